@@ -345,6 +345,7 @@ def load_retriever():
     try:
         from rag_retriever import RAGRetriever
         retriever = RAGRetriever()
+        retriever.warm_up()
         return retriever
     except Exception as e:
         st.error(f"Error loading RAG retriever: {str(e)}")
@@ -359,21 +360,8 @@ def search_documents_improved(query, retriever, top_k=4):
         # Use enhanced retriever with optimized threshold for quality results
         results = retriever.search(query, top_k=top_k * 2, similarity_threshold=0.15)
         
-        # Quality filtering: ensure we have meaningful results
-        quality_results = []
-        for result in results:
-            # Filter out very low-quality matches
-            if result['similarity'] >= 0.25:
-                formatted_result = {
-                    "text": result['content'],
-                    "source": result['category'],
-                    "distance": 1.0 - result['similarity'],
-                    "similarity": result['similarity'],
-                    "rerank_score": result['similarity'],
-                    "semantic_score": result.get('semantic_score', 0.0),
-                    "keyword_score": result.get('keyword_score', 0.0)
-                }
-                quality_results.append(formatted_result)
+        # Quality filtering: filter out very low-quality matches
+        quality_results = [result for result in results if result.similarity >= 0.25]
         
         # Return top results, ensuring we have at least some context
         return quality_results[:top_k] if quality_results else results[:top_k]
@@ -689,18 +677,18 @@ for i, message in enumerate(st.session_state.messages):
             with st.expander("📚 View Source Information", expanded=False):  # Collapsed by default
                 if message_context:
                     for j, context in enumerate(message_context):
-                        semantic_score = context.get('semantic_score', 0.0)
-                        keyword_score = context.get('keyword_score', 0.0)
+                        semantic_score = context.semantic_score
+                        keyword_score = context.keyword_score
                         
                         st.markdown(f"""
                         <div style="background: white; border-radius: 10px; padding: 1.2rem; 
                                     margin-bottom: 1.2rem; border: 2px solid rgba(171, 35, 40, 0.2);">
-                            <h4 style="margin-top: 0; color: rgb(171, 35, 40); font-size: 1.1rem; font-weight: 600;">{context['source']}</h4>
+                            <h4 style="margin-top: 0; color: rgb(171, 35, 40); font-size: 1.1rem; font-weight: 600;">{context.category}</h4>
                             <div style="display: flex; gap: 1rem; margin-bottom: 0.8rem;">
                                 <span style="display: inline-block; background: rgba(171, 35, 40, 0.15); 
                                             color: rgb(171, 35, 40); border-radius: 999px; padding: 0.3rem 0.8rem;
                                             font-size: 0.85rem; font-weight: 600;">
-                                    Overall: {context['similarity']:.2f}
+                                    Overall: {context.similarity:.2f}
                                 </span>
                                 <span style="display: inline-block; background: rgba(34, 139, 34, 0.15); 
                                             color: rgb(34, 139, 34); border-radius: 999px; padding: 0.3rem 0.8rem;
@@ -718,7 +706,7 @@ for i, message in enumerate(st.session_state.messages):
                         
                         # Use a cleaner text area without tooltips
                         st.text_area("Source Content", 
-                                     context["text"], 
+                                     context.content, 
                                      height=120, 
                                      key=f"ctx_msg_{i}_{j}")
                         
@@ -791,7 +779,7 @@ The knowledge base is not accessible. This usually means:
             st.session_state.context_data = context_data
             
             # Prepare context for the LLM
-            context_texts = [item["text"] for item in context_data]
+            context_texts = [item.content for item in context_data]
             context_str = "\n\n".join(context_texts)
             
             # Prepare messages for the LLM - SAMPLE QUESTION PROCESSING
@@ -871,7 +859,7 @@ The knowledge base is not accessible. This usually means:
             st.session_state.context_data = context_data
             
             # Prepare context for the LLM
-            context_texts = [item["text"] for item in context_data]
+            context_texts = [item.content for item in context_data]
             context_str = "\n\n".join(context_texts)
             
             # Prepare messages for the LLM - USER INPUT PROCESSING
@@ -57,7 +57,7 @@ class HealthcareAgent:
             )
             
             # Prepare context for the LLM
-            context_texts = [item["content"] for item in context_data]
+            context_texts = [item.content for item in context_data]
             context_str = "\n\n".join(context_texts)
             
             # Prepare messages for the LLM
@@ -12,6 +12,7 @@ class Config:
     
     # Model settings
     LLM_MODEL = os.environ.get('LLM_MODEL', 'google/gemma-3-27b-it:free')
+    EMBEDDING_MODEL = os.environ.get('EMBEDDING_MODEL', 'all-MiniLM-L6-v2')
     
     # Data directories
     DOCS_DIR = os.environ.get('DOCS_DIR', 'docs')
@@ -33,4 +34,75 @@ class Config:
     CHUNK_SIZE = int(os.environ.get('CHUNK_SIZE', 200))
     OVERLAP_SIZE = int(os.environ.get('OVERLAP_SIZE', 50))
     TOP_K_RESULTS = int(os.environ.get('TOP_K_RESULTS', 4))
-    SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD', 0.15))
\ No newline at end of file
+    SIMILARITY_THRESHOLD = float(os.environ.get('SIMILARITY_THRESHOLD', 0.15))
+    
+    # Vector index settings ('exact', 'flat', 'ivf', 'hnsw', or 'stream' for exact search over files larger than RAM)
+    INDEX_TYPE = os.environ.get('INDEX_TYPE', 'flat')
+    IVF_NLIST = int(os.environ.get('IVF_NLIST', 0))  # 0 = sqrt(number of chunks)
+    IVF_NPROBE = int(os.environ.get('IVF_NPROBE', 8))
+    HNSW_M = int(os.environ.get('HNSW_M', 32))
+    HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', 64))
+    STREAM_BLOCK_ROWS = int(os.environ.get('STREAM_BLOCK_ROWS', 16384))  # rows read per block by 'stream'
+    
+    # Query embedding cache (size 0 disables it, TTL 0 never expires)
+    QUERY_CACHE_SIZE = int(os.environ.get('QUERY_CACHE_SIZE', 1024))
+    QUERY_CACHE_TTL = float(os.environ.get('QUERY_CACHE_TTL', 3600))
+    
+    # Query expansion rules (JSON object of term -> expansion)
+    QUERY_EXPANSIONS_FILE = os.environ.get('QUERY_EXPANSIONS_FILE', os.path.join(DATA_DIR, 'query_expansions.json'))
+    
+    # BM25 keyword search parameters
+    BM25_K1 = float(os.environ.get('BM25_K1', 1.2))
+    BM25_B = float(os.environ.get('BM25_B', 0.75))
+    
+    # Memory-map embeddings and read chunk text lazily (lower, shared memory per worker)
+    MMAP_EMBEDDINGS = os.environ.get('MMAP_EMBEDDINGS', 'False').lower() == 'true'
+    
+    # Quantized first-pass scan ('none', 'float16' or 'int8'), rescored in float32
+    EMBEDDING_QUANTIZATION = os.environ.get('EMBEDDING_QUANTIZATION', 'none')
+    RESCORE_FACTOR = int(os.environ.get('RESCORE_FACTOR', 4))  # shortlist size = top_k * factor
+    
+    # Result fusion ('weighted' sum with consensus boost, or reciprocal rank fusion 'rrf')
+    FUSION_STRATEGY = os.environ.get('FUSION_STRATEGY', 'weighted')
+    RRF_K = int(os.environ.get('RRF_K', 60))
+    
+    # Search result cache, invalidated whenever the knowledge base generation changes
+    RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', 512))
+    
+    # Encoder backend for query and chunk embeddings ('torch' or 'onnx' via onnxruntime)
+    ENCODER_BACKEND = os.environ.get('ENCODER_BACKEND', 'torch')
+    ONNX_MODEL_DIR = os.environ.get('ONNX_MODEL_DIR', os.path.join(DATA_DIR, 'models', 'onnx'))
+    ONNX_QUANTIZED = os.environ.get('ONNX_QUANTIZED', 'False').lower() == 'true'  # int8 dynamic quantization
+    ONNX_NUM_THREADS = int(os.environ.get('ONNX_NUM_THREADS', 0))  # 0 = onnxruntime default
+    
+    # Ingest-time embedding: chunks per forward pass, and encoder processes for large rebuilds
+    # (0 or 1 encodes in-process; workers only start when each gets several batches)
+    EMBED_BATCH_SIZE = int(os.environ.get('EMBED_BATCH_SIZE', 64))
+    EMBED_WORKERS = int(os.environ.get('EMBED_WORKERS', 0))
+    # Content-hash embedding cache: unchanged chunk text is never re-encoded (empty disables it)
+    EMBEDDING_CACHE_DIR = os.environ.get('EMBEDDING_CACHE_DIR', os.path.join(DATA_DIR, 'embedding_cache'))
+    # Entries kept when the cache shards are merged, least recently used dropped first (0 = unbounded)
+    EMBEDDING_CACHE_MAX_ENTRIES = int(os.environ.get('EMBEDDING_CACHE_MAX_ENTRIES', 500000))
+    
+    # Sharded retrieval: split the corpus into row ranges searched in parallel (1 disables sharding)
+    NUM_SHARDS = int(os.environ.get('NUM_SHARDS', 1))
+    SHARD_WORKERS = int(os.environ.get('SHARD_WORKERS', 0))  # 0 = one thread per shard
+    
+    # Near-duplicate chunks (MinHash/LSH) are collapsed at ingest; threshold is the
+    # estimated Jaccard similarity of word 5-gram shingles (0 disables detection)
+    DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', 0.8))
+    MINHASH_PERMUTATIONS = int(os.environ.get('MINHASH_PERMUTATIONS', 128))
+    MINHASH_BANDS = int(os.environ.get('MINHASH_BANDS', 16))  # must divide MINHASH_PERMUTATIONS
+    
+    # Uploads are appended as immutable segments and deletes as tombstones; a background
+    # compactor merges segments once there are this many, and rewrites the base once
+    # segment rows plus tombstones reach COMPACT_RATIO of the base
+    SEGMENT_MERGE_THRESHOLD = int(os.environ.get('SEGMENT_MERGE_THRESHOLD', 8))
+    COMPACT_RATIO = float(os.environ.get('COMPACT_RATIO', 0.1))
+    
+    # Startup check of the knowledge base manifest: 'fast' (file sizes, .npy shapes, model name),
+    # 'full' (also sha256 of every data file) or 'off'
+    KB_VERIFY = os.environ.get('KB_VERIFY', 'fast')
+    
+    # Per-stage search latency: recent samples kept per stage for p50/p95/p99 (0 disables)
+    LATENCY_WINDOW = int(os.environ.get('LATENCY_WINDOW', 2048))
\ No newline at end of file
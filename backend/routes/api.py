@@ -25,6 +25,7 @@ def initialize_components():
     global retriever, agent
     try:
         retriever = RAGRetriever()
+        retriever.warm_up()
         agent = HealthcareAgent(retriever)
         current_app.logger.info("RAG retriever and agent initialized successfully")
     except Exception as e:
@@ -83,7 +84,7 @@ def chat():
         
         return jsonify({
             'response': response.get('response', ''),
-            'context': response.get('context', []),
+            'context': [item.to_dict() for item in response.get('context', [])],
             'query': response.get('query', user_input),
             'timestamp': datetime.utcnow().isoformat()
         }), 200
@@ -150,6 +151,9 @@ def upload_document():
             
             if add_result.get('status') == 'success':
                 current_app.logger.info("Document uploaded and added to knowledge base successfully")
+                if retriever is not None:
+                    # Load the new generation in the background; searches keep using the old one meanwhile
+                    retriever.reload()
                 return jsonify({
                     'message': 'Document uploaded and added to knowledge base successfully',
                     'result': add_result,
@@ -175,6 +179,39 @@ def upload_document():
             'message': str(e)
         }), 500
 
+# Document deletion endpoint
+@api_bp.route('/documents/<path:source_name>', methods=['DELETE'])
+def delete_document(source_name):
+    """Remove an uploaded document's chunks from the knowledge base."""
+    try:
+        current_app.logger.info(f"Processing delete request: {source_name}")
+        
+        loader = DocumentLoader()
+        delete_result = loader.delete_from_knowledge_base(source_name)
+        
+        if delete_result.get('status') == 'success':
+            current_app.logger.info("Document deleted from knowledge base successfully")
+            if retriever is not None:
+                retriever.reload()
+            return jsonify({
+                'message': 'Document deleted from knowledge base successfully',
+                'result': delete_result,
+                'timestamp': datetime.utcnow().isoformat()
+            }), 200
+        else:
+            current_app.logger.warning(f"Error deleting document: {delete_result.get('error')}")
+            return jsonify({
+                'error': 'Failed to delete document',
+                'message': delete_result.get('error', 'Unknown error')
+            }), 404
+
+    except Exception as e:
+        current_app.logger.error(f"Error in delete endpoint: {e}", exc_info=True)
+        return jsonify({
+            'error': 'Internal server error',
+            'message': str(e)
+        }), 500
+
 # Document summarization endpoint
 @api_bp.route('/summarize', methods=['POST'])
 def summarize_document():
@@ -278,6 +315,18 @@ def search_documents():
             return jsonify({'error': 'No query provided'}), 400
         
         top_k = data.get('top_k', 4)
+        if not isinstance(top_k, int) or isinstance(top_k, bool) or top_k < 1:
+            current_app.logger.warning("Invalid top_k in search request")
+            return jsonify({'error': 'top_k must be a positive integer'}), 400
+        
+        # Optional category filter, a category name or a list of them
+        categories = data.get('categories')
+        if isinstance(categories, str):
+            categories = [categories]
+        if categories is not None and not (
+                isinstance(categories, list) and all(isinstance(c, str) for c in categories)):
+            current_app.logger.warning("Invalid categories filter in search request")
+            return jsonify({'error': 'categories must be a string or a list of strings'}), 400
         
         if retriever is None:
             current_app.logger.error("Retriever not initialized")
@@ -288,16 +337,20 @@ def search_documents():
         
         current_app.logger.info(f"Processing search request: {query}")
         
-        # Search for relevant documents
-        results = retriever.search(query, top_k=top_k)
+        # Search for relevant documents, with per-stage timings when debugging
+        timings = {} if data.get('debug') else None
+        results = retriever.search(query, top_k=top_k, categories=categories, timings=timings)
         
         current_app.logger.info(f"Search request processed successfully, found {len(results)} results")
         
-        return jsonify({
-            'results': results,
+        response = {
+            'results': [result.to_dict() for result in results],
             'query': query,
             'timestamp': datetime.utcnow().isoformat()
-        }), 200
+        }
+        if timings is not None:
+            response['timings'] = {stage: round(ms, 3) for stage, ms in timings.items()}
+        return jsonify(response), 200
         
     except Exception as e:
         current_app.logger.error(f"Error in search endpoint: {e}", exc_info=True)
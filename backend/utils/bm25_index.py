@@ -0,0 +1,380 @@
+import re
+from collections import Counter
+from functools import lru_cache
+from pathlib import Path
+from typing import Dict, FrozenSet, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from backend.utils.streaming_writer import temporary_path
+from backend.utils.vector_index import top_k_indices
+
+# Same tokenization the TF-IDF keyword search used: alphanumeric tokens starting with a letter
+TOKEN_PATTERN = re.compile(r'\b[a-zA-Z][a-zA-Z0-9]*\b')
+
+
+@lru_cache(maxsize=1)
+def _stop_words() -> FrozenSet[str]:
+    """English stop words (imported lazily, sklearn is slow to import)."""
+    from sklearn.feature_extraction.text import ENGLISH_STOP_WORDS
+    return frozenset(ENGLISH_STOP_WORDS)
+
+
+def tokenize(text: str) -> List[str]:
+    """Lowercase unigrams and bigrams with English stop words removed."""
+    stop_words = _stop_words()
+    words = [w for w in TOKEN_PATTERN.findall(text.lower()) if w not in stop_words]
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+def bm25_index_path(data_dir: Path) -> Path:
+    """Location of the persisted keyword index, next to metadata.json."""
+    return Path(data_dir) / "bm25_index.npz"
+
+
+def term_counts_path(data_dir: Path) -> Path:
+    """Location of the persisted raw term counts, next to metadata.json."""
+    return Path(data_dir) / "term_counts.npz"
+
+
+class TermCounts(NamedTuple):
+    """Raw term frequencies of a document range, in CSR layout; BM25 impacts are derived from these."""
+    terms: List[str]
+    offsets: np.ndarray  # term i owns postings offsets[i]:offsets[i + 1]
+    doc_ids: np.ndarray  # document ids local to the range, sorted within each term
+    tfs: np.ndarray  # term frequency of each posting
+    doc_lengths: np.ndarray  # tokens per document
+
+    @classmethod
+    def count(cls, texts: List[str]) -> 'TermCounts':
+        """Tokenize and count a list of documents (list position is the document id)."""
+        postings: Dict[str, List[Tuple[int, int]]] = {}
+        doc_lengths = np.zeros(len(texts), dtype=np.float32)
+
+        for doc_id, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            doc_lengths[doc_id] = sum(counts.values())
+            for term, tf in counts.items():
+                postings.setdefault(term, []).append((doc_id, tf))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        entries = np.array([entry for term in terms for entry in postings[term]], dtype=np.int64).reshape(-1, 2)
+        return cls(terms, offsets, entries[:, 0].astype(np.int32), entries[:, 1].astype(np.int32), doc_lengths)
+
+    @classmethod
+    def concat(cls, parts: List['TermCounts']) -> 'TermCounts':
+        """Counts of consecutive document ranges as one range, postings regrouped by term."""
+        terms = sorted(set().union(*(part.terms for part in parts)))
+        vocabulary = np.array(terms, dtype=str)
+
+        term_ids, doc_ids, tfs = [np.empty(0, dtype=np.int64)], [np.empty(0, dtype=np.int64)], []
+        doc_offset = 0
+        for part in parts:
+            if len(part.terms):
+                local_ids = np.searchsorted(vocabulary, np.array(part.terms, dtype=str))
+                term_ids.append(np.repeat(local_ids, np.diff(part.offsets)))
+                doc_ids.append(part.doc_ids.astype(np.int64) + doc_offset)
+                tfs.append(part.tfs)
+            doc_offset += len(part.doc_lengths)
+
+        term_ids = np.concatenate(term_ids)
+        # Stable: parts are in document order and each part's postings are sorted by document
+        order = np.argsort(term_ids, kind='stable')
+        offsets = np.zeros(len(terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(np.bincount(term_ids, minlength=len(terms)))
+        return cls(terms, offsets, np.concatenate(doc_ids)[order].astype(np.int32),
+                   np.concatenate(tfs or [np.empty(0, dtype=np.int32)])[order].astype(np.int32),
+                   np.concatenate([part.doc_lengths for part in parts] or [np.empty(0)]).astype(np.float32))
+
+    def select(self, rows: np.ndarray) -> 'TermCounts':
+        """Counts of the given documents only, renumbered 0..len(rows) - 1 in the given order."""
+        rows = np.asarray(rows, dtype=np.int64)
+        new_ids = np.full(len(self.doc_lengths), -1, dtype=np.int64)
+        new_ids[rows] = np.arange(len(rows))
+        keep = new_ids[self.doc_ids] >= 0
+        kept_per_term = np.add.reduceat(keep.astype(np.int64), self.offsets[:-1]) if len(self.terms) else []
+        offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum(kept_per_term)
+        doc_ids, tfs = new_ids[self.doc_ids[keep]], self.tfs[keep]
+
+        # Re-sort each term's postings by new id and drop terms that lost every posting
+        term_of = np.repeat(np.arange(len(self.terms)), np.diff(offsets))
+        order = np.lexsort((doc_ids, term_of))
+        present = np.diff(offsets) > 0
+        new_offsets = np.zeros(int(present.sum()) + 1, dtype=np.int64)
+        new_offsets[1:] = np.cumsum(np.diff(offsets)[present])
+        return TermCounts([term for term, alive in zip(self.terms, present) if alive], new_offsets,
+                          doc_ids[order].astype(np.int32), tfs[order], self.doc_lengths[rows])
+
+    def save(self, path: Path):
+        """Persist the counts as a compressed .npz archive (written to a temporary name and renamed)."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = temporary_path(path)
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(f, terms=np.array(self.terms, dtype=str), offsets=self.offsets,
+                                doc_ids=self.doc_ids, tfs=self.tfs, doc_lengths=self.doc_lengths)
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['TermCounts']:
+        """Load persisted counts, or return None if the file does not exist."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            return cls(data['terms'].tolist(), data['offsets'], data['doc_ids'],
+                       data['tfs'], data['doc_lengths'])
+
+
+def _empty_result() -> Tuple[np.ndarray, np.ndarray]:
+    return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+
+
+class BM25Index:
+    """Inverted index with precomputed BM25 impacts and MaxScore top-k pruning."""
+
+    def __init__(self, terms: List[str], offsets: np.ndarray, doc_ids: np.ndarray,
+                 impacts: np.ndarray, num_docs: int, max_impacts: Optional[np.ndarray] = None,
+                 vocabulary: Optional[Dict[str, int]] = None):
+        """
+        Wrap posting lists stored in CSR layout.
+
+        Args:
+            terms: Vocabulary, term i owns postings offsets[i]:offsets[i + 1]
+            offsets: Posting list boundaries, shape (len(terms) + 1,)
+            doc_ids: Document (row) ids of all postings, sorted within each list
+            impacts: BM25 contribution of the term to each posting's document
+            num_docs: Number of documents in the collection
+            max_impacts: Per-term score upper bounds (computed from impacts if omitted)
+            vocabulary: Term -> id map to share with another index over the same terms
+        """
+        self.terms = list(terms)
+        self.vocabulary: Dict[str, int] = vocabulary or {term: i for i, term in enumerate(self.terms)}
+        self.offsets = offsets.astype(np.int64)
+        self.doc_ids = doc_ids.astype(np.int32)
+        self.impacts = impacts.astype(np.float32)
+        self.num_docs = int(num_docs)
+
+        # Upper bound of each term's contribution, used for MaxScore pruning
+        if max_impacts is not None:
+            self.max_impacts = max_impacts
+        elif len(self.terms):
+            self.max_impacts = np.maximum.reduceat(self.impacts, self.offsets[:-1])
+        else:
+            self.max_impacts = np.empty(0, dtype=np.float32)
+
+        self._matrix = None  # term x document sparse matrix, built on first batch query
+
+    @classmethod
+    def build(cls, texts: List[str], k1: float = 1.2, b: float = 0.75) -> 'BM25Index':
+        """
+        Index a list of documents.
+
+        Args:
+            texts: Document texts, list position is the document id
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalization
+
+        Returns:
+            The built index
+        """
+        return cls.from_counts([TermCounts.count(texts)], k1=k1, b=b)
+
+    @classmethod
+    def from_counts(cls, parts: List['TermCounts'], k1: float = 1.2, b: float = 0.75) -> 'BM25Index':
+        """
+        Score raw term counts of consecutive document ranges as one collection.
+
+        Document frequencies and the average length are taken over all parts, so
+        the impacts are the same as indexing the concatenated texts with build().
+
+        Args:
+            parts: Term counts, part i's documents follow those of part i - 1
+            k1: BM25 term frequency saturation
+            b: BM25 document length normalization
+
+        Returns:
+            The built index
+        """
+        counts = TermCounts.concat(parts)
+        num_docs = len(counts.doc_lengths)
+        doc_lengths = counts.doc_lengths
+        avg_length = float(doc_lengths.mean()) if num_docs and doc_lengths.mean() > 0 else 1.0
+
+        df = np.diff(counts.offsets)
+        term_ids = np.repeat(np.arange(len(counts.terms)), df)
+        ids, tf = counts.doc_ids, counts.tfs.astype(np.float64)
+
+        posting_df = df[term_ids]
+        idf = np.log(1.0 + (num_docs - posting_df + 0.5) / (posting_df + 0.5))
+        norm = k1 * (1.0 - b + b * doc_lengths[ids] / avg_length)
+        impacts = idf * tf * (k1 + 1.0) / (tf + norm)
+
+        return cls(counts.terms, counts.offsets, ids, impacts.astype(np.float32), num_docs)
+
+    def save(self, path: Path):
+        """Persist the posting lists as a compressed .npz archive."""
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = temporary_path(path)
+        with open(tmp_path, 'wb') as f:
+            np.savez_compressed(
+                f,
+                terms=np.array(self.terms, dtype=str),
+                offsets=self.offsets,
+                doc_ids=self.doc_ids,
+                impacts=self.impacts,
+                num_docs=np.array(self.num_docs)
+            )
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path) -> Optional['BM25Index']:
+        """Load a persisted index, or return None if the file does not exist."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        with np.load(path) as data:
+            return cls(data['terms'].tolist(), data['offsets'], data['doc_ids'],
+                       data['impacts'], int(data['num_docs']))
+
+    def split(self, bounds: np.ndarray) -> List['BM25Index']:
+        """
+        Split the posting lists into shards over contiguous document ranges.
+
+        Shards keep global document ids and the global per-term upper bounds, so
+        scores (and their normalization) are identical to this index's.
+
+        Args:
+            bounds: Shard boundaries in document ids, shape (n_shards + 1,)
+
+        Returns:
+            One index per shard
+        """
+        shards = []
+        for start, end in zip(bounds[:-1], bounds[1:]):
+            keep = (self.doc_ids >= start) & (self.doc_ids < end)
+            offsets = np.zeros(len(self.terms) + 1, dtype=np.int64)
+            if len(self.terms):
+                offsets[1:] = np.cumsum(np.add.reduceat(keep.astype(np.int64), self.offsets[:-1]))
+            shards.append(BM25Index(self.terms, offsets, self.doc_ids[keep], self.impacts[keep],
+                                    self.num_docs, max_impacts=self.max_impacts,
+                                    vocabulary=self.vocabulary))
+        return shards
+
+    def _query_terms(self, query: str) -> np.ndarray:
+        """Vocabulary ids of the distinct query terms."""
+        ids = {self.vocabulary[term] for term in tokenize(query) if term in self.vocabulary}
+        return np.fromiter(ids, dtype=np.int64, count=len(ids))
+
+    def _postings(self, term_id: int) -> Tuple[np.ndarray, np.ndarray]:
+        start, end = self.offsets[term_id], self.offsets[term_id + 1]
+        return self.doc_ids[start:end], self.impacts[start:end]
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Top-k documents for a query using term-at-a-time MaxScore.
+
+        Terms are processed by decreasing upper bound. Once the remaining terms
+        cannot lift an unseen document above the current k-th best score, their
+        posting lists are only probed for documents that are already candidates,
+        and candidates that cannot reach the threshold are dropped.
+
+        Args:
+            query: Query text
+            k: Number of documents to return
+            allowed: Boolean mask over documents; others are never scored (None allows all)
+
+        Returns:
+            Tuple of (doc_ids, scores), best first. Scores are divided by the
+            query's maximum attainable score so they fall in [0, 1].
+        """
+        term_ids = self._query_terms(query)
+        if not len(term_ids) or k <= 0:
+            return _empty_result()
+
+        upper_bounds = self.max_impacts[term_ids]
+        order = np.argsort(-upper_bounds, kind='stable')
+        term_ids, upper_bounds = term_ids[order], upper_bounds[order]
+        remaining_bound = np.concatenate([np.cumsum(upper_bounds[::-1])[::-1], [0.0]])
+
+        candidates = np.empty(0, dtype=np.int32)
+        scores = np.empty(0, dtype=np.float32)
+
+        for i, term_id in enumerate(term_ids):
+            threshold = np.partition(scores, -k)[-k] if len(scores) >= k else 0.0
+            docs, impacts = self._postings(term_id)
+
+            if remaining_bound[i] > threshold:
+                # Essential term: new documents can still enter the top-k, merge the whole list
+                if allowed is not None:
+                    keep = allowed[docs]
+                    docs, impacts = docs[keep], impacts[keep]
+                merged = np.concatenate([candidates, docs])
+                candidates, inverse = np.unique(merged, return_inverse=True)
+                scores = np.bincount(inverse, weights=np.concatenate([scores, impacts]),
+                                     minlength=len(candidates)).astype(np.float32)
+            else:
+                # Non-essential term: drop hopeless candidates, then probe only the survivors
+                alive = scores + remaining_bound[i] > threshold
+                candidates, scores = candidates[alive], scores[alive]
+                positions = np.searchsorted(docs, candidates)
+                positions[positions == len(docs)] = 0
+                found = docs[positions] == candidates
+                scores[found] += impacts[positions[found]]
+
+        best = top_k_indices(scores[np.newaxis, :], k)[0]
+        return candidates[best].astype(np.int64), scores[best] / remaining_bound[0]
+
+    def search_batch(self, queries: List[str], k: int,
+                     allowed: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """
+        Top-k documents for several queries.
+
+        A single query uses the pruned search(); several queries are scored with
+        one sparse (queries x terms) @ (terms x documents) product.
+
+        Args:
+            queries: Query texts
+            k: Number of documents to return per query
+            allowed: Boolean mask over documents; others are never returned (None allows all)
+
+        Returns:
+            One (doc_ids, scores) tuple per query, as returned by search()
+        """
+        if len(queries) == 1:
+            return [self.search(queries[0], k, allowed)]
+
+        from scipy.sparse import csr_matrix
+
+        if self._matrix is None:
+            self._matrix = csr_matrix((self.impacts, self.doc_ids, self.offsets),
+                                      shape=(len(self.terms), self.num_docs))
+
+        rows, cols = [], []
+        for row, query in enumerate(queries):
+            term_ids = self._query_terms(query)
+            rows.extend([row] * len(term_ids))
+            cols.extend(term_ids.tolist())
+        query_matrix = csr_matrix((np.ones(len(cols), dtype=np.float32), (rows, cols)),
+                                  shape=(len(queries), len(self.terms)))
+
+        bounds = query_matrix @ self.max_impacts
+        scores = (query_matrix @ self._matrix).tocsr()
+
+        results = []
+        for row in range(len(queries)):
+            start, end = scores.indptr[row], scores.indptr[row + 1]
+            if start == end or k <= 0:
+                results.append(_empty_result())
+                continue
+            docs, row_scores = scores.indices[start:end], scores.data[start:end]
+            if allowed is not None:
+                keep = allowed[docs]
+                docs, row_scores = docs[keep], row_scores[keep]
+            best = top_k_indices(row_scores[np.newaxis, :], k)[0]
+            results.append((docs[best].astype(np.int64), row_scores[best] / bounds[row]))
+        return results
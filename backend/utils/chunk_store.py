@@ -0,0 +1,193 @@
+import json
+import mmap
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+
+from backend.utils.streaming_writer import temporary_path
+
+
+def chunk_store_paths(data_dir: Path):
+    """Locations of the chunk text blob (JSON Lines) and its offset index."""
+    data_dir = Path(data_dir)
+    return data_dir / "chunks.jsonl", data_dir / "chunks_index.npz"
+
+
+class ChunkStore:
+    """Chunk records addressed by row, held in memory or read lazily from an offset-indexed blob."""
+
+    def __init__(self, categories: List[str], chunk_ids: List[str],
+                 records: Optional[List[Dict]] = None, blob=None, offsets: Optional[np.ndarray] = None):
+        """
+        Initialize the store. Use from_records() or open() rather than calling this directly.
+
+        Args:
+            categories: Category of each row
+            chunk_ids: Chunk id of each row
+            records: Full chunk dicts when held in memory
+            blob: Memory-mapped JSON Lines file when reading lazily
+            offsets: Byte offset of each line in blob, shape (n_rows + 1,)
+        """
+        self.categories = categories
+        self.chunk_ids = chunk_ids
+        self._records = records
+        self._blob = blob
+        self._offsets = offsets
+
+    @classmethod
+    def from_records(cls, records: List[Dict]) -> 'ChunkStore':
+        """Keep fully loaded chunk dicts in memory."""
+        return cls(
+            [record.get('category', 'unknown') for record in records],
+            [record.get('chunk_id', '') for record in records],
+            records=records
+        )
+
+    @staticmethod
+    def write(records: Iterable[Dict], data_dir: Path):
+        """
+        Write chunk records as JSON Lines plus an index of line offsets.
+
+        Args:
+            records: Chunk dicts in row order
+            data_dir: Directory to write chunks.jsonl and chunks_index.npz into
+        """
+        with ChunkStoreWriter(data_dir) as writer:
+            for record in records:
+                writer.write(record)
+
+    @classmethod
+    def open(cls, data_dir: Path) -> Optional['ChunkStore']:
+        """
+        Memory-map a written store. Only categories, chunk ids and offsets are loaded.
+
+        Args:
+            data_dir: Directory containing chunks.jsonl and chunks_index.npz
+
+        Returns:
+            The store, or None if the files do not exist
+        """
+        blob_path, index_path = chunk_store_paths(data_dir)
+        if not blob_path.exists() or not index_path.exists():
+            return None
+
+        with np.load(index_path) as index:
+            offsets = index['offsets']
+            categories = index['categories'].tolist()
+            chunk_ids = index['chunk_ids'].tolist()
+
+        blob = b''
+        if offsets[-1] > 0:
+            with open(blob_path, 'rb') as f:
+                # The mapping stays valid after the file object is closed
+                blob = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(categories, chunk_ids, blob=blob, offsets=offsets)
+
+    @property
+    def lazy(self) -> bool:
+        return self._records is None
+
+    def __len__(self) -> int:
+        return len(self.categories)
+
+    def __bool__(self) -> bool:
+        return len(self) > 0
+
+    def __getitem__(self, row: int) -> Dict:
+        """Full chunk dict for a row (read from disk in lazy mode)."""
+        if self._records is not None:
+            return self._records[row]
+        start, end = self._offsets[row], self._offsets[row + 1]
+        return json.loads(self._blob[start:end])
+
+    def __iter__(self) -> Iterator[Dict]:
+        for row in range(len(self)):
+            yield self[row]
+
+    def close(self):
+        """Release the memory map."""
+        if isinstance(self._blob, mmap.mmap):
+            self._blob.close()
+
+
+class ChunkStoreWriter:
+    """Streams chunk records into a chunk store, so records never accumulate in memory."""
+
+    def __init__(self, data_dir: Path):
+        """
+        Open the blob (both files are written under temporary names and renamed on close).
+
+        Args:
+            data_dir: Directory to write chunks.jsonl and chunks_index.npz into
+        """
+        self.blob_path, self.index_path = chunk_store_paths(data_dir)
+        self.blob_path.parent.mkdir(parents=True, exist_ok=True)
+        self._tmp_blob = temporary_path(self.blob_path)
+        self._file = open(self._tmp_blob, 'wb')
+        self._offsets = [0]
+        self._categories: List[str] = []
+        self._chunk_ids: List[str] = []
+
+    def write(self, record: Dict):
+        """Append one record as the next row."""
+        self._file.write(json.dumps(record, ensure_ascii=False).encode('utf-8') + b'\n')
+        self._offsets.append(self._file.tell())
+        self._categories.append(record.get('category', 'unknown'))
+        self._chunk_ids.append(record.get('chunk_id', ''))
+
+    def close(self):
+        """Write the offset index and publish both files."""
+        self._file.close()
+        tmp_index = temporary_path(self.index_path)
+        with open(tmp_index, 'wb') as f:
+            np.savez(
+                f,
+                offsets=np.array(self._offsets, dtype=np.int64),
+                categories=np.array(self._categories, dtype=str),
+                chunk_ids=np.array(self._chunk_ids, dtype=str)
+            )
+
+        # Blob first: an index is never published before the lines it points to
+        self._tmp_blob.replace(self.blob_path)
+        tmp_index.replace(self.index_path)
+
+    def abort(self):
+        """Discard a partially written store."""
+        self._file.close()
+        self._tmp_blob.unlink(missing_ok=True)
+
+    def __enter__(self) -> 'ChunkStoreWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class SegmentedChunkStore(ChunkStore):
+    """Several chunk stores addressed as one, with rows numbered across them in order."""
+
+    def __init__(self, parts: List[ChunkStore]):
+        """
+        Args:
+            parts: Stores of consecutive row ranges (the base, then each segment)
+        """
+        super().__init__([category for part in parts for category in part.categories],
+                         [chunk_id for part in parts for chunk_id in part.chunk_ids])
+        self.parts = parts
+        self.bounds = np.cumsum([0] + [len(part) for part in parts])
+
+    @property
+    def lazy(self) -> bool:
+        return any(part.lazy for part in self.parts)
+
+    def __getitem__(self, row: int) -> Dict:
+        part = int(np.searchsorted(self.bounds, row, side='right')) - 1
+        return self.parts[part][row - int(self.bounds[part])]
+
+    def close(self):
+        for part in self.parts:
+            part.close()
@@ -312,17 +312,16 @@ class DocumentLoader:
             from utils.generate_embeddings import EmbeddingGenerator
             import json
             import numpy as np
+            from backend.config import Config
+            from backend.utils.segments import append_segment, find_layout_duplicates, minhash_index
             
             # Create a temporary directory for processing
             import tempfile
-            import shutil
             
             with tempfile.TemporaryDirectory() as temp_dir:
                 # Save content to a temporary file
                 # Sanitize filename
-                safe_source_name = "".join(c for c in source_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
-                if not safe_source_name:
-                    safe_source_name = "unnamed_document"
+                safe_source_name = self._safe_source_name(source_name)
                     
                 temp_file_path = os.path.join(temp_dir, f"{safe_source_name}.txt")
                 with open(temp_file_path, 'w', encoding='utf-8') as f:
@@ -343,8 +342,59 @@ class DocumentLoader:
                         "message": "Failed to process document into chunks"
                     }
                 
+                # The main knowledge base (the directory the retriever loads from)
+                main_faiss_dir = Config.EMBEDDINGS_DIR
+                
+                # Collapse near-duplicates (re-uploads, re-scraped pages) before they are embedded
+                dedup_report = None
+                lsh = minhash_index(Config)
+                if lsh is not None:
+                    # Existing rows are the base and then each segment, as numbered in one manifest
+                    new_signatures = lsh.signatures(documents)
+                    matches, offset, existing_names = find_layout_duplicates(main_faiss_dir, new_signatures, Config)
+                    
+                    duplicate_rows = {match.row - offset for match in matches}
+                    for row in duplicate_rows:
+                        os.remove(metadata[row]['chunk_file'])
+                    
+                    kept = [i for i in range(len(documents)) if i not in duplicate_rows]
+                    kept_signatures = {metadata[i]['chunk_file']: new_signatures[i] for i in kept}
+                    dedup_report = {
+                        "chunks_in_document": len(documents),
+                        "duplicates_removed": len(matches),
+                        "shrink_ratio": round(len(matches) / len(documents), 4),
+                        "duplicates": [
+                            {
+                                "chunk_file": os.path.relpath(metadata[match.row - offset]['chunk_file'], chunks_dir),
+                                "duplicate_of": self._describe_row(match.duplicate_of, existing_names,
+                                                                   metadata, offset, chunks_dir),
+                                "similarity": round(match.similarity, 3)
+                            }
+                            for match in matches
+                        ]
+                    }
+                    self.logger.info(f"Near-duplicate detection removed {len(matches)} of {len(documents)} "
+                                     f"chunks from {source_name}")
+                    
+                    if not kept:
+                        return {
+                            "status": "success",
+                            "chunks_created": 0,
+                            "deduplication": dedup_report,
+                            "message": "All chunks are near-duplicates of the knowledge base; nothing was added"
+                        }
+                
                 # Generate embeddings for chunks
-                embedding_generator = EmbeddingGenerator()
+                embedding_generator = EmbeddingGenerator(
+                    Config.EMBEDDING_MODEL,
+                    backend=Config.ENCODER_BACKEND,
+                    onnx_dir=Config.ONNX_MODEL_DIR,
+                    quantized=Config.ONNX_QUANTIZED,
+                    batch_size=Config.EMBED_BATCH_SIZE,
+                    workers=Config.EMBED_WORKERS,
+                    cache_dir=Config.EMBEDDING_CACHE_DIR or None,
+                    cache_max_entries=Config.EMBEDDING_CACHE_MAX_ENTRIES
+                )
                 embedding_generator.process_chunks_directory(chunks_dir, embeddings_dir)
                 
                 # Load the generated embeddings and metadata
@@ -364,41 +414,23 @@ class DocumentLoader:
                 
                 new_embeddings = np.load(embeddings_file)
                 
-                # Update the main knowledge base
-                main_embeddings_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'embeddings')
-                main_faiss_dir = os.path.join(main_embeddings_dir, 'faiss')
-                
-                # Load existing metadata and embeddings
-                main_metadata_file = os.path.join(main_faiss_dir, 'metadata.json')
-                main_embeddings_file = os.path.join(main_faiss_dir, 'embeddings.npy')
-                
-                if os.path.exists(main_metadata_file) and os.path.exists(main_embeddings_file):
-                    with open(main_metadata_file, 'r', encoding='utf-8') as f:
-                        existing_metadata = json.load(f)
-                    
-                    existing_embeddings = np.load(main_embeddings_file)
-                    
-                    # Combine existing and new data
-                    combined_metadata = existing_metadata + new_metadata
-                    combined_embeddings = np.concatenate([existing_embeddings, new_embeddings], axis=0)
-                else:
-                    # No existing data, use new data only
-                    combined_metadata = new_metadata
-                    combined_embeddings = new_embeddings
-                
-                # Save combined data
-                os.makedirs(main_faiss_dir, exist_ok=True)
-                
-                with open(main_metadata_file, 'w', encoding='utf-8') as f:
-                    json.dump(combined_metadata, f, ensure_ascii=False, indent=2)
-                
-                np.save(main_embeddings_file, combined_embeddings)
+                # Append the new chunks as a segment; nothing already indexed is rewritten
+                new_signatures = None
+                if dedup_report is not None:
+                    new_signatures = np.array([kept_signatures[chunk['file_path']] for chunk in new_metadata],
+                                              dtype=np.uint32).reshape(len(new_metadata), -1)
+                generation = append_segment(main_faiss_dir, new_metadata, new_embeddings, Config,
+                                            signatures=new_signatures)
                 
-                return {
+                result = {
                     "status": "success",
                     "chunks_created": len(new_metadata),
+                    "generation": generation,
                     "message": f"Successfully added {len(new_metadata)} chunks to knowledge base"
                 }
+                if dedup_report is not None:
+                    result["deduplication"] = dedup_report
+                return result
                 
         except Exception as e:
             self.logger.error(f"Error adding document to knowledge base: {e}")
@@ -406,4 +438,59 @@ class DocumentLoader:
                 "status": "error",
                 "error": str(e),
                 "message": "Failed to add document to knowledge base"
-            }
\ No newline at end of file
+            }
+    
+    def delete_from_knowledge_base(self, source_name: str) -> Dict[str, Any]:
+        """
+        Delete every chunk of a document from the knowledge base.
+        
+        The rows are tombstoned (hidden from search at once) and dropped from the
+        files by the background compactor.
+        
+        Args:
+            source_name: Name the document was added under
+            
+        Returns:
+            Dictionary with the deletion results
+        """
+        try:
+            from backend.config import Config
+            from backend.utils.segments import add_tombstones
+            
+            deleted, generation = add_tombstones(Config.EMBEDDINGS_DIR, self._safe_source_name(source_name), Config)
+            if not deleted:
+                return {
+                    "status": "error",
+                    "error": f"No chunks found for document: {source_name}",
+                    "message": "Document is not in the knowledge base"
+                }
+            
+            self.logger.info(f"Deleted {deleted} chunks of {source_name} from the knowledge base")
+            return {
+                "status": "success",
+                "chunks_deleted": deleted,
+                "generation": generation,
+                "message": f"Successfully deleted {deleted} chunks from knowledge base"
+            }
+            
+        except Exception as e:
+            self.logger.error(f"Error deleting document from knowledge base: {e}")
+            return {
+                "status": "error",
+                "error": str(e),
+                "message": "Failed to delete document from knowledge base"
+            }
+    
+    @staticmethod
+    def _safe_source_name(source_name: str) -> str:
+        """Sanitized document name, which becomes the category of its chunks."""
+        safe_source_name = "".join(c for c in source_name if c.isalnum() or c in (' ', '-', '_')).rstrip()
+        return safe_source_name or "unnamed_document"
+    
+    @staticmethod
+    def _describe_row(row: int, existing_names: Dict[int, str], new_metadata: list, offset: int,
+                      chunks_dir: str) -> str:
+        """Human-readable name of the chunk a duplicate was collapsed into."""
+        if row < offset:
+            return existing_names[row]
+        return os.path.relpath(new_metadata[row - offset]['chunk_file'], chunks_dir)
\ No newline at end of file
@@ -0,0 +1,205 @@
+import hashlib
+import os
+import re
+import time
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Sequence, Set, Tuple
+
+import numpy as np
+
+from backend.utils.streaming_writer import NpyRowWriter, temporary_path
+
+# One shard is a keys<suffix>.npy / vectors<suffix>.npy pair ('keys.npy' is the unsuffixed legacy shard)
+KEYS_PREFIX = "keys"
+VECTORS_PREFIX = "vectors"
+
+# Rows copied per block when shards are merged
+MERGE_BLOCK_ROWS = 8192
+
+
+def text_digest(text: str) -> bytes:
+    """sha256 of the chunk text, the per-entry cache key."""
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def cache_namespace(model_name: str, revision: str, backend: str, quantized: bool = False) -> str:
+    """Directory name for one (model, revision, backend) combination; embeddings never mix across them."""
+    parts = [model_name, revision, backend + ('-int8' if quantized else '')]
+    return "__".join(re.sub(r'[^A-Za-z0-9._-]', '_', part) for part in parts)
+
+
+def _save_atomic(path: Path, array: np.ndarray):
+    """np.save to a unique temporary file in the same directory, then rename into place."""
+    tmp_path = temporary_path(path)
+    with open(tmp_path, 'wb') as f:
+        np.save(f, array)
+    tmp_path.replace(path)
+
+
+class EmbeddingCache:
+    """
+    Persistent embeddings keyed by the sha256 of the chunk text, for one model and revision.
+
+    Entries live in append-only shards: each save() writes only the new entries as a
+    shard, and existing vectors are memory-mapped rather than loaded. merge() folds the
+    shards into one and enforces max_entries.
+    """
+
+    def __init__(self, cache_dir: Path, namespace: str, max_entries: int = 0):
+        """
+        Open the cache (an empty one if it does not exist yet).
+
+        Args:
+            cache_dir: Base directory of all embedding caches
+            namespace: Model, revision and backend key (see cache_namespace())
+            max_entries: Bound on the number of cached entries, enforced by merge() (0 = unbounded)
+        """
+        self.path = Path(cache_dir) / namespace
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._shard_names: List[str] = []
+        self._shards: List[np.ndarray] = []
+        self._rows: Dict[bytes, Tuple[int, int]] = {}  # key -> (shard, row)
+        self._used: Set[bytes] = set()  # keys looked up or added since the cache was opened
+        self._new_keys: List[bytes] = []
+        self._new_vectors: List[np.ndarray] = []
+
+        # Shard suffixes start with a timestamp, so name order is age order
+        if self.path.exists():
+            for keys_path in sorted(self.path.glob(f"{KEYS_PREFIX}*.npy")):
+                suffix = keys_path.name[len(KEYS_PREFIX):-len('.npy')]
+                vectors_path = self.path / f"{VECTORS_PREFIX}{suffix}.npy"
+                if not vectors_path.exists():
+                    continue
+                keys = np.load(keys_path)
+                vectors = np.load(vectors_path, mmap_mode='r')
+                if keys.ndim != 2 or len(keys) != len(vectors):
+                    continue
+                shard = len(self._shards)
+                self._shard_names.append(suffix)
+                self._shards.append(vectors)
+                self._rows.update((key.tobytes(), (shard, row)) for row, key in enumerate(keys))
+
+    def __len__(self) -> int:
+        return len(self._rows) + len(self._new_keys)
+
+    @property
+    def dim(self) -> Optional[int]:
+        """Width of the cached vectors (None while the cache is empty)."""
+        for shard in self._shards:
+            if shard.ndim == 2:
+                return int(shard.shape[1])
+        return int(self._new_vectors[0].shape[0]) if self._new_vectors else None
+
+    def embed(self, texts: Sequence[str], encode: Callable[[List[str]], np.ndarray]) -> np.ndarray:
+        """
+        Embeddings of texts, encoding only those not cached yet.
+
+        Args:
+            texts: Input texts
+            encode: Embeds a list of texts, returning an array of shape (len(texts), dim)
+
+        Returns:
+            Float32 array of shape (len(texts), dim), in the order of texts
+        """
+        digests = [text_digest(text) for text in texts]
+        new_rows = {key: i for i, key in enumerate(self._new_keys)}
+
+        # Unique missing texts, so a chunk repeated within one run is encoded once
+        missing: Dict[bytes, str] = {}
+        for key, text in zip(digests, texts):
+            if key not in self._rows and key not in new_rows and key not in missing:
+                missing[key] = text
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        self._used.update(digests)
+
+        if missing:
+            encoded = np.asarray(encode(list(missing.values())), dtype=np.float32)
+            for key, vector in zip(missing, encoded):
+                new_rows[key] = len(self._new_keys)
+                self._new_keys.append(key)
+                self._new_vectors.append(vector)
+
+        if not texts:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.stack([
+            self._vector(self._rows[key]) if key in self._rows else self._new_vectors[new_rows[key]]
+            for key in digests
+        ]).astype(np.float32, copy=False)
+
+    def _vector(self, location: Tuple[int, int]) -> np.ndarray:
+        shard, row = location
+        return self._shards[shard][row]
+
+    def save(self):
+        """Persist newly encoded entries as a new shard; existing shards are not touched."""
+        if not self._new_keys:
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        suffix = f".{time.time_ns():016x}-{os.getpid()}"
+        # Raw digests as uint8 rows ('S32' would strip trailing zero bytes)
+        keys = np.frombuffer(b''.join(self._new_keys), dtype=np.uint8).reshape(-1, 32)
+        # Keys are published last: a shard without its keys file is never read
+        _save_atomic(self.path / f"{VECTORS_PREFIX}{suffix}.npy", np.stack(self._new_vectors))
+        _save_atomic(self.path / f"{KEYS_PREFIX}{suffix}.npy", keys)
+
+        shard = len(self._shards)
+        self._shard_names.append(suffix)
+        self._shards.append(np.load(self.path / f"{VECTORS_PREFIX}{suffix}.npy", mmap_mode='r'))
+        self._rows.update((key, (shard, row)) for row, key in enumerate(self._new_keys))
+        self._new_keys, self._new_vectors = [], []
+
+    def merge(self):
+        """
+        Save, then fold every shard into one, dropping entries beyond max_entries.
+
+        Entries used since the cache was opened are kept first, then the newest shards.
+        Vectors are copied block by block from the memory-mapped shards.
+        """
+        self.save()
+        if len(self._shards) <= 1 and (not self.max_entries or len(self._rows) <= self.max_entries):
+            return
+
+        # Used entries first, then the rest newest shard first
+        by_shard: Dict[int, List[Tuple[int, bytes]]] = {}
+        for key, (shard, row) in self._rows.items():
+            by_shard.setdefault(shard, []).append((row, key))
+        ordered = [(key, location) for key, location in self._rows.items() if key in self._used]
+        for shard in sorted(by_shard, reverse=True):
+            ordered.extend((key, (shard, row)) for row, key in sorted(by_shard[shard]) if key not in self._used)
+        if self.max_entries:
+            ordered = ordered[:self.max_entries]
+        # Read each shard in row order
+        ordered.sort(key=lambda entry: entry[1])
+
+        suffix = f".{time.time_ns():016x}-{os.getpid()}"
+        vectors_path = self.path / f"{VECTORS_PREFIX}{suffix}.npy"
+        with NpyRowWriter(vectors_path, len(ordered)) as writer:
+            for start in range(0, len(ordered), MERGE_BLOCK_ROWS):
+                block = ordered[start:start + MERGE_BLOCK_ROWS]
+                writer.append(np.stack([self._vector(location) for _, location in block]))
+        keys = np.frombuffer(b''.join(key for key, _ in ordered), dtype=np.uint8).reshape(-1, 32)
+        _save_atomic(self.path / f"{KEYS_PREFIX}{suffix}.npy", keys)
+
+        # Only the shards merged here are removed; shards other processes saved meanwhile stay
+        for old in self._shard_names:
+            (self.path / f"{KEYS_PREFIX}{old}.npy").unlink(missing_ok=True)
+            (self.path / f"{VECTORS_PREFIX}{old}.npy").unlink(missing_ok=True)
+
+        self._shard_names = [suffix]
+        self._shards = [np.load(vectors_path, mmap_mode='r')]
+        self._rows = {key: (0, row) for row, (key, _) in enumerate(ordered)}
+
+    def stats(self) -> Dict[str, float]:
+        """Hits and misses since the cache was opened."""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self),
+            "shards": len(self._shards),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0
+        }
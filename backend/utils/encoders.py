@@ -0,0 +1,379 @@
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from typing import List, Optional, Sequence, Tuple, Union
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+ENCODER_BACKENDS = ('torch', 'onnx')
+
+# Minimum cosine similarity between ONNX and torch embeddings of the same text
+ONNX_COSINE_TOLERANCE = 0.99
+ONNX_QUANTIZED_COSINE_TOLERANCE = 0.95
+
+ONNX_MODEL_FILE = "model.onnx"
+ONNX_QUANTIZED_MODEL_FILE = "model_quantized.onnx"
+ENCODER_CONFIG_FILE = "encoder_config.json"
+
+VERIFICATION_TEXTS = [
+    "What dialysis treatments are available?",
+    "How can I contact DCC?",
+    "home dialysis options",
+    "Peritoneal dialysis can be done at home while you sleep.",
+    "Patients with end-stage renal disease need regular hemodialysis sessions, usually three times a week.",
+]
+
+
+def onnx_model_dir(base_dir: str, model_name: str) -> Path:
+    """Directory holding the exported ONNX model and tokenizer for a sentence-transformers model."""
+    return Path(base_dir) / model_name.replace('/', '__')
+
+
+class TorchEncoder:
+    """Sentence embeddings computed by sentence-transformers on PyTorch."""
+
+    backend = 'torch'
+
+    def __init__(self, model_name: str):
+        """
+        Load the model.
+
+        Args:
+            model_name: Name of the pre-trained model from sentence-transformers
+        """
+        from sentence_transformers import SentenceTransformer
+
+        self.model_name = model_name
+        self.model = SentenceTransformer(model_name)
+
+    @property
+    def dim(self) -> int:
+        """Width of the embeddings."""
+        return int(self.model.get_sentence_embedding_dimension())
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Embed texts.
+
+        Args:
+            texts: Input texts
+            batch_size: Texts per forward pass
+
+        Returns:
+            Float32 array of shape (len(texts), dim)
+        """
+        embeddings = self.model.encode(list(texts), batch_size=batch_size,
+                                       show_progress_bar=False, convert_to_numpy=True)
+        return np.asarray(embeddings, dtype=np.float32)
+
+
+class OnnxEncoder:
+    """Sentence embeddings computed by an exported ONNX model on onnxruntime (no PyTorch at runtime)."""
+
+    backend = 'onnx'
+
+    def __init__(self, model_dir: Path, quantized: bool = False, num_threads: int = 0):
+        """
+        Load an exported model (see export_onnx()).
+
+        Args:
+            model_dir: Directory with the .onnx files, tokenizer.json and encoder_config.json
+            quantized: Use the dynamically int8-quantized model
+            num_threads: Intra-op threads for onnxruntime (0 lets onnxruntime decide)
+        """
+        try:
+            import onnxruntime as ort
+            from tokenizers import Tokenizer
+        except ImportError as e:
+            raise ImportError("onnxruntime and tokenizers are required for ENCODER_BACKEND=onnx") from e
+
+        self.model_dir = Path(model_dir)
+        with open(self.model_dir / ENCODER_CONFIG_FILE, 'r', encoding='utf-8') as f:
+            encoder_config = json.load(f)
+        self.model_name = encoder_config['model_name']
+        self.normalize = encoder_config['normalize']
+
+        self.tokenizer = Tokenizer.from_file(str(self.model_dir / "tokenizer.json"))
+        self.tokenizer.enable_truncation(max_length=encoder_config['max_seq_length'])
+        self.tokenizer.enable_padding(pad_id=encoder_config['pad_token_id'],
+                                      pad_token=encoder_config['pad_token'])
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+        self.session = ort.InferenceSession(str(self.model_dir / model_file), options,
+                                            providers=['CPUExecutionProvider'])
+        self.input_names = [node.name for node in self.session.get_inputs()]
+
+    @property
+    def dim(self) -> int:
+        """Width of the embeddings (the hidden size, which mean pooling keeps)."""
+        return int(self.session.get_outputs()[0].shape[-1])
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Embed texts with mean pooling over the token embeddings, as sentence-transformers does.
+
+        Args:
+            texts: Input texts
+            batch_size: Texts per forward pass
+
+        Returns:
+            Float32 array of shape (len(texts), dim)
+        """
+        texts = list(texts)
+        batches = []
+        for start in range(0, len(texts), batch_size):
+            encodings = self.tokenizer.encode_batch(texts[start:start + batch_size])
+            feeds = {
+                'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+                'attention_mask': np.array([e.attention_mask for e in encodings], dtype=np.int64),
+                'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            token_embeddings = self.session.run(None, {name: feeds[name] for name in self.input_names})[0]
+
+            mask = feeds['attention_mask'][:, :, np.newaxis].astype(np.float32)
+            pooled = (token_embeddings * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+            if self.normalize:
+                pooled /= np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
+            batches.append(pooled.astype(np.float32))
+
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(batches)
+
+
+Encoder = Union[TorchEncoder, OnnxEncoder]
+
+
+def export_onnx(model_name: str, output_dir: Path, quantize: bool = True) -> Path:
+    """
+    Export a mean-pooling sentence-transformers model to ONNX.
+
+    Writes model.onnx (and model_quantized.onnx with int8 dynamically quantized
+    weights), the fast tokenizer and the pooling settings needed by OnnxEncoder.
+    Needs torch, sentence-transformers and onnx; only onnxruntime and tokenizers
+    are needed to run the result.
+
+    Args:
+        model_name: Name of the pre-trained model from sentence-transformers
+        output_dir: Directory to write the exported files into
+        quantize: Also write the dynamically quantized model
+
+    Returns:
+        The output directory
+    """
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    model = SentenceTransformer(model_name, device='cpu')
+    transformer, pooling = model[0], model[1]
+    if not getattr(pooling, 'pooling_mode_mean_tokens', False):
+        raise ValueError(f"{model_name} does not use mean pooling, which is all OnnxEncoder implements")
+    normalize = any(type(module).__name__ == 'Normalize' for module in model)
+
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    tokenizer = transformer.tokenizer
+    tokenizer.save_pretrained(str(output_dir))
+
+    auto_model = transformer.auto_model.eval()
+    input_names = [name for name in ('input_ids', 'attention_mask', 'token_type_ids')
+                   if name in tokenizer.model_input_names]
+    sample = tokenizer(["an example sentence"], return_tensors='pt')
+    dynamic_axes = {name: {0: 'batch', 1: 'sequence'} for name in input_names}
+    dynamic_axes['last_hidden_state'] = {0: 'batch', 1: 'sequence'}
+
+    # Write to a temporary name so a failed export never leaves a truncated model behind
+    model_path = output_dir / ONNX_MODEL_FILE
+    tmp_path = output_dir / (ONNX_MODEL_FILE + '.tmp')
+    with torch.no_grad():
+        torch.onnx.export(
+            auto_model,
+            tuple(sample[name] for name in input_names),
+            str(tmp_path),
+            input_names=input_names,
+            output_names=['last_hidden_state'],
+            dynamic_axes=dynamic_axes,
+            opset_version=14
+        )
+    os.replace(tmp_path, model_path)
+
+    if quantize:
+        from onnxruntime.quantization import QuantType, quantize_dynamic
+        quantize_dynamic(str(model_path), str(output_dir / ONNX_QUANTIZED_MODEL_FILE),
+                         weight_type=QuantType.QInt8)
+
+    with open(output_dir / ENCODER_CONFIG_FILE, 'w', encoding='utf-8') as f:
+        json.dump({
+            'model_name': model_name,
+            'max_seq_length': model.max_seq_length,
+            'normalize': normalize,
+            'pad_token': tokenizer.pad_token,
+            'pad_token_id': tokenizer.pad_token_id,
+        }, f, indent=2)
+
+    logger.info(f"Exported {model_name} to ONNX in {output_dir}")
+    return output_dir
+
+
+def load_encoder(model_name: str, backend: str = 'torch', onnx_dir: Optional[str] = None,
+                 quantized: bool = False, num_threads: int = 0) -> Encoder:
+    """
+    Create the encoder for a backend, exporting the ONNX model on first use.
+
+    Args:
+        model_name: Name of the pre-trained model from sentence-transformers
+        backend: 'torch' or 'onnx'
+        onnx_dir: Base directory for exported ONNX models
+        quantized: Use the int8 dynamically quantized ONNX model
+        num_threads: Intra-op threads for onnxruntime (0 lets onnxruntime decide)
+
+    Returns:
+        A TorchEncoder or OnnxEncoder
+    """
+    if backend not in ENCODER_BACKENDS:
+        raise ValueError(f"Unknown encoder backend '{backend}', expected one of {ENCODER_BACKENDS}")
+
+    if backend == 'torch':
+        return TorchEncoder(model_name)
+
+    model_dir = onnx_model_dir(onnx_dir or os.path.join('data', 'models', 'onnx'), model_name)
+    model_file = ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE
+    if not (model_dir / model_file).exists() or not (model_dir / ENCODER_CONFIG_FILE).exists():
+        logger.warning(f"No exported ONNX model in {model_dir}, exporting {model_name} (needs torch once)")
+        export_onnx(model_name, model_dir, quantize=quantized)
+    return OnnxEncoder(model_dir, quantized=quantized, num_threads=num_threads)
+
+
+def _file_fingerprint(paths: List[Path]) -> str:
+    """Short sha256 over file contents, identifying exactly which weights were used."""
+    digest = hashlib.sha256()
+    for path in sorted(paths):
+        with open(path, 'rb') as f:
+            for block in iter(lambda: f.read(1 << 20), b''):
+                digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def model_revision(model_name: str, backend: str = 'torch', onnx_dir: Optional[str] = None,
+                   quantized: bool = False) -> Optional[str]:
+    """
+    Identify the exact weights an encoder would use, without loading it.
+
+    Args:
+        model_name: Name of the pre-trained model from sentence-transformers, or a local path
+        backend: 'torch' or 'onnx'
+        onnx_dir: Base directory for exported ONNX models
+        quantized: Use the int8 dynamically quantized ONNX model
+
+    Returns:
+        The Hugging Face commit hash for a downloaded model, a content hash for a
+        local model or ONNX export, or None if the model is not on disk yet
+    """
+    if backend == 'onnx':
+        model_dir = onnx_model_dir(onnx_dir or os.path.join('data', 'models', 'onnx'), model_name)
+        model_file = model_dir / (ONNX_QUANTIZED_MODEL_FILE if quantized else ONNX_MODEL_FILE)
+        return _file_fingerprint([model_file]) if model_file.exists() else None
+
+    if os.path.isdir(model_name):
+        return _file_fingerprint([path for path in Path(model_name).rglob('*')
+                                  if path.is_file() and path.suffix in ('.bin', '.safetensors')])
+
+    # sentence-transformers resolves bare names to the sentence-transformers organization
+    repo_id = model_name if '/' in model_name else f"sentence-transformers/{model_name}"
+    hub_cache = os.environ.get('HF_HUB_CACHE') or os.path.join(
+        os.environ.get('HF_HOME', os.path.join(os.path.expanduser('~'), '.cache', 'huggingface')), 'hub')
+    ref = Path(hub_cache) / f"models--{repo_id.replace('/', '--')}" / "refs" / "main"
+    return ref.read_text().strip() if ref.exists() else None
+
+
+# Encoder of a pool worker process, created by _init_pool_worker()
+_worker_encoder: Optional[Encoder] = None
+
+
+def _init_pool_worker(model_name: str, backend: str, onnx_dir: Optional[str], quantized: bool, num_threads: int):
+    """Load the encoder once per worker, limited to its share of the cores."""
+    global _worker_encoder
+    if backend == 'torch':
+        import torch
+        torch.set_num_threads(num_threads)
+    _worker_encoder = load_encoder(model_name, backend, onnx_dir, quantized=quantized, num_threads=num_threads)
+
+
+def _encode_in_worker(job: Tuple[List[str], int]) -> np.ndarray:
+    texts, batch_size = job
+    return _worker_encoder.encode(texts, batch_size=batch_size)
+
+
+class EncodePool:
+    """Worker processes that each hold an encoder, for embedding large corpora on many cores."""
+
+    def __init__(self, model_name: str, backend: str = 'torch', onnx_dir: Optional[str] = None,
+                 quantized: bool = False, workers: int = 0):
+        """
+        Start the workers (the model is loaded once in each).
+
+        Args:
+            model_name: Name of the pre-trained model from sentence-transformers
+            backend: 'torch' or 'onnx'
+            onnx_dir: Base directory for exported ONNX models
+            quantized: Use the int8 dynamically quantized ONNX model
+            workers: Worker processes (0 = one per core)
+        """
+        cores = os.cpu_count() or 1
+        self.workers = workers or cores
+        # Each worker gets an equal share of the cores, so the pool does not oversubscribe them
+        threads = max(1, cores // self.workers)
+        # Spawned, not forked: forking a process that has already used torch threads can deadlock
+        self._executor = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_pool_worker,
+            initargs=(model_name, backend, onnx_dir, quantized, threads)
+        )
+
+    def encode(self, texts: Sequence[str], batch_size: int = 32) -> np.ndarray:
+        """
+        Embed texts on the workers, one batch per task.
+
+        Args:
+            texts: Input texts
+            batch_size: Texts per forward pass (and per task)
+
+        Returns:
+            Float32 array of shape (len(texts), dim), in the order of texts
+        """
+        texts = list(texts)
+        jobs = [(texts[start:start + batch_size], batch_size) for start in range(0, len(texts), batch_size)]
+        batches = list(self._executor.map(_encode_in_worker, jobs))
+        if not batches:
+            return np.empty((0, 0), dtype=np.float32)
+        return np.vstack(batches)
+
+    def close(self):
+        """Stop the worker processes."""
+        self._executor.shutdown()
+
+    def __enter__(self) -> 'EncodePool':
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def cosine_agreement(reference: np.ndarray, candidate: np.ndarray) -> np.ndarray:
+    """Row-wise cosine similarity between two embedding matrices of the same texts."""
+    reference = np.asarray(reference, dtype=np.float64)
+    candidate = np.asarray(candidate, dtype=np.float64)
+    norms = np.linalg.norm(reference, axis=1) * np.linalg.norm(candidate, axis=1)
+    return np.einsum('ij,ij->i', reference, candidate) / np.maximum(norms, 1e-12)
+
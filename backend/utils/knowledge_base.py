@@ -0,0 +1,266 @@
+import hashlib
+import json
+import os
+import sys
+from datetime import datetime, timezone
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from backend.utils.chunk_store import chunk_store_paths
+from backend.utils.streaming_writer import temporary_path
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+
+# Source-of-truth files of the base; derived indexes are checked for freshness by the retriever
+BASE_FILES = ("metadata.json", "embeddings.npy")
+
+
+class SegmentInfo(NamedTuple):
+    """An immutable segment directory and its row count."""
+    name: str
+    rows: int
+
+
+class Manifest(NamedTuple):
+    """
+    Published state of the knowledge base: the base files in data_dir, then each segment in order.
+
+    Rows are numbered across the layout (base rows first). Tombstones are deleted rows,
+    which stay in the files until the compactor rewrites the part holding them. The
+    generation, model, dimension, checksums and timestamp are filled in by publish_manifest().
+    """
+    base_rows: int
+    segments: List[SegmentInfo]
+    tombstones: List[int]
+    generation: int = 0
+    model: Optional[str] = None
+    dim: Optional[int] = None
+    files: Optional[Dict[str, Dict]] = None  # Relative path -> size, mtime_ns and sha256
+    built_at: Optional[str] = None
+
+    @property
+    def total_rows(self) -> int:
+        return self.base_rows + sum(segment.rows for segment in self.segments)
+
+
+def manifest_path(data_dir: Path) -> Path:
+    """Location of the knowledge base manifest, next to metadata.json."""
+    return Path(data_dir) / MANIFEST_FILE
+
+
+def _is_fresh(path: Path, source: Path) -> bool:
+    return path.exists() and source.exists() and path.stat().st_mtime >= source.stat().st_mtime
+
+
+def count_base_rows(data_dir: Path) -> int:
+    """Rows in the base files (from the chunk store index when it is current, else metadata.json)."""
+    data_dir = Path(data_dir)
+    metadata_path = data_dir / "metadata.json"
+    if not metadata_path.exists():
+        return 0
+    _, offsets_path = chunk_store_paths(data_dir)
+    if _is_fresh(offsets_path, metadata_path):
+        with np.load(offsets_path) as index:
+            return len(index['offsets']) - 1
+    with open(metadata_path, 'r', encoding='utf-8') as f:
+        return len(json.load(f))
+
+
+def read_manifest(data_dir: Path) -> Manifest:
+    """The published manifest (a base-only, unverified one at generation 0 if none was written)."""
+    path = manifest_path(data_dir)
+    if not path.exists():
+        return Manifest(count_base_rows(data_dir), [], [])
+    with open(path, 'r', encoding='utf-8') as f:
+        data = json.load(f)
+    return Manifest(
+        data['base_rows'],
+        [SegmentInfo(segment['name'], segment['rows']) for segment in data['segments']],
+        data['tombstones'],
+        generation=data['generation'],
+        model=data.get('model'),
+        dim=data.get('dim'),
+        files=data.get('files'),
+        built_at=data.get('built_at')
+    )
+
+
+def file_checksum(path: Path, block_size: int = 1 << 20) -> str:
+    """sha256 of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def layout_files(data_dir: Path, manifest: Manifest) -> List[str]:
+    """Relative paths of the data files a manifest covers: the base files and every segment file."""
+    data_dir = Path(data_dir)
+    files = [name for name in BASE_FILES if (data_dir / name).exists()]
+    for segment in manifest.segments:
+        segment_path = data_dir / SEGMENTS_DIR / segment.name
+        files.extend(f"{SEGMENTS_DIR}/{segment.name}/{path.name}" for path in sorted(segment_path.iterdir()))
+    return files
+
+
+def _embedding_shape(path: Path) -> Tuple[int, ...]:
+    """Shape of a .npy file, read from its header only."""
+    return np.load(path, mmap_mode='r').shape
+
+
+def _check_tombstones(manifest: Manifest):
+    """Raise ValueError if a tombstone is not a row of the layout."""
+    out_of_range = [row for row in manifest.tombstones if not 0 <= row < manifest.total_rows]
+    if out_of_range:
+        raise ValueError(f"Tombstones {out_of_range[:5]} are outside the {manifest.total_rows} rows "
+                         f"of the knowledge base")
+
+
+def publish_manifest(data_dir: Path, manifest: Manifest, model: str) -> int:
+    """
+    Checksum the files of a layout and publish it as the next generation.
+
+    Written last (tmp file + rename): retrievers reload once they see the new generation.
+    Checksums of files whose size and mtime did not change are carried over, so an
+    upload only hashes the segment it added.
+
+    Args:
+        data_dir: Knowledge base directory
+        manifest: Layout to publish (base rows, segments and tombstones)
+        model: Name of the model that produced the embeddings
+
+    Returns:
+        The new generation
+
+    Raises:
+        ValueError: If a tombstone is outside the layout's rows
+    """
+    _check_tombstones(manifest)
+    data_dir = Path(data_dir)
+    previous = read_manifest(data_dir)
+    known = previous.files or {}
+
+    files = {}
+    for name in layout_files(data_dir, manifest):
+        stat = (data_dir / name).stat()
+        entry = known.get(name)
+        if entry is None or entry['size'] != stat.st_size or entry['mtime_ns'] != stat.st_mtime_ns:
+            entry = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': file_checksum(data_dir / name)}
+        files[name] = entry
+
+    dim = None
+    vector_files = ["embeddings.npy"] + [f"{SEGMENTS_DIR}/{s.name}/embeddings.npy" for s in manifest.segments]
+    for name in vector_files:
+        shape = _embedding_shape(data_dir / name) if name in files else ()
+        if len(shape) == 2 and shape[0]:
+            dim = int(shape[1])
+            break
+
+    manifest = manifest._replace(
+        generation=previous.generation + 1,
+        model=model,
+        dim=dim,
+        files=files,
+        built_at=datetime.now(timezone.utc).isoformat(timespec='seconds')
+    )
+    path = manifest_path(data_dir)
+    tmp_path = temporary_path(path)
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump({
+            'generation': manifest.generation,
+            'model': manifest.model,
+            'dim': manifest.dim,
+            'base_rows': manifest.base_rows,
+            'segments': [{'name': segment.name, 'rows': segment.rows} for segment in manifest.segments],
+            'tombstones': sorted(manifest.tombstones),
+            'files': manifest.files,
+            'built_at': manifest.built_at
+        }, f, indent=2)
+    tmp_path.replace(path)
+    return manifest.generation
+
+
+def verify_manifest(data_dir: Path, manifest: Manifest, model: str, full: bool = False):
+    """
+    Check that the files on disk are the ones the manifest was published with.
+
+    The default check only stats files and reads .npy headers; full also compares sha256 checksums.
+    A manifest that was never published (no manifest.json) is not checked.
+
+    Args:
+        data_dir: Knowledge base directory
+        manifest: Manifest to check against
+        model: Name of the model queries will be encoded with
+        full: Recompute every checksum
+
+    Raises:
+        ValueError: If a file is missing, changed or does not match the manifest
+    """
+    if manifest.files is None:
+        return
+    data_dir = Path(data_dir)
+    if manifest.model and manifest.model != model:
+        raise ValueError(f"Knowledge base was embedded with {manifest.model} but EMBEDDING_MODEL is {model}")
+    _check_tombstones(manifest)
+
+    for name, entry in manifest.files.items():
+        path = data_dir / name
+        if not path.exists():
+            raise ValueError(f"{name} is listed in {MANIFEST_FILE} but missing")
+        if path.stat().st_size != entry['size']:
+            raise ValueError(f"{name} is {path.stat().st_size} bytes, {MANIFEST_FILE} expects {entry['size']}")
+        if full and file_checksum(path) != entry['sha256']:
+            raise ValueError(f"{name} does not match its checksum in {MANIFEST_FILE}")
+
+    expected = [("embeddings.npy", manifest.base_rows)]
+    expected += [(f"{SEGMENTS_DIR}/{s.name}/embeddings.npy", s.rows) for s in manifest.segments]
+    for name, rows in expected:
+        if name not in manifest.files or not rows:
+            continue
+        shape = _embedding_shape(data_dir / name)
+        if shape != (rows, manifest.dim):
+            raise ValueError(f"{name} has shape {shape}, {MANIFEST_FILE} expects {(rows, manifest.dim)}")
+
+
+class GenerationTracker:
+    """Cheaply follows the manifest generation: the file is only re-read when its stat changes."""
+
+    def __init__(self, data_dir: Path):
+        self.path = manifest_path(data_dir)
+        self._signature: Optional[Tuple[int, int, int]] = None
+        self._generation = 0
+
+    def current(self) -> int:
+        """Generation on disk right now."""
+        try:
+            stat = os.stat(self.path)
+            signature = (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+        except FileNotFoundError:
+            signature = None
+
+        if signature != self._signature:
+            self._generation = read_manifest(self.path.parent).generation if signature else 0
+            self._signature = signature
+        return self._generation
+
+
+if __name__ == "__main__":
+    # python -m backend.utils.knowledge_base [data_dir] [--publish]
+    # Verifies every checksum; --publish writes a manifest for the files as they are
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    kb_dir = Path(args[0] if args else "data/embeddings/faiss")
+    from backend.config import Config
+    if '--publish' in sys.argv:
+        current = read_manifest(kb_dir)
+        print(f"Published generation {publish_manifest(kb_dir, current, Config.EMBEDDING_MODEL)}")
+    kb_manifest = read_manifest(kb_dir)
+    if kb_manifest.files is None:
+        sys.exit(f"No {MANIFEST_FILE} in {kb_dir}; run with --publish to write one")
+    verify_manifest(kb_dir, kb_manifest, Config.EMBEDDING_MODEL, full=True)
+    print(f"Generation {kb_manifest.generation}: {kb_manifest.total_rows} rows "
+          f"({len(kb_manifest.segments)} segments, {len(kb_manifest.tombstones)} deleted), "
+          f"{kb_manifest.model} ({kb_manifest.dim} dims), built {kb_manifest.built_at}: OK")
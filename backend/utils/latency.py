@@ -0,0 +1,78 @@
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict
+
+import numpy as np
+
+
+class StageTimer:
+    """Wall-clock time per stage of a single call, measured with perf_counter."""
+
+    def __init__(self):
+        self.durations: Dict[str, float] = {}
+        self._start = self._last = time.perf_counter()
+
+    def lap(self, stage: str):
+        """Charge the time since the previous lap (or the start) to stage."""
+        now = time.perf_counter()
+        self.durations[stage] = self.durations.get(stage, 0.0) + now - self._last
+        self._last = now
+
+    @property
+    def total(self) -> float:
+        return time.perf_counter() - self._start
+
+
+class LatencyStats:
+    """Thread-safe sliding window of recent durations per stage, summarized as percentiles."""
+
+    def __init__(self, window: int = 2048):
+        """
+        Initialize the recorder.
+
+        Args:
+            window: Most recent samples kept per stage (0 disables recording)
+        """
+        self.window = window
+        self._samples: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def record(self, durations: Dict[str, float]):
+        """Add one sample, in seconds, for each stage."""
+        if self.window <= 0:
+            return
+        with self._lock:
+            for stage, seconds in durations.items():
+                samples = self._samples.get(stage)
+                if samples is None:
+                    samples = self._samples[stage] = deque(maxlen=self.window)
+                samples.append(seconds)
+                self._counts[stage] = self._counts.get(stage, 0) + 1
+
+    def clear(self):
+        """Drop all samples and counts."""
+        with self._lock:
+            self._samples.clear()
+            self._counts.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        """Per-stage count and p50/p95/p99/max over the window, in milliseconds."""
+        with self._lock:
+            snapshot = {stage: np.array(samples) for stage, samples in self._samples.items()}
+            counts = dict(self._counts)
+
+        summary = {}
+        for stage, samples in snapshot.items():
+            p50, p95, p99 = np.percentile(samples, [50, 95, 99]) * 1000.0
+            summary[stage] = {
+                "count": counts[stage],
+                "window": len(samples),
+                "mean_ms": round(float(samples.mean()) * 1000.0, 3),
+                "p50_ms": round(float(p50), 3),
+                "p95_ms": round(float(p95), 3),
+                "p99_ms": round(float(p99), 3),
+                "max_ms": round(float(samples.max()) * 1000.0, 3)
+            }
+        return summary
@@ -0,0 +1,205 @@
+import json
+import re
+import sys
+import zlib
+from collections import defaultdict
+from pathlib import Path
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from backend.utils.streaming_writer import temporary_path
+
+WORD_PATTERN = re.compile(r'\w+')
+
+# Mersenne prime for the (a * x + b) mod p permutations; hashes are then truncated to 32 bits
+_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+
+
+def minhash_path(data_dir: Path) -> Path:
+    """Location of the persisted MinHash signatures, next to metadata.json."""
+    return Path(data_dir) / "minhash.npy"
+
+
+def shingles(text: str, size: int = 5) -> List[str]:
+    """Overlapping lowercase word n-grams (the whole text if it is shorter than one)."""
+    words = WORD_PATTERN.findall(text.lower())
+    if len(words) <= size:
+        return [" ".join(words)]
+    return [" ".join(words[i:i + size]) for i in range(len(words) - size + 1)]
+
+
+class DuplicateMatch(NamedTuple):
+    """A chunk judged a near-duplicate of an earlier row."""
+    row: int
+    duplicate_of: int
+    similarity: float
+
+
+class MinHashLSH:
+    """MinHash signatures with banded locality-sensitive hashing for near-duplicate lookup."""
+
+    def __init__(self, num_perm: int = 128, bands: int = 16, threshold: float = 0.8,
+                 shingle_size: int = 5, seed: int = 1):
+        """
+        Initialize the index.
+
+        Args:
+            num_perm: Hash permutations per signature (must be divisible by bands)
+            bands: LSH bands; chunks sharing any band are compared
+            threshold: Estimated Jaccard similarity at or above which chunks are duplicates
+            shingle_size: Words per shingle
+            seed: Seed of the permutations (signatures are only comparable with the same seed)
+        """
+        if num_perm % bands:
+            raise ValueError(f"num_perm ({num_perm}) must be divisible by bands ({bands})")
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.threshold = threshold
+        self.shingle_size = shingle_size
+
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 1 << 31, num_perm, dtype=np.uint64)
+        self._b = rng.integers(0, 1 << 31, num_perm, dtype=np.uint64)
+
+        self._buckets: List[Dict[bytes, List[int]]] = [defaultdict(list) for _ in range(bands)]
+        self._signatures: Dict[int, np.ndarray] = {}
+
+    def signature(self, text: str) -> np.ndarray:
+        """MinHash signature of a text, shape (num_perm,), uint32."""
+        hashes = np.fromiter((zlib.crc32(s.encode('utf-8')) for s in shingles(text, self.shingle_size)),
+                             dtype=np.uint64)
+        # a, b < 2**31 and hashes < 2**32, so a * x + b cannot overflow 64 bits
+        permuted = (np.outer(self._a, hashes) + self._b[:, np.newaxis]) % _PRIME
+        return (permuted.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+    def signatures(self, texts: List[str]) -> np.ndarray:
+        """Signatures of several texts, shape (len(texts), num_perm)."""
+        result = np.empty((len(texts), self.num_perm), dtype=np.uint32)
+        for i, text in enumerate(texts):
+            result[i] = self.signature(text)
+        return result
+
+    def _band_keys(self, signature: np.ndarray) -> List[bytes]:
+        return [band.tobytes() for band in signature.reshape(self.bands, self.rows_per_band)]
+
+    def add(self, row: int, signature: np.ndarray):
+        """Index a signature under a row id."""
+        self._signatures[row] = signature
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            buckets[key].append(row)
+
+    def query(self, signature: np.ndarray) -> Optional[Tuple[int, float]]:
+        """
+        Find the most similar indexed row.
+
+        Args:
+            signature: Signature to look up
+
+        Returns:
+            Tuple of (row, estimated Jaccard similarity) at or above the threshold, or None
+        """
+        candidates = set()
+        for buckets, key in zip(self._buckets, self._band_keys(signature)):
+            candidates.update(buckets.get(key, ()))
+
+        best = None
+        for row in sorted(candidates):
+            similarity = float(np.mean(self._signatures[row] == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (row, similarity)
+        return best
+
+
+def find_near_duplicates(signatures: np.ndarray, lsh: MinHashLSH,
+                         existing: Optional[np.ndarray] = None,
+                         deleted: Optional[List[int]] = None) -> List[DuplicateMatch]:
+    """
+    Flag signatures that nearly duplicate an existing row or an earlier new one.
+
+    Args:
+        signatures: Signatures of the new chunks, in ingest order
+        lsh: Empty index holding the permutations and threshold; kept rows are added to it
+        existing: Signatures of the chunks already in the knowledge base
+        deleted: Existing rows that were deleted (tombstoned) and must not match
+
+    Returns:
+        One match per duplicate. Rows are numbered after the existing ones, so
+        duplicate_of < len(existing) points into the knowledge base.
+    """
+    offset = 0 if existing is None else len(existing)
+    if existing is not None:
+        skip = set(deleted or ())
+        for row, signature in enumerate(existing):
+            if row not in skip:
+                lsh.add(row, signature)
+
+    matches = []
+    for i, signature in enumerate(signatures):
+        match = lsh.query(signature)
+        if match is None:
+            # Only kept chunks are indexed, so every duplicate points at a surviving row
+            lsh.add(offset + i, signature)
+        else:
+            matches.append(DuplicateMatch(offset + i, match[0], match[1]))
+    return matches
+
+
+def load_signatures(data_dir: Path, lsh: MinHashLSH, chunks: List[Dict], save: bool = False) -> np.ndarray:
+    """
+    Persisted signatures of the knowledge base, recomputed if missing or out of date.
+
+    The file is current when it is at least as new as metadata.json and has a row per chunk.
+
+    Args:
+        data_dir: Knowledge base directory
+        lsh: Index whose permutations the signatures must come from
+        chunks: Chunk records of data_dir, in row order
+        save: Persist recomputed signatures (only while holding the knowledge base write lock)
+
+    Returns:
+        Signatures of shape (len(chunks), lsh.num_perm)
+    """
+    path = minhash_path(data_dir)
+    metadata_path = Path(data_dir) / "metadata.json"
+    if path.exists() and (not metadata_path.exists() or path.stat().st_mtime_ns >= metadata_path.stat().st_mtime_ns):
+        signatures = np.load(path)
+        if signatures.shape == (len(chunks), lsh.num_perm):
+            return signatures
+    signatures = lsh.signatures([chunk['content'] for chunk in chunks])
+    if save:
+        save_signatures(signatures, data_dir)
+    return signatures
+
+
+def save_signatures(signatures: np.ndarray, data_dir: Path):
+    """Write signatures atomically (tmp file + rename), like the other knowledge base files."""
+    path = minhash_path(data_dir)
+    tmp_path = temporary_path(path)
+    with open(tmp_path, 'wb') as f:
+        np.save(f, signatures)
+    tmp_path.replace(path)
+
+
+def report(data_dir: str, threshold: float = 0.8):
+    """Report how much an existing knowledge base would shrink if near-duplicates were collapsed."""
+    with open(Path(data_dir) / "metadata.json", 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+
+    lsh = MinHashLSH(threshold=threshold)
+    matches = find_near_duplicates(lsh.signatures([chunk['content'] for chunk in chunks]), lsh)
+    for match in matches:
+        print(f"{chunks[match.row]['category']}/{chunks[match.row]['chunk_id']} ~ "
+              f"{chunks[match.duplicate_of]['category']}/{chunks[match.duplicate_of]['chunk_id']} "
+              f"({match.similarity:.2f})")
+    kept = len(chunks) - len(matches)
+    print(f"{len(chunks)} chunks, {len(matches)} near-duplicates: "
+          f"index would shrink to {kept} rows ({len(matches) / max(len(chunks), 1):.1%} smaller)")
+
+
+if __name__ == "__main__":
+    # python -m backend.utils.near_duplicates [data_dir] [threshold]
+    report(sys.argv[1] if len(sys.argv) > 1 else "data/embeddings/faiss",
+           float(sys.argv[2]) if len(sys.argv) > 2 else 0.8)
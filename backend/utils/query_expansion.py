@@ -0,0 +1,93 @@
+import json
+import logging
+import re
+from pathlib import Path
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def _trie_pattern(trie: Dict) -> str:
+    """Turn a character trie into a regex that matches any of its words, longest first."""
+    ends_here = '' in trie
+    branches = []
+    single_chars = []
+
+    for char in sorted(key for key in trie if key):
+        suffix = _trie_pattern(trie[char])
+        if suffix:
+            branches.append(re.escape(char) + suffix)
+        else:
+            single_chars.append(re.escape(char))
+
+    if single_chars:
+        branches.append(single_chars[0] if len(single_chars) == 1 else '[' + ''.join(single_chars) + ']')
+
+    if not branches:
+        return ''
+
+    pattern = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+    if ends_here:
+        # Greedy optional: try the longer term first, fall back to the word ending here
+        pattern = '(?:' + pattern + ')?'
+    return pattern
+
+
+class QueryExpander:
+    """Expands abbreviations and synonyms in a query in a single left-to-right pass."""
+
+    def __init__(self, expansions: Dict[str, str]):
+        """
+        Compile the expansion rules.
+
+        All terms are merged into one trie-shaped regex, so matching cost does not
+        grow with the number of rules. Each term is matched once at its position
+        (longest term wins) and expansions are never re-expanded.
+
+        Args:
+            expansions: Mapping of lowercase term -> text appended after it
+        """
+        self.expansions = {term.lower().strip(): expansion for term, expansion in expansions.items()
+                           if term.strip()}
+        self.pattern: Optional[re.Pattern] = None
+
+        if self.expansions:
+            trie: Dict = {}
+            for term in self.expansions:
+                node = trie
+                for char in term:
+                    node = node.setdefault(char, {})
+                node[''] = {}
+            self.pattern = re.compile(r'\b' + _trie_pattern(trie) + r'\b')
+
+    @classmethod
+    def from_file(cls, path: Path) -> 'QueryExpander':
+        """
+        Load expansion rules from a JSON object of term -> expansion.
+
+        Args:
+            path: Path to the JSON rules file
+
+        Returns:
+            The compiled expander (with no rules if the file is missing)
+        """
+        path = Path(path)
+        if not path.exists():
+            logger.warning(f"Query expansion file not found: {path}")
+            return cls({})
+
+        with open(path, 'r', encoding='utf-8') as f:
+            return cls(json.load(f))
+
+    def __len__(self) -> int:
+        return len(self.expansions)
+
+    def _replace(self, match: re.Match) -> str:
+        term = match.group(0)
+        return f"{term} {self.expansions[term]}"
+
+    def expand(self, text: str) -> str:
+        """Append the expansion after every rule term found in (lowercased) text."""
+        if self.pattern is None:
+            return text
+        return self.pattern.sub(self._replace, text)
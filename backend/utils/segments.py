@@ -0,0 +1,618 @@
+import json
+import logging
+import os
+import shutil
+import threading
+import uuid
+from contextlib import ExitStack, contextmanager
+from pathlib import Path
+from typing import IO, Callable, Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+import numpy as np
+
+from backend.utils.bm25_index import BM25Index, TermCounts, bm25_index_path, term_counts_path
+from backend.utils.chunk_store import ChunkStore, ChunkStoreWriter, SegmentedChunkStore, chunk_store_paths
+from backend.utils.knowledge_base import (
+    SEGMENTS_DIR, Manifest, SegmentInfo, count_base_rows, publish_manifest, read_manifest
+)
+from backend.utils.near_duplicates import (
+    DuplicateMatch, MinHashLSH, find_near_duplicates, load_signatures, minhash_path, save_signatures
+)
+from backend.utils.streaming_writer import JsonArrayWriter, NpyRowWriter, temporary_path
+from backend.utils.vector_index import build_index, index_path, normalize_rows
+
+try:
+    import fcntl
+except ImportError:  # Windows: writers are only serialized within one process
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Rows copied per block when a full compaction streams the layout into new base files
+COMPACT_BLOCK_ROWS = 4096
+
+# Lock file that serializes writers across processes (ingest, deletes, the compactor and rebuilds)
+LOCK_FILE = ".write.lock"
+
+_thread_lock = threading.RLock()
+_lock_files: Dict[Path, Tuple[IO, int]] = {}  # Held lock file and re-entry depth per directory
+_compaction_thread: Optional[threading.Thread] = None
+
+
+@contextmanager
+def write_lock(data_dir: Path, blocking: bool = True) -> Iterator[bool]:
+    """
+    Serialize every writer of a knowledge base layout.
+
+    Threads of this process wait on an RLock, other processes on an fcntl lock of
+    data_dir/.write.lock. The lock is re-entrant within a thread. Read the manifest
+    again once it is held: another writer may have published since.
+
+    Args:
+        data_dir: Knowledge base directory
+        blocking: Wait for the lock (otherwise yield False at once if another writer holds it)
+
+    Yields:
+        Whether the lock is held
+    """
+    if not _thread_lock.acquire(blocking=blocking):
+        yield False
+        return
+    try:
+        key = Path(data_dir).resolve()
+        lock_file, depth = _lock_files.get(key, (None, 0))
+        if lock_file is None:
+            key.mkdir(parents=True, exist_ok=True)
+            lock_file = open(key / LOCK_FILE, 'a')
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    lock_file.close()
+                    yield False
+                    return
+        _lock_files[key] = (lock_file, depth + 1)
+        try:
+            yield True
+        finally:
+            if depth:
+                _lock_files[key] = (lock_file, depth)
+            else:
+                # Closing the file releases the fcntl lock
+                del _lock_files[key]
+                lock_file.close()
+    finally:
+        _thread_lock.release()
+
+
+def source_stamp(path: Path) -> Optional[Tuple[int, int, int]]:
+    """Identity of a file's current version (inode, mtime and size), or None if it does not exist."""
+    try:
+        stat = Path(path).stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+def persist_derived(data_dir: Path, source: Path, stamp: Optional[Tuple[int, int, int]],
+                    save: Callable[[], None]) -> bool:
+    """
+    Persist a file a reader derived from source, unless that could replace a writer's newer file.
+
+    Skipped while a writer holds the lock, and when source changed since the reader took
+    its stamp (the derived data would be stale).
+
+    Args:
+        data_dir: Knowledge base directory
+        source: File the derived data was built from
+        stamp: source_stamp() of source taken before it was read
+        save: Writes the derived file
+
+    Returns:
+        Whether the file was saved
+    """
+    with write_lock(data_dir, blocking=False) as locked:
+        if not locked or stamp is None or source_stamp(source) != stamp:
+            return False
+        save()
+        return True
+
+
+class Segment(NamedTuple):
+    """A loaded segment: chunk records, unit-length vectors, raw term counts and MinHash signatures."""
+    name: str
+    records: List[Dict]
+    embeddings: np.ndarray
+    term_counts: TermCounts
+    signatures: Optional[np.ndarray]
+
+
+def segment_dir(data_dir: Path, name: str) -> Path:
+    return Path(data_dir) / SEGMENTS_DIR / name
+
+
+def _is_fresh(path: Path, source: Path) -> bool:
+    return path.exists() and source.exists() and path.stat().st_mtime >= source.stat().st_mtime
+
+
+def write_segment(data_dir: Path, records: List[Dict], embeddings: np.ndarray,
+                  signatures: Optional[np.ndarray] = None) -> SegmentInfo:
+    """
+    Write a new immutable segment. It is not searchable until it is added to the manifest.
+
+    Call with the write lock held: the segment is named after the highest existing one.
+
+    Args:
+        data_dir: Knowledge base directory
+        records: Chunk dicts of the segment
+        embeddings: Their embeddings, shape (len(records), dim)
+        signatures: Their MinHash signatures, if near-duplicate detection is enabled
+
+    Returns:
+        The segment's manifest entry
+    """
+    root = Path(data_dir) / SEGMENTS_DIR
+    root.mkdir(parents=True, exist_ok=True)
+    existing = [int(path.name) for path in root.iterdir() if path.name.isdigit()]
+    name = f"{max(existing, default=0) + 1:06d}"
+
+    # Written under a temporary name and renamed, so a segment directory is always complete
+    tmp_dir = root / f"{name}.{uuid.uuid4().hex}.tmp"
+    tmp_dir.mkdir()
+    with open(tmp_dir / "metadata.json", 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    np.save(tmp_dir / "embeddings.npy", normalize_rows(embeddings))
+    TermCounts.count([record['content'] for record in records]).save(term_counts_path(tmp_dir))
+    if signatures is not None:
+        np.save(minhash_path(tmp_dir), signatures)
+    tmp_dir.rename(root / name)
+    return SegmentInfo(name, len(records))
+
+
+def load_segment(data_dir: Path, name: str) -> Segment:
+    """Read a segment fully into memory (segments are small; the compactor keeps them so)."""
+    path = segment_dir(data_dir, name)
+    with open(path / "metadata.json", 'r', encoding='utf-8') as f:
+        records = json.load(f)
+    signatures = np.load(minhash_path(path)) if minhash_path(path).exists() else None
+    return Segment(name, records, np.load(path / "embeddings.npy"), TermCounts.load(term_counts_path(path)),
+                   signatures)
+
+
+def load_chunks(data_dir: Path, segments: List[Segment]) -> ChunkStore:
+    """
+    Chunk records of the whole layout, numbered like the manifest rows.
+
+    Args:
+        data_dir: Knowledge base directory
+        segments: Loaded segments of the manifest, in order
+
+    Returns:
+        The base (read lazily when its chunk store is current) followed by each segment
+    """
+    data_dir = Path(data_dir)
+    metadata_path = data_dir / "metadata.json"
+    base = None
+    if _is_fresh(chunk_store_paths(data_dir)[1], metadata_path):
+        base = ChunkStore.open(data_dir)
+    if base is None:
+        records = []
+        if metadata_path.exists():
+            with open(metadata_path, 'r', encoding='utf-8') as f:
+                records = json.load(f)
+        base = ChunkStore.from_records(records)
+    if not segments:
+        return base
+    return SegmentedChunkStore([base] + [ChunkStore.from_records(segment.records) for segment in segments])
+
+
+def load_base_term_counts(data_dir: Path, chunks: ChunkStore,
+                          stamp: Optional[Tuple[int, int, int]] = None) -> TermCounts:
+    """
+    Raw term counts of the base rows, counted once from the chunk text if missing or stale.
+
+    Args:
+        data_dir: Knowledge base directory
+        chunks: Base chunk records
+        stamp: source_stamp() of metadata.json taken before chunks were read (recounted
+            counts are only persisted when it is given and still current)
+    """
+    path = term_counts_path(data_dir)
+    metadata_path = Path(data_dir) / "metadata.json"
+    if _is_fresh(path, metadata_path):
+        counts = TermCounts.load(path)
+        if counts is not None and len(counts.doc_lengths) == len(chunks):
+            return counts
+    counts = TermCounts.count([chunk['content'] for chunk in chunks])
+    try:
+        persist_derived(data_dir, metadata_path, stamp, lambda: counts.save(path))
+    except Exception as e:
+        logger.warning(f"Could not persist base term counts: {e}")
+    return counts
+
+
+def minhash_index(config) -> Optional[MinHashLSH]:
+    """MinHash index of the configured near-duplicate detection (None when it is disabled)."""
+    if config.DEDUP_THRESHOLD <= 0:
+        return None
+    return MinHashLSH(config.MINHASH_PERMUTATIONS, config.MINHASH_BANDS, config.DEDUP_THRESHOLD)
+
+
+def load_base_signatures(data_dir: Path, config) -> Optional[np.ndarray]:
+    """
+    MinHash signatures of the base rows, computed and persisted once if missing or stale.
+
+    Runs under the write lock, so the signatures always match the base files they are saved next to.
+
+    Returns:
+        Signatures of shape (base rows, MINHASH_PERMUTATIONS), or None when deduplication is disabled
+    """
+    lsh = minhash_index(config)
+    if lsh is None:
+        return None
+    with write_lock(data_dir):
+        chunks = load_chunks(data_dir, [])
+        try:
+            return load_signatures(data_dir, lsh, chunks, save=True)
+        finally:
+            chunks.close()
+
+
+def find_layout_duplicates(data_dir: Path, signatures: np.ndarray,
+                           config) -> Tuple[List[DuplicateMatch], int, Dict[int, str]]:
+    """
+    Near-duplicates of new chunks among the live rows of the knowledge base and each other.
+
+    The manifest, segments and base signatures are read under the write lock, so they
+    all come from one layout even while the compactor rewrites the base.
+
+    Args:
+        data_dir: Knowledge base directory
+        signatures: MinHash signatures of the new chunks, in ingest order
+        config: Config with the deduplication settings
+
+    Returns:
+        The matches (new rows numbered from the returned offset, see find_near_duplicates()),
+        the number of existing rows, and 'category/chunk_id' of each existing row a match points to
+    """
+    lsh = minhash_index(config)
+    with write_lock(data_dir):
+        manifest = read_manifest(data_dir)
+        segments = [load_segment(data_dir, segment.name) for segment in manifest.segments]
+        existing = np.concatenate(
+            [load_base_signatures(data_dir, config)] +
+            [segment.signatures if segment.signatures is not None
+             else lsh.signatures([record['content'] for record in segment.records])
+             for segment in segments]
+        )
+        matches = find_near_duplicates(signatures, lsh, existing, deleted=manifest.tombstones)
+
+        offset = len(existing)
+        targets = {match.duplicate_of for match in matches if match.duplicate_of < offset}
+        names = {}
+        if targets:
+            chunks = load_chunks(data_dir, segments)
+            try:
+                names = {row: f"{chunks.categories[row]}/{chunks.chunk_ids[row] or row}" for row in targets}
+            finally:
+                chunks.close()
+    return matches, offset, names
+
+
+def write_base(data_dir: Path, records: List[Dict], embeddings: np.ndarray, config,
+               term_counts: Optional[TermCounts] = None, signatures: Optional[np.ndarray] = None):
+    """
+    Rewrite the base files: metadata, vectors, ANN and BM25 indexes, chunk store and signatures.
+
+    Every file is written to a temporary name and renamed, because running retrievers
+    memory-map them. Call with the write lock held, and publish the new layout with
+    publish_manifest() afterwards.
+
+    Args:
+        data_dir: Knowledge base directory
+        records: Chunk dicts of every base row
+        embeddings: Their embeddings, shape (len(records), dim)
+        config: Config with the index settings
+        term_counts: Raw term counts of records (counted from the text if omitted)
+        signatures: MinHash signatures of records (computed from the text if omitted, unless
+            deduplication is disabled)
+    """
+    data_dir = Path(data_dir)
+    data_dir.mkdir(parents=True, exist_ok=True)
+    metadata_path = data_dir / "metadata.json"
+    embeddings_path = data_dir / "embeddings.npy"
+
+    # Store unit-length float32 vectors so retrievers can memory-map them as-is
+    embeddings = normalize_rows(embeddings)
+
+    tmp_metadata_path = temporary_path(metadata_path)
+    with open(tmp_metadata_path, 'w', encoding='utf-8') as f:
+        json.dump(records, f, ensure_ascii=False, indent=2)
+    tmp_embeddings_path = temporary_path(embeddings_path)
+    with open(tmp_embeddings_path, 'wb') as f:
+        np.save(f, embeddings)
+    tmp_embeddings_path.replace(embeddings_path)
+    tmp_metadata_path.replace(metadata_path)
+
+    # Offset-indexed chunk text for lazily loading retrievers
+    ChunkStore.write(records, data_dir)
+
+    if signatures is None and minhash_index(config) is not None:
+        signatures = minhash_index(config).signatures([record['content'] for record in records])
+    if signatures is not None:
+        save_signatures(signatures, data_dir)
+    else:
+        minhash_path(data_dir).unlink(missing_ok=True)
+
+    if term_counts is None:
+        term_counts = TermCounts.count([record['content'] for record in records])
+    _write_base_indexes(data_dir, embeddings, config, term_counts)
+
+
+def _write_base_indexes(data_dir: Path, embeddings: np.ndarray, config, term_counts: TermCounts):
+    """Build the ANN and BM25 indexes of freshly written base files."""
+    # Rebuild the ANN index at ingest time so retrievers can load it directly
+    # (the stream index reads embeddings.npy itself and has nothing to build)
+    if config.INDEX_TYPE != 'stream':
+        index = build_index(
+            embeddings,
+            index_type=config.INDEX_TYPE,
+            nlist=config.IVF_NLIST,
+            hnsw_m=config.HNSW_M,
+            quantization=config.EMBEDDING_QUANTIZATION
+        )
+        index.save(index_path(data_dir, config.INDEX_TYPE, config.EMBEDDING_QUANTIZATION))
+
+    term_counts.save(term_counts_path(data_dir))
+    BM25Index.from_counts([term_counts], k1=config.BM25_K1, b=config.BM25_B).save(bm25_index_path(data_dir))
+
+
+def _rewrite_base(data_dir: Path, manifest: Manifest, segments: List[Segment], deleted: np.ndarray,
+                  config) -> int:
+    """
+    Write new base files from the current base and every segment, without the deleted rows.
+
+    Rows are streamed block by block from the memory-mapped base into the new files, so
+    the base is never held in memory. Call with the write lock held.
+
+    Args:
+        data_dir: Knowledge base directory
+        manifest: Current layout
+        segments: Its loaded segments
+        deleted: Deletion flag of every row of the layout
+        config: Config with the index and deduplication settings
+
+    Returns:
+        Rows of the new base
+    """
+    metadata_path = data_dir / "metadata.json"
+    embeddings_path = data_dir / "embeddings.npy"
+    base_chunks = load_chunks(data_dir, [])
+    base_counts = load_base_term_counts(data_dir, base_chunks, source_stamp(metadata_path))
+    lsh = minhash_index(config)
+    parts = [(base_chunks, np.load(embeddings_path, mmap_mode='r'), load_base_signatures(data_dir, config))]
+    parts += [(ChunkStore.from_records(s.records), s.embeddings, s.signatures) for s in segments]
+    rows = int((~deleted).sum())
+
+    # Derived files are entered first so they are published after metadata.json and embeddings.npy
+    with ExitStack() as stack:
+        signature_writer = None
+        if lsh is not None:
+            signature_writer = stack.enter_context(
+                NpyRowWriter(minhash_path(data_dir), rows, dim=lsh.num_perm, dtype=np.uint32))
+        chunk_writer = stack.enter_context(ChunkStoreWriter(data_dir))
+        vector_writer = stack.enter_context(NpyRowWriter(embeddings_path, rows, dim=manifest.dim))
+        metadata_writer = stack.enter_context(JsonArrayWriter(metadata_path))
+
+        first_row = 0
+        for chunks, embeddings, signatures in parts:
+            kept = np.flatnonzero(~deleted[first_row:first_row + len(chunks)])
+            first_row += len(chunks)
+            for start in range(0, len(kept), COMPACT_BLOCK_ROWS):
+                block = kept[start:start + COMPACT_BLOCK_ROWS]
+                records = [chunks[row] for row in block]
+                for record in records:
+                    metadata_writer.write(record)
+                    chunk_writer.write(record)
+                vector_writer.append(normalize_rows(np.asarray(embeddings[block])))
+                if signature_writer is not None:
+                    # Segments written while deduplication was disabled get their signatures now
+                    signature_writer.append(signatures[block] if signatures is not None
+                                            else lsh.signatures([record['content'] for record in records]))
+    base_chunks.close()
+
+    # Derived files count as current when they are at least as new as metadata.json, but
+    # their last write can precede its closing bracket (or go through a memory map)
+    derived = list(chunk_store_paths(data_dir))
+    if lsh is None:
+        minhash_path(data_dir).unlink(missing_ok=True)
+    else:
+        derived.append(minhash_path(data_dir))
+    for path in derived:
+        os.utime(path)
+
+    term_counts = TermCounts.concat([base_counts] + [s.term_counts for s in segments])
+    _write_base_indexes(data_dir, np.load(embeddings_path, mmap_mode='r'), config,
+                        term_counts.select(np.flatnonzero(~deleted)))
+    return rows
+
+
+def append_segment(data_dir: Path, records: List[Dict], embeddings: np.ndarray, config,
+                   signatures: Optional[np.ndarray] = None) -> int:
+    """
+    Add chunks to the knowledge base without rewriting what is already there.
+
+    The first ingest into an empty knowledge base writes the base files instead.
+
+    Args:
+        data_dir: Knowledge base directory
+        records: New chunk dicts
+        embeddings: Their embeddings, shape (len(records), dim)
+        config: Config with the index and compaction settings
+        signatures: Their MinHash signatures, if near-duplicate detection is enabled
+
+    Returns:
+        The new knowledge base generation
+    """
+    with write_lock(data_dir):
+        manifest = read_manifest(data_dir)
+        if manifest.total_rows == 0:
+            write_base(data_dir, records, embeddings, config, signatures=signatures)
+            manifest = Manifest(len(records), [], [])
+        else:
+            segment = write_segment(data_dir, records, embeddings, signatures)
+            manifest = manifest._replace(segments=manifest.segments + [segment])
+        generation = publish_manifest(data_dir, manifest, config.EMBEDDING_MODEL)
+    schedule_compaction(data_dir, config)
+    return generation
+
+
+def add_tombstones(data_dir: Path, category: str, config) -> Tuple[int, Optional[int]]:
+    """
+    Tombstone every chunk of a category; the rows are dropped from the files at the next compaction.
+
+    Rows are resolved under the write lock against the current manifest, so a compaction
+    that renumbers them cannot run in between.
+
+    Args:
+        data_dir: Knowledge base directory
+        category: Category (document name) whose chunks to delete
+        config: Config with the compaction settings
+
+    Returns:
+        The number of rows deleted and the new knowledge base generation (None if nothing matched)
+    """
+    with write_lock(data_dir):
+        manifest = read_manifest(data_dir)
+        segments = [load_segment(data_dir, segment.name) for segment in manifest.segments]
+        chunks = load_chunks(data_dir, segments)
+        try:
+            tombstones = set(manifest.tombstones)
+            rows = [row for row, row_category in enumerate(chunks.categories)
+                    if row_category == category and row not in tombstones]
+        finally:
+            chunks.close()
+        if not rows:
+            return 0, None
+        generation = publish_manifest(data_dir, manifest._replace(tombstones=sorted(tombstones | set(rows))),
+                                      config.EMBEDDING_MODEL)
+    schedule_compaction(data_dir, config)
+    return len(rows), generation
+
+
+def reset_layout(data_dir: Path, config) -> int:
+    """
+    Drop every segment and tombstone after the base files were rebuilt from scratch.
+
+    Args:
+        data_dir: Knowledge base directory
+        config: Config with the embedding model
+
+    Returns:
+        The new knowledge base generation
+    """
+    with write_lock(data_dir):
+        shutil.rmtree(Path(data_dir) / SEGMENTS_DIR, ignore_errors=True)
+        return publish_manifest(data_dir, Manifest(count_base_rows(data_dir), [], []), config.EMBEDDING_MODEL)
+
+
+def compaction_plan(manifest: Manifest, config) -> Optional[str]:
+    """
+    Decide what the compactor should do with a layout.
+
+    Returns:
+        'full' to fold segments and tombstones into new base files once they amount to
+        COMPACT_RATIO of the base, 'merge' to merge the segments into one when there are
+        SEGMENT_MERGE_THRESHOLD or more, or None
+    """
+    pending = sum(segment.rows for segment in manifest.segments) + len(manifest.tombstones)
+    if pending and pending >= config.COMPACT_RATIO * manifest.base_rows:
+        return 'full'
+    if len(manifest.segments) >= max(config.SEGMENT_MERGE_THRESHOLD, 2):
+        return 'merge'
+    return None
+
+
+def compact(data_dir: Path, config, plan: Optional[str] = None) -> Optional[int]:
+    """
+    Merge segments (and drop tombstoned rows) according to compaction_plan().
+
+    Args:
+        data_dir: Knowledge base directory
+        config: Config with the index and compaction settings
+        plan: 'full' or 'merge' to force a compaction (None follows compaction_plan())
+
+    Returns:
+        The new generation, or None if there was nothing to do
+    """
+    data_dir = Path(data_dir)
+    with write_lock(data_dir):
+        manifest = read_manifest(data_dir)
+        plan = plan or compaction_plan(manifest, config)
+        if plan is None or (not manifest.segments and not manifest.tombstones):
+            return None
+
+        segments = [load_segment(data_dir, segment.name) for segment in manifest.segments]
+        deleted = np.zeros(manifest.total_rows, dtype=bool)
+        deleted[manifest.tombstones] = True
+
+        if plan == 'full':
+            new_manifest = Manifest(_rewrite_base(data_dir, manifest, segments, deleted, config), [], [])
+        else:
+            keep = np.flatnonzero(~deleted[manifest.base_rows:])
+            records = [record for segment in segments for record in segment.records]
+            records = [records[row] for row in keep]
+            embeddings = np.concatenate([segment.embeddings for segment in segments])[keep]
+            signatures = None
+            lsh = minhash_index(config)
+            if lsh is not None:
+                # Segments written while deduplication was disabled get their signatures now
+                signatures = np.concatenate([
+                    segment.signatures if segment.signatures is not None
+                    else lsh.signatures([record['content'] for record in segment.records])
+                    for segment in segments
+                ])[keep]
+
+            # Base rows are untouched, so their tombstones keep their row numbers
+            merged = [write_segment(data_dir, records, embeddings, signatures)] if records else []
+            base_tombstones = [row for row in manifest.tombstones if row < manifest.base_rows]
+            new_manifest = Manifest(manifest.base_rows, merged, base_tombstones)
+
+        generation = publish_manifest(data_dir, new_manifest, config.EMBEDDING_MODEL)
+
+        # Retrievers hold loaded segments in memory, so replaced directories can go right away
+        live = {segment.name for segment in new_manifest.segments}
+        for path in (data_dir / SEGMENTS_DIR).iterdir():
+            if path.name not in live:
+                shutil.rmtree(path, ignore_errors=True)
+
+    logger.info(f"Compacted knowledge base ({plan}): {manifest.total_rows} rows in "
+                f"{len(manifest.segments)} segments -> {new_manifest.total_rows} rows in "
+                f"{len(new_manifest.segments)} segments (generation {generation})")
+    return generation
+
+
+def schedule_compaction(data_dir: Path, config) -> bool:
+    """
+    Start the compactor on a background thread if the layout needs it and it is not running.
+
+    Returns:
+        Whether a compaction was started
+    """
+    global _compaction_thread
+    with _thread_lock:
+        if _compaction_thread is not None and _compaction_thread.is_alive():
+            return False
+        if compaction_plan(read_manifest(data_dir), config) is None:
+            return False
+        _compaction_thread = threading.Thread(target=_compaction_worker, args=(data_dir, config),
+                                              name="kb-compactor", daemon=True)
+        _compaction_thread.start()
+        return True
+
+
+def _compaction_worker(data_dir: Path, config):
+    try:
+        compact(data_dir, config)
+    except Exception as e:
+        logger.error(f"Knowledge base compaction failed: {e}")
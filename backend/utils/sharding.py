@@ -0,0 +1,121 @@
+import heapq
+from concurrent.futures import Executor
+from itertools import islice
+from pathlib import Path
+from typing import Callable, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from backend.utils.bm25_index import BM25Index
+from backend.utils.vector_index import VectorIndex, normalize_rows
+
+
+def shard_bounds(n_rows: int, n_shards: int) -> np.ndarray:
+    """Boundaries of n_shards contiguous, near-equal row ranges, shape (n_shards + 1,)."""
+    n_shards = max(1, min(n_shards, n_rows))
+    return np.linspace(0, n_rows, n_shards + 1).astype(np.int64)
+
+
+def shard_path(path: Path, shard: int, n_shards: int) -> Path:
+    """Location of one shard of a persisted index, next to the unsharded file."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.shard{shard}of{n_shards}{path.suffix}")
+
+
+def merge_top_k(shard_results: Iterable[Tuple[np.ndarray, np.ndarray]], k: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    k-way heap merge of per-shard results.
+
+    Args:
+        shard_results: (row_ids, scores) per shard, each sorted best first
+        k: Number of results to keep
+
+    Returns:
+        Tuple of (row_ids, scores) of the overall top k, best first. Ties keep
+        shard order, which matches the row order an unsharded scan would return.
+    """
+    streams = [zip(scores.tolist(), ids.tolist()) for ids, scores in shard_results]
+    best = list(islice(heapq.merge(*streams, key=lambda item: item[0], reverse=True), k))
+    return (np.fromiter((row for _, row in best), dtype=np.int64, count=len(best)),
+            np.fromiter((score for score, _ in best), dtype=np.float32, count=len(best)))
+
+
+def _run(executor: Optional[Executor], fn: Callable, jobs: List) -> List:
+    """Run fn over jobs on the executor, or inline when there is nothing to parallelize."""
+    if executor is None or len(jobs) <= 1:
+        return [fn(job) for job in jobs]
+    return list(executor.map(fn, jobs))
+
+
+class ShardedVectorIndex(VectorIndex):
+    """Vector indexes over contiguous row ranges, searched in parallel and merged."""
+
+    def __init__(self, shards: List[VectorIndex], bounds: np.ndarray, executor: Optional[Executor] = None):
+        """
+        Args:
+            shards: One index per row range, each addressing its rows from 0
+            bounds: Shard boundaries in global row ids, shape (len(shards) + 1,)
+            executor: Pool the shards are searched on (NumPy and FAISS release the GIL)
+        """
+        self.shards = shards
+        self.bounds = np.asarray(bounds, dtype=np.int64)
+        self.executor = executor
+        self.index_type = shards[0].index_type
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.bounds[-1])
+
+    def search(self, queries: np.ndarray, k: int,
+               subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(queries)
+
+        jobs = []
+        for shard, start, end in zip(self.shards, self.bounds[:-1], self.bounds[1:]):
+            local = None
+            if subset is not None:
+                # subset is sorted, so each shard's part is one contiguous slice
+                lo, hi = np.searchsorted(subset, [start, end])
+                if lo == hi:
+                    continue
+                local = subset[lo:hi] - start
+            jobs.append((shard, start, local))
+
+        results = _run(self.executor, lambda job: job[0].search(queries, k, job[2]), jobs)
+
+        width = max(min(k, self.ntotal if subset is None else len(subset)), 0)
+        scores = np.full((len(queries), width), -np.inf, dtype=np.float32)
+        ids = np.full((len(queries), width), -1, dtype=np.int64)
+        for q in range(len(queries)):
+            shard_results = []
+            for (_, start, _), (shard_scores, shard_ids) in zip(jobs, results):
+                valid = shard_ids[q] >= 0
+                shard_results.append((shard_ids[q][valid] + start, shard_scores[q][valid]))
+            row_ids, row_scores = merge_top_k(shard_results, width)
+            ids[q, :len(row_ids)] = row_ids
+            scores[q, :len(row_scores)] = row_scores
+        return scores, ids
+
+
+class ShardedBM25Index:
+    """BM25 posting lists split over document ranges, searched in parallel and merged."""
+
+    def __init__(self, shards: List[BM25Index], executor: Optional[Executor] = None):
+        """
+        Args:
+            shards: Shards from BM25Index.split(), which share global ids and bounds
+            executor: Pool the shards are searched on
+        """
+        self.shards = shards
+        self.executor = executor
+        self.num_docs = shards[0].num_docs
+
+    def search(self, query: str, k: int, allowed: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """Top-k documents for a query, with the same scores as the unsharded index."""
+        return self.search_batch([query], k, allowed)[0]
+
+    def search_batch(self, queries: List[str], k: int,
+                     allowed: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Top-k documents for several queries, one (doc_ids, scores) tuple per query."""
+        results = _run(self.executor, lambda shard: shard.search_batch(queries, k, allowed), self.shards)
+        return [merge_top_k([shard_results[q] for shard_results in results], k) for q in range(len(queries))]
@@ -0,0 +1,121 @@
+import json
+import uuid
+from pathlib import Path
+from typing import Dict, Optional
+
+import numpy as np
+
+
+def temporary_path(path: Path) -> Path:
+    """
+    Unique temporary name next to path, to write to and then rename onto path.
+
+    Unique per call, so concurrent writers (threads or processes) never write into each other's file.
+    """
+    path = Path(path)
+    return path.with_name(f"{path.name}.{uuid.uuid4().hex}.tmp")
+
+
+class NpyRowWriter:
+    """Appends rows into a preallocated, memory-mapped .npy file."""
+
+    def __init__(self, path: Path, rows: int, dim: Optional[int] = None, dtype=np.float32):
+        """
+        Prepare the writer. The file is created on the first append, once the row width is known.
+
+        Args:
+            path: Destination .npy file (written under a temporary name and renamed on close)
+            rows: Total number of rows that will be appended
+            dim: Row width, if known up front (keeps the shape of an empty file at (0, dim))
+            dtype: Element type of the file
+        """
+        self.path = Path(path)
+        self.rows = rows
+        self.dim = dim
+        self.dtype = dtype
+        self.written = 0
+        self._tmp_path = temporary_path(self.path)
+        self._array: Optional[np.memmap] = None
+
+    def append(self, batch: np.ndarray):
+        """Copy a (n, dim) batch to the next n rows; only the current batch is ever in memory."""
+        if len(batch) == 0:
+            return
+        if self._array is None:
+            self._array = np.lib.format.open_memmap(self._tmp_path, mode='w+', dtype=self.dtype,
+                                                    shape=(self.rows, batch.shape[1]))
+        if self.written + len(batch) > self.rows:
+            raise ValueError(f"{self.path} was sized for {self.rows} rows, got {self.written + len(batch)}")
+        self._array[self.written:self.written + len(batch)] = batch
+        self.written += len(batch)
+
+    def close(self):
+        """Flush and publish the file."""
+        if self.written != self.rows:
+            raise ValueError(f"{self.path} was sized for {self.rows} rows but {self.written} were written")
+        if self._array is None:
+            # Through a file object: np.save would append '.npy' to the tmp name
+            with open(self._tmp_path, 'wb') as f:
+                np.save(f, np.empty((0, self.dim or 0), dtype=self.dtype))
+        else:
+            self._array.flush()
+            del self._array
+            self._array = None
+        self._tmp_path.replace(self.path)
+
+    def abort(self):
+        """Discard a partially written file."""
+        self._array = None
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> 'NpyRowWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+
+class JsonArrayWriter:
+    """Writes a JSON array one record per line, so records never accumulate in memory."""
+
+    def __init__(self, path: Path):
+        """
+        Open the file (written under a temporary name and renamed on close).
+
+        Args:
+            path: Destination .json file
+        """
+        self.path = Path(path)
+        self.count = 0
+        self._tmp_path = temporary_path(self.path)
+        self._file = open(self._tmp_path, 'w', encoding='utf-8')
+        self._file.write('[')
+
+    def write(self, record: Dict):
+        """Append one record."""
+        self._file.write(',\n' if self.count else '\n')
+        self._file.write(json.dumps(record, ensure_ascii=False))
+        self.count += 1
+
+    def close(self):
+        """Finish the array and publish the file."""
+        self._file.write('\n]\n')
+        self._file.close()
+        self._tmp_path.replace(self.path)
+
+    def abort(self):
+        """Discard a partially written file."""
+        self._file.close()
+        self._tmp_path.unlink(missing_ok=True)
+
+    def __enter__(self) -> 'JsonArrayWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
@@ -0,0 +1,536 @@
+import logging
+import threading
+from pathlib import Path
+from typing import Optional, Tuple
+
+import numpy as np
+
+from backend.utils.streaming_writer import temporary_path
+
+logger = logging.getLogger(__name__)
+
+# Supported index backends. "exact" is the brute-force fallback that needs no FAISS;
+# "stream" is the same exact scan read block by block from embeddings.npy.
+INDEX_TYPES = ('exact', 'flat', 'ivf', 'hnsw', 'stream')
+
+# Optional compressed storage for the first-pass scan, rescored in float32
+QUANTIZATIONS = ('none', 'float16', 'int8')
+
+# FAISS warns when an IVF quantizer gets fewer than ~39 training points per list
+MIN_POINTS_PER_LIST = 39
+
+# Rows converted to float32 at a time when scanning quantized codes
+SCAN_BLOCK_ROWS = 65536
+
+
+def _import_faiss():
+    """Import FAISS, raising a clear error if it is not installed."""
+    try:
+        import faiss
+    except ImportError as e:
+        raise ImportError("faiss-cpu is required for the 'flat', 'ivf' and 'hnsw' index types") from e
+    return faiss
+
+
+def normalize_rows(vectors: np.ndarray) -> np.ndarray:
+    """
+    Return a float32, C-contiguous, L2-normalized version of a 2D array.
+
+    Arrays that are already float32 and unit length are returned as-is.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    # einsum avoids a full-size temporary, which matters for memory-mapped matrices
+    norms = np.sqrt(np.einsum('ij,ij->i', vectors, vectors))[:, np.newaxis]
+    if np.allclose(norms, 1.0, atol=1e-5):
+        return vectors
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def top_k_indices(scores: np.ndarray, k: int) -> np.ndarray:
+    """
+    Column indices of the k highest scores in each row, best first.
+
+    Uses an O(N) argpartition per row and only sorts the k survivors.
+
+    Args:
+        scores: Score matrix of shape (n_queries, n_rows)
+        k: Number of indices to keep per row
+
+    Returns:
+        Index matrix of shape (n_queries, min(k, n_rows))
+    """
+    k = min(k, scores.shape[1])
+    if k <= 0:
+        return np.empty((scores.shape[0], 0), dtype=np.int64)
+    if k < scores.shape[1]:
+        candidates = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    else:
+        candidates = np.broadcast_to(np.arange(k), scores.shape).copy()
+    order = np.argsort(-np.take_along_axis(scores, candidates, axis=1), axis=1, kind='stable')
+    return np.take_along_axis(candidates, order, axis=1).astype(np.int64)
+
+
+def index_path(data_dir: Path, index_type: str, quantization: str = 'none') -> Path:
+    """Location of the persisted index for a given backend, next to metadata.json."""
+    if quantization == 'none':
+        return Path(data_dir) / f"index_{index_type}.faiss"
+    if index_type == 'exact':
+        # Plain .npy codes so they can be memory-mapped
+        return Path(data_dir) / f"embeddings_{quantization}.npy"
+    return Path(data_dir) / f"index_{index_type}_{quantization}.faiss"
+
+
+class VectorIndex:
+    """Base class for dense vector indexes scored by cosine similarity."""
+
+    index_type = 'base'
+
+    @property
+    def ntotal(self) -> int:
+        raise NotImplementedError
+
+    def search(self, queries: np.ndarray, k: int,
+               subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Find the k most similar rows for each query.
+
+        Args:
+            queries: Query embeddings of shape (n_queries, dim)
+            k: Number of neighbours to return per query
+            subset: Sorted row ids to restrict the search to (None searches all rows)
+
+        Returns:
+            Tuple of (scores, row_ids), each of shape (n_queries, k). Missing
+            neighbours are reported with row id -1.
+        """
+        raise NotImplementedError
+
+    def save(self, path: Path):
+        """Persist the index to disk (no-op for indexes that are rebuilt on load)."""
+
+
+class ExactIndex(VectorIndex):
+    """Brute-force scan of the full embedding matrix with a single matrix product."""
+
+    index_type = 'exact'
+
+    def __init__(self, embeddings: np.ndarray):
+        # Normalize once so each query costs one GEMV (returned as-is if already unit length)
+        self.embeddings = normalize_rows(embeddings)
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.embeddings)
+
+    def search(self, queries: np.ndarray, k: int,
+               subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        # With a subset only those rows are read and scored
+        embeddings = self.embeddings if subset is None else self.embeddings[subset]
+        similarities = normalize_rows(queries) @ embeddings.T
+        ids = top_k_indices(similarities, k)
+        scores = np.take_along_axis(similarities, ids, axis=1)
+        return scores, ids if subset is None else subset[ids]
+
+
+class QuantizedIndex(VectorIndex):
+    """Brute-force scan over float16 or per-dimension scalar int8 codes (approximate scores)."""
+
+    index_type = 'exact'
+
+    def __init__(self, codes: np.ndarray, quantization: str,
+                 offsets: Optional[np.ndarray] = None, scales: Optional[np.ndarray] = None):
+        """
+        Wrap quantized codes. Use quantize() or load() rather than calling this directly.
+
+        Args:
+            codes: Code matrix of shape (n_rows, dim), float16 or int8
+            quantization: 'float16' or 'int8'
+            offsets: Per-dimension minimum (int8 only)
+            scales: Per-dimension step size (int8 only)
+        """
+        self.codes = codes
+        self.quantization = quantization
+        self.offsets = offsets
+        self.scales = scales
+
+    @classmethod
+    def quantize(cls, embeddings: np.ndarray, quantization: str) -> 'QuantizedIndex':
+        """
+        Compress L2-normalized embeddings.
+
+        Args:
+            embeddings: Embedding matrix of shape (n_rows, dim)
+            quantization: 'float16' (2x smaller) or 'int8' (4x smaller)
+
+        Returns:
+            The quantized index
+        """
+        if quantization == 'float16':
+            return cls(normalize_rows(embeddings).astype(np.float16), quantization)
+
+        codes = np.empty(embeddings.shape, dtype=np.int8)
+        offsets = np.full(embeddings.shape[1], np.inf, dtype=np.float32)
+        maxima = np.full(embeddings.shape[1], -np.inf, dtype=np.float32)
+        for start in range(0, len(embeddings), SCAN_BLOCK_ROWS):
+            block = normalize_rows(embeddings[start:start + SCAN_BLOCK_ROWS])
+            offsets = np.minimum(offsets, block.min(axis=0))
+            maxima = np.maximum(maxima, block.max(axis=0))
+        scales = np.maximum(maxima - offsets, 1e-12) / 255.0
+
+        for start in range(0, len(embeddings), SCAN_BLOCK_ROWS):
+            block = normalize_rows(embeddings[start:start + SCAN_BLOCK_ROWS])
+            levels = np.rint((block - offsets) / scales)
+            codes[start:start + len(block)] = (np.clip(levels, 0, 255) - 128).astype(np.int8)
+        return cls(codes, quantization, offsets, scales)
+
+    @property
+    def ntotal(self) -> int:
+        return len(self.codes)
+
+    def search(self, queries: np.ndarray, k: int,
+               subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(queries)
+        if self.quantization == 'int8':
+            # x ~= (code + 128) * scale + offset, folded into the query side
+            weights = queries * self.scales
+            bias = 128.0 * weights.sum(axis=1) + queries @ self.offsets
+        else:
+            weights, bias = queries, 0.0
+
+        n_rows = self.ntotal if subset is None else len(subset)
+        similarities = np.empty((len(queries), n_rows), dtype=np.float32)
+        for start in range(0, n_rows, SCAN_BLOCK_ROWS):
+            # Only one block is ever expanded to float32
+            if subset is None:
+                block = self.codes[start:start + SCAN_BLOCK_ROWS]
+            else:
+                block = self.codes[subset[start:start + SCAN_BLOCK_ROWS]]
+            block = block.astype(np.float32)
+            similarities[:, start:start + len(block)] = (block @ weights.T).T
+        similarities += np.reshape(bias, (-1, 1))
+
+        ids = top_k_indices(similarities, k)
+        scores = np.take_along_axis(similarities, ids, axis=1)
+        return scores, ids if subset is None else subset[ids]
+
+    def save(self, path: Path):
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = temporary_path(path)
+        with open(tmp_path, 'wb') as f:
+            np.save(f, self.codes)
+        if self.quantization == 'int8':
+            tmp_params_path = temporary_path(_params_path(path))
+            with open(tmp_params_path, 'wb') as f:
+                np.save(f, np.stack([self.offsets, self.scales]))
+            tmp_params_path.replace(_params_path(path))
+        tmp_path.replace(path)
+
+    @classmethod
+    def load(cls, path: Path, quantization: str, mmap: bool = True) -> Optional['QuantizedIndex']:
+        """Load persisted codes (memory-mapped by default), or None if missing."""
+        path = Path(path)
+        if not path.exists():
+            return None
+        codes = np.load(path, mmap_mode='r' if mmap else None)
+        if quantization == 'int8':
+            offsets, scales = np.load(_params_path(path))
+            return cls(codes, quantization, offsets, scales)
+        return cls(codes, quantization)
+
+
+class StreamingIndex(VectorIndex):
+    """Exact scan that streams a .npy embedding file in fixed-size blocks, for matrices larger than RAM."""
+
+    index_type = 'stream'
+
+    def __init__(self, path: Path, start: int = 0, end: Optional[int] = None, block_rows: int = 16384):
+        """
+        Read the .npy header; no embedding data is loaded until a search.
+
+        Args:
+            path: Embedding matrix saved with np.save (2D, C order)
+            start: First row of the file covered by this index (for sharding)
+            end: Row after the last one covered (None means the end of the file)
+            block_rows: Rows read per block; the working set is one block per searching thread
+        """
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            version = np.lib.format.read_magic(f)
+            if version == (1, 0):
+                shape, fortran_order, dtype = np.lib.format.read_array_header_1_0(f)
+            else:
+                shape, fortran_order, dtype = np.lib.format.read_array_header_2_0(f)
+            self.data_offset = f.tell()
+        if len(shape) != 2 or fortran_order:
+            raise ValueError(f"{self.path} must hold a 2D C-order matrix, got shape {shape}")
+
+        self.dtype = dtype
+        self.dim = shape[1]
+        self.row_bytes = self.dim * dtype.itemsize
+        self.start = start
+        self.end = shape[0] if end is None else end
+        self.block_rows = max(1, block_rows)
+        self._local = threading.local()
+
+    @property
+    def ntotal(self) -> int:
+        return self.end - self.start
+
+    def _buffer(self) -> np.ndarray:
+        """Block buffer reused across blocks and searches, one per thread."""
+        buffer = getattr(self._local, 'buffer', None)
+        if buffer is None:
+            buffer = np.empty((self.block_rows, self.dim), dtype=self.dtype)
+            self._local.buffer = buffer
+        return buffer
+
+    def search(self, queries: np.ndarray, k: int,
+               subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(queries)
+        buffer = self._buffer()
+        best_scores = np.empty((len(queries), 0), dtype=np.float32)
+        best_ids = np.empty((len(queries), 0), dtype=np.int64)
+
+        with open(self.path, 'rb', buffering=0) as f:
+            for block_start in range(0, self.ntotal, self.block_rows):
+                rows = min(self.block_rows, self.ntotal - block_start)
+                block_ids = None
+                if subset is not None:
+                    lo, hi = np.searchsorted(subset, [block_start, block_start + rows])
+                    if lo == hi:
+                        continue  # no requested rows in this block, skip the read
+                    block_ids = subset[lo:hi]
+
+                f.seek(self.data_offset + (self.start + block_start) * self.row_bytes)
+                block = buffer[:rows]
+                view = memoryview(block).cast('B')
+                filled = 0
+                while filled < len(view):
+                    read = f.readinto(view[filled:])
+                    if not read:
+                        raise ValueError(f"{self.path} is shorter than its header says")
+                    filled += read
+
+                if block_ids is None:
+                    block_ids = np.arange(block_start, block_start + rows, dtype=np.int64)
+                else:
+                    block = block[block_ids - block_start]
+                # Normalized per block, so an unnormalized file never needs a full-size copy
+                scores = normalize_rows(block) @ queries.T
+                scores = scores.T
+
+                # Keep a running top-k: the block's own top-k merged with the best so far
+                top = top_k_indices(scores, k)
+                candidate_scores = np.concatenate([best_scores, np.take_along_axis(scores, top, axis=1)], axis=1)
+                candidate_ids = np.concatenate([best_ids, block_ids[top]], axis=1)
+                keep = top_k_indices(candidate_scores, k)
+                best_scores = np.take_along_axis(candidate_scores, keep, axis=1)
+                best_ids = np.take_along_axis(candidate_ids, keep, axis=1)
+
+        return best_scores, best_ids
+
+
+def _params_path(codes_path: Path) -> Path:
+    """Per-dimension int8 offsets and scales stored next to the codes."""
+    return codes_path.with_name(codes_path.stem + '_params.npy')
+
+
+class RescoredIndex(VectorIndex):
+    """Shortlist with a quantized index, then rescore the shortlist against float32 embeddings."""
+
+    def __init__(self, first_pass: VectorIndex, embeddings: np.ndarray, rescore_factor: int = 4):
+        """
+        Args:
+            first_pass: Index over compressed vectors
+            embeddings: L2-normalized float32 embeddings (typically memory-mapped)
+            rescore_factor: Shortlist size as a multiple of k
+        """
+        self.first_pass = first_pass
+        self.embeddings = embeddings
+        self.rescore_factor = max(1, rescore_factor)
+        self.index_type = first_pass.index_type
+
+    @property
+    def ntotal(self) -> int:
+        return self.first_pass.ntotal
+
+    def search(self, queries: np.ndarray, k: int,
+               subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(queries)
+        _, shortlist = self.first_pass.search(queries, k * self.rescore_factor, subset)
+
+        # Read each shortlisted float32 row once, even if several queries share it
+        rows, inverse = np.unique(shortlist[shortlist >= 0], return_inverse=True)
+        exact = np.asarray(self.embeddings[rows], dtype=np.float32)
+
+        scores = np.full(shortlist.shape, -np.inf, dtype=np.float32)
+        valid = shortlist >= 0
+        query_index = np.nonzero(valid)[0]
+        scores[valid] = np.einsum('ij,ij->i', queries[query_index], exact[inverse])
+
+        order = top_k_indices(scores, k)
+        ids = np.take_along_axis(shortlist, order, axis=1)
+        scores = np.take_along_axis(scores, order, axis=1)
+        ids[~np.isfinite(scores)] = -1
+        return scores, ids
+
+
+class FaissIndex(VectorIndex):
+    """Inner-product FAISS index over L2-normalized vectors (inner product == cosine)."""
+
+    def __init__(self, index, index_type: str):
+        self.index = index
+        self.index_type = index_type
+
+    @property
+    def ntotal(self) -> int:
+        return int(self.index.ntotal)
+
+    def set_search_params(self, nprobe: Optional[int] = None, ef_search: Optional[int] = None):
+        """Adjust query-time recall/speed knobs for IVF and HNSW indexes."""
+        if nprobe and hasattr(self.index, 'nprobe'):
+            self.index.nprobe = nprobe
+        if ef_search and hasattr(self.index, 'hnsw'):
+            self.index.hnsw.efSearch = ef_search
+
+    def search(self, queries: np.ndarray, k: int,
+               subset: Optional[np.ndarray] = None) -> Tuple[np.ndarray, np.ndarray]:
+        queries = normalize_rows(queries)
+        k = min(k, self.ntotal if subset is None else len(subset))
+        if k <= 0:
+            # FAISS asserts on k <= 0
+            return np.empty((len(queries), 0), dtype=np.float32), np.empty((len(queries), 0), dtype=np.int64)
+        if subset is None:
+            return self.index.search(queries, k)
+
+        # Non-members are skipped before their distance is computed
+        faiss = _import_faiss()
+        selector = faiss.IDSelectorBatch(np.ascontiguousarray(subset, dtype=np.int64))
+        # Graph and list traversal stop early when most visited rows are filtered out,
+        # so widen the search in proportion to how selective the filter is
+        widen = self.ntotal / max(len(subset), 1)
+        if hasattr(self.index, 'nprobe'):
+            nlist = self.index.nlist
+            params = faiss.SearchParametersIVF(
+                sel=selector, nprobe=min(nlist, int(np.ceil(self.index.nprobe * widen))))
+        elif hasattr(self.index, 'hnsw'):
+            ef_search = max(self.index.hnsw.efSearch, k)
+            params = faiss.SearchParametersHNSW(
+                sel=selector, efSearch=min(self.ntotal, int(np.ceil(ef_search * widen))))
+        else:
+            params = faiss.SearchParameters(sel=selector)
+        return self.index.search(queries, k, params=params)
+
+    def save(self, path: Path):
+        faiss = _import_faiss()
+        path = Path(path)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = temporary_path(path)
+        faiss.write_index(self.index, str(tmp_path))
+        tmp_path.replace(path)
+
+
+def build_index(embeddings: np.ndarray, index_type: str = 'flat', nlist: int = 0,
+                hnsw_m: int = 32, nprobe: int = 8, ef_search: int = 64,
+                quantization: str = 'none') -> VectorIndex:
+    """
+    Build a vector index over the embedding matrix.
+
+    Args:
+        embeddings: Embedding matrix of shape (n_chunks, dim)
+        index_type: One of INDEX_TYPES
+        nlist: Number of IVF lists (0 picks sqrt(n_chunks))
+        hnsw_m: Number of neighbours per HNSW node
+        nprobe: IVF lists probed per query
+        ef_search: HNSW candidate list size per query
+        quantization: One of QUANTIZATIONS; compressed indexes return approximate
+            scores and are meant to be wrapped in a RescoredIndex
+
+    Returns:
+        The built index
+    """
+    if index_type not in INDEX_TYPES:
+        raise ValueError(f"Unknown index type '{index_type}', expected one of {INDEX_TYPES}")
+    if quantization not in QUANTIZATIONS:
+        raise ValueError(f"Unknown quantization '{quantization}', expected one of {QUANTIZATIONS}")
+
+    if index_type == 'stream':
+        raise ValueError("The 'stream' index scans embeddings.npy in place; create a StreamingIndex instead")
+
+    if index_type == 'exact':
+        if quantization != 'none':
+            return QuantizedIndex.quantize(embeddings, quantization)
+        return ExactIndex(embeddings)
+
+    faiss = _import_faiss()
+    vectors = normalize_rows(embeddings)
+    n_chunks, dim = vectors.shape
+    scalar_type = {'float16': faiss.ScalarQuantizer.QT_fp16,
+                   'int8': faiss.ScalarQuantizer.QT_8bit}.get(quantization)
+
+    if index_type == 'ivf':
+        if not nlist:
+            nlist = max(1, int(np.sqrt(n_chunks)))
+        nlist = min(nlist, max(1, n_chunks // MIN_POINTS_PER_LIST))
+        if nlist <= 1:
+            # Too few vectors to train a useful quantizer; a flat scan is both exact and faster
+            logger.info(f"Corpus of {n_chunks} chunks is too small for IVF, using a flat index")
+            index_type = 'flat'
+        else:
+            quantizer = faiss.IndexFlatIP(dim)
+            if scalar_type is None:
+                index = faiss.IndexIVFFlat(quantizer, dim, nlist, faiss.METRIC_INNER_PRODUCT)
+            else:
+                index = faiss.IndexIVFScalarQuantizer(quantizer, dim, nlist, scalar_type,
+                                                      faiss.METRIC_INNER_PRODUCT)
+            index.train(vectors)
+
+    if index_type == 'flat':
+        if scalar_type is None:
+            index = faiss.IndexFlatIP(dim)
+        else:
+            index = faiss.IndexScalarQuantizer(dim, scalar_type, faiss.METRIC_INNER_PRODUCT)
+    elif index_type == 'hnsw':
+        if scalar_type is None:
+            index = faiss.IndexHNSWFlat(dim, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWSQ(dim, scalar_type, hnsw_m, faiss.METRIC_INNER_PRODUCT)
+
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+
+    result = FaissIndex(index, index_type)
+    result.set_search_params(nprobe=nprobe, ef_search=ef_search)
+    return result
+
+
+def load_index(path: Path, index_type: str, nprobe: int = 8, ef_search: int = 64,
+               mmap: bool = False) -> Optional[VectorIndex]:
+    """
+    Load a persisted FAISS index.
+
+    Args:
+        path: Path to the index file
+        index_type: Backend the index was built with
+        nprobe: IVF lists probed per query
+        ef_search: HNSW candidate list size per query
+        mmap: Memory-map the stored vectors instead of reading them into RAM
+
+    Returns:
+        The loaded index, or None if the file does not exist
+    """
+    path = Path(path)
+    if not path.exists():
+        return None
+
+    faiss = _import_faiss()
+    io_flags = 0
+    if mmap:
+        # Older FAISS releases only know the generic flag, which they ignore for flat storage
+        io_flags = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP) | faiss.IO_FLAG_READ_ONLY
+    result = FaissIndex(faiss.read_index(str(path), io_flags), index_type)
+    result.set_search_params(nprobe=nprobe, ef_search=ef_search)
+    return result
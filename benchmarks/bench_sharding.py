@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Benchmark sharded retrieval against a single-shard scan on a synthetic corpus.
+
+Usage:
+    python benchmarks/bench_sharding.py --rows 1000000 --shards 1,2,4,8
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from backend.utils.bm25_index import BM25Index
+from backend.utils.sharding import ShardedBM25Index, ShardedVectorIndex, shard_bounds
+from backend.utils.vector_index import build_index, normalize_rows
+
+
+def time_queries(search, queries, repeat: int) -> float:
+    """Median seconds per call of search(query) over all queries."""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for query in queries:
+            search(query)
+        timings.append((time.perf_counter() - start) / len(queries))
+    return float(np.median(timings))
+
+
+def bench_vectors(args, shard_counts):
+    rng = np.random.default_rng(0)
+    print(f"Generating {args.rows} x {args.dim} embeddings...")
+    embeddings = normalize_rows(rng.standard_normal((args.rows, args.dim), dtype=np.float32))
+    queries = normalize_rows(rng.standard_normal((args.queries, args.dim), dtype=np.float32))
+
+    print(f"\nDense search ({args.index_type}, top {args.k}, one query per call)")
+    baseline = None
+    for n_shards in shard_counts:
+        bounds = shard_bounds(len(embeddings), n_shards)
+        shards = [build_index(embeddings[start:end], args.index_type)
+                  for start, end in zip(bounds[:-1], bounds[1:])]
+        with ThreadPoolExecutor(max_workers=n_shards) as pool:
+            index = ShardedVectorIndex(shards, bounds, pool if n_shards > 1 else None)
+            per_query = time_queries(lambda q: index.search(q[np.newaxis, :], args.k), queries, args.repeat)
+        baseline = baseline or per_query
+        print(f"  {n_shards:>2} shards: {per_query * 1000:8.2f} ms/query  speedup {baseline / per_query:4.2f}x")
+
+
+def bench_keywords(args, shard_counts):
+    rng = np.random.default_rng(1)
+    vocabulary = np.array([f"term{i}" for i in range(args.vocabulary)])
+    # Zipf-like term frequencies, as in natural text
+    weights = 1.0 / np.arange(1, args.vocabulary + 1)
+    weights /= weights.sum()
+    print(f"\nGenerating {args.docs} documents for BM25...")
+    texts = [" ".join(rng.choice(vocabulary, 60, p=weights)) for _ in range(args.docs)]
+    queries = [" ".join(rng.choice(vocabulary, 4, p=weights)) for _ in range(args.queries)]
+    index = BM25Index.build(texts)
+
+    print(f"\nBM25 search (top {args.k}, one query per call)")
+    baseline = None
+    for n_shards in shard_counts:
+        with ThreadPoolExecutor(max_workers=n_shards) as pool:
+            sharded = ShardedBM25Index(index.split(shard_bounds(args.docs, n_shards)),
+                                       pool if n_shards > 1 else None)
+            per_query = time_queries(lambda q: sharded.search(q, args.k), queries, args.repeat)
+        baseline = baseline or per_query
+        print(f"  {n_shards:>2} shards: {per_query * 1000:8.2f} ms/query  speedup {baseline / per_query:4.2f}x")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--rows', type=int, default=500_000, help='Embedding rows')
+    parser.add_argument('--dim', type=int, default=384, help='Embedding dimension (all-MiniLM-L6-v2: 384)')
+    parser.add_argument('--index-type', default='exact', help='Per-shard index type')
+    parser.add_argument('--docs', type=int, default=100_000, help='BM25 documents (0 skips the keyword benchmark)')
+    parser.add_argument('--vocabulary', type=int, default=20_000, help='Distinct BM25 terms')
+    parser.add_argument('--shards', default='1,2,4,8', help='Comma-separated shard counts')
+    parser.add_argument('--queries', type=int, default=50, help='Queries per measurement')
+    parser.add_argument('--repeat', type=int, default=3, help='Measurements per shard count (median is reported)')
+    parser.add_argument('--k', type=int, default=15, help='Results per query (search() asks for top_k * 3)')
+    args = parser.parse_args()
+
+    shard_counts = [int(n) for n in args.shards.split(',')]
+    print(f"CPU cores available: {os.cpu_count()}")
+    bench_vectors(args, shard_counts)
+    if args.docs:
+        bench_keywords(args, shard_counts)
+
+
+if __name__ == "__main__":
+    main()
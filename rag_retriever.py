@@ -3,75 +3,456 @@
 import json
 import numpy as np
 from pathlib import Path
-from sentence_transformers import SentenceTransformer
-from typing import List, Dict, Optional
+from typing import List, Dict, NamedTuple, Optional, Tuple, Union
 import re
-from sklearn.metrics.pairwise import cosine_similarity
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import linear_kernel
 import string
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from backend.config import Config
+from backend.utils.bm25_index import BM25Index, bm25_index_path, tokenize
+from backend.utils.chunk_store import ChunkStore, SegmentedChunkStore, chunk_store_paths
+from backend.utils.encoders import Encoder, load_encoder
+from backend.utils.knowledge_base import (
+    MANIFEST_FILE, GenerationTracker, Manifest, read_manifest, verify_manifest
+)
+from backend.utils.latency import LatencyStats, StageTimer
+from backend.utils.lru_cache import LRUCache
+from backend.utils.query_expansion import QueryExpander
+from backend.utils.segments import Segment, load_base_term_counts, load_segment, persist_derived, source_stamp
+from backend.utils.sharding import ShardedBM25Index, ShardedVectorIndex, shard_bounds, shard_path
+from backend.utils.vector_index import (
+    ExactIndex, QuantizedIndex, RescoredIndex, StreamingIndex, VectorIndex,
+    build_index, load_index, index_path, normalize_rows
+)
+
+FUSION_STRATEGIES = ('weighted', 'rrf')
+
+KeywordIndex = Union[BM25Index, ShardedBM25Index]
+
+
+class FusedScores(NamedTuple):
+    """Fused candidate scores, aligned arrays sorted by similarity (best first)."""
+    rows: np.ndarray
+    similarity: np.ndarray
+    semantic: np.ndarray
+    keyword: np.ndarray
+
+
+SCORE_FIELDS = ('similarity', 'semantic_score', 'keyword_score')
+
+
+class SearchResult:
+    """One ranked chunk: its row and scores, with the chunk record read only when accessed."""
+    
+    __slots__ = ('row', 'similarity', 'semantic_score', 'keyword_score', '_chunks', '_record')
+    
+    def __init__(self, row: int, similarity: float, semantic_score: float, keyword_score: float,
+                 chunks: ChunkStore):
+        self.row = row
+        self.similarity = similarity
+        self.semantic_score = semantic_score
+        self.keyword_score = keyword_score
+        self._chunks = chunks
+        self._record: Optional[Dict] = None
+    
+    @property
+    def record(self) -> Dict:
+        """The chunk record (loaded on first access, shared: do not modify)."""
+        if self._record is None:
+            self._record = self._chunks[self.row]
+        return self._record
+    
+    @property
+    def category(self) -> str:
+        return self._chunks.categories[self.row]
+    
+    @property
+    def chunk_id(self) -> str:
+        return self._chunks.chunk_ids[self.row]
+    
+    @property
+    def content(self) -> str:
+        return self.record['content']
+    
+    def __getitem__(self, key: str):
+        """Dict-style access to scores and chunk fields, e.g. result['content']."""
+        if key in SCORE_FIELDS:
+            return getattr(self, key)
+        return self.record[key]
+    
+    def get(self, key: str, default=None):
+        try:
+            return self[key]
+        except KeyError:
+            return default
+    
+    def to_dict(self) -> Dict:
+        """Chunk record plus scores, for JSON responses."""
+        result = dict(self.record)
+        result.update({field: getattr(self, field) for field in SCORE_FIELDS})
+        return result
+    
+    def __repr__(self) -> str:
+        return (f"SearchResult(row={self.row}, category={self.category!r}, "
+                f"similarity={self.similarity:.3f})")
+
+
+class IndexSnapshot(NamedTuple):
+    """One consistent, read-only view of the knowledge base, loaded together and swapped as a unit."""
+    generation: int
+    manifest: Manifest  # Base rows, segments and tombstones the snapshot was loaded from
+    chunks: ChunkStore
+    embeddings: np.ndarray  # Base rows only; segment vectors live in their own indexes
+    vector_index: VectorIndex
+    keyword_index: Optional[KeywordIndex]
+    category_rows: Dict[str, np.ndarray]  # Category -> sorted live rows, for filtered search
+    live_rows: Optional[np.ndarray]  # Sorted rows that are not tombstoned, None when none are
+
 
 class RAGRetriever:
     """Enhanced Retrieval system using hybrid semantic and keyword search."""
     
-    def __init__(self, data_dir: Optional[Path] = None):
+    def __init__(self, data_dir: Optional[Path] = None, config: Optional[Config] = None):
         """Initialize the retriever with embeddings."""
+        self.config = config or Config()
         if data_dir is None:
-            data_dir = Path("data/embeddings/faiss")
-        
-        self.data_dir = data_dir
-        self.embedding_model: Optional[SentenceTransformer] = None
-        self.embeddings: Optional[np.ndarray] = None
-        self.chunks: Optional[List[Dict]] = None
-        self.tfidf_vectorizer: Optional[TfidfVectorizer] = None
-        self.tfidf_matrix = None  # Sparse matrix from TF-IDF
-        
-        self._load_resources()
+            data_dir = Path(self.config.EMBEDDINGS_DIR)
+        
+        self.data_dir = Path(data_dir)
+        self._embedding_model: Optional[Encoder] = None
+        self._model_lock = threading.Lock()
+        self._snapshot: Optional[IndexSnapshot] = None
+        self._reload_lock = threading.Lock()
+        self._reload_thread: Optional[threading.Thread] = None
+        self._failed_generation: Optional[int] = None
+        self.query_cache = LRUCache(self.config.QUERY_CACHE_SIZE, self.config.QUERY_CACHE_TTL)
+        self.result_cache = LRUCache(self.config.RESULT_CACHE_SIZE)
+        self.latency = LatencyStats(self.config.LATENCY_WINDOW)
+        self.generation = GenerationTracker(self.data_dir)
+        self.query_expander = QueryExpander.from_file(Path(self.config.QUERY_EXPANSIONS_FILE))
+        
+        # One pool shared by every snapshot's shards, so reloads do not leak threads
+        self._shard_pool: Optional[ThreadPoolExecutor] = None
+        if self.config.NUM_SHARDS > 1:
+            self._shard_pool = ThreadPoolExecutor(
+                max_workers=self.config.SHARD_WORKERS or self.config.NUM_SHARDS,
+                thread_name_prefix="retriever-shard"
+            )
+        
+        self._snapshot = self._load_snapshot()
     
-    def _load_resources(self):
-        """Load all necessary resources."""
+    def _load_snapshot(self) -> IndexSnapshot:
+        """Load all necessary resources into a new snapshot."""
         try:
-            # Load embedding model with higher quality model
-            self.embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
+            # Read the manifest before the files: if an ingest lands mid-load, the snapshot
+            # is labelled with the older generation and the next check loads it again
+            manifest = read_manifest(self.data_dir)
+            generation = manifest.generation
+            if self.config.KB_VERIFY != 'off':
+                # Sizes, .npy headers and the model name only, unless full checksums are asked for
+                verify_manifest(self.data_dir, manifest, self.config.EMBEDDING_MODEL,
+                                full=self.config.KB_VERIFY == 'full')
+            
+            # Versions of the base files as read here: indexes built from them are only
+            # persisted if a writer has not replaced them since
+            stamps = {name: source_stamp(self.data_dir / name) for name in ("metadata.json", "embeddings.npy")}
             
             # Load chunks metadata
-            metadata_path = self.data_dir / "metadata.json"
-            with open(metadata_path, 'r', encoding='utf-8') as f:
-                self.chunks = json.load(f)
+            chunks = self._load_chunks(stamps)
             
-            # Load embeddings
+            # Load embeddings as an L2-normalized float32 matrix so scoring is a plain dot product
             embeddings_path = self.data_dir / "embeddings.npy"
-            self.embeddings = np.load(embeddings_path)
+            if self.config.INDEX_TYPE == 'stream':
+                # Only the header is read here; searches stream the file block by block
+                embeddings = np.load(embeddings_path, mmap_mode='r')
+            elif self.config.MMAP_EMBEDDINGS or self.config.EMBEDDING_QUANTIZATION != 'none':
+                # Pages are read on demand and shared between worker processes; with a
+                # quantized first pass only the rescored shortlist is ever read
+                raw_embeddings = np.load(embeddings_path, mmap_mode='r')
+                embeddings = normalize_rows(raw_embeddings)
+                if not np.may_share_memory(embeddings, raw_embeddings):
+                    print("embeddings.npy is not L2-normalized float32, holding a normalized copy in memory")
+            else:
+                embeddings = normalize_rows(np.load(embeddings_path))
+            
+            if len(embeddings) != len(chunks):
+                raise ValueError(f"embeddings.npy has {len(embeddings)} rows but metadata.json "
+                                 f"has {len(chunks)} chunks")
+            if len(chunks) != manifest.base_rows:
+                raise ValueError(f"metadata.json has {len(chunks)} chunks but {MANIFEST_FILE} "
+                                 f"expects {manifest.base_rows}")
+            
+            # Load (or build) the ANN index for semantic search
+            vector_index = self._load_vector_index(embeddings, stamps)
             
-            # Initialize TF-IDF for keyword-based search
-            self._initialize_tfidf()
+            # Segments appended since the base was written are small and searched exactly
+            segments = [load_segment(self.data_dir, segment.name) for segment in manifest.segments]
+            for info, segment in zip(manifest.segments, segments):
+                if len(segment.records) != info.rows or len(segment.embeddings) != info.rows:
+                    raise ValueError(f"Segment {info.name} does not have the {info.rows} rows "
+                                     f"{MANIFEST_FILE} expects")
+            if segments:
+                chunks = SegmentedChunkStore([chunks] + [ChunkStore.from_records(s.records) for s in segments])
+                # A sharded base is flattened into the same index: nesting would wait on the shard
+                # pool from inside one of its own threads
+                base_shards, bounds = [vector_index], chunks.bounds
+                if isinstance(vector_index, ShardedVectorIndex):
+                    base_shards = vector_index.shards
+                    bounds = np.concatenate([vector_index.bounds, chunks.bounds[2:]])
+                vector_index = ShardedVectorIndex(base_shards + [ExactIndex(s.embeddings) for s in segments],
+                                                  bounds, self._shard_pool)
             
-            print(f"Loaded enhanced retriever with {len(self.chunks) if self.chunks else 0} chunks")
+            # Load (or build) the BM25 inverted index for keyword search
+            keyword_index = self._load_keyword_index(chunks, segments, stamps)
+            
+            live_rows = None
+            if manifest.tombstones:
+                deleted = np.zeros(len(chunks), dtype=bool)
+                deleted[manifest.tombstones] = True
+                live_rows = np.flatnonzero(~deleted)
+            
+            print(f"Loaded enhanced retriever with {len(chunks)} chunks in {len(segments)} segments "
+                  f"plus the base, {len(manifest.tombstones)} deleted (generation {generation})")
+            return IndexSnapshot(generation, manifest, chunks, embeddings, vector_index, keyword_index,
+                                 self._build_category_rows(chunks, live_rows), live_rows)
             
         except Exception as e:
             print(f"Error loading retrieval resources: {e}")
             print("Please ensure data files exist in the data/embeddings/faiss directory.")
             raise
     
-    def _initialize_tfidf(self):
-        """Initialize TF-IDF vectorizer for keyword search."""
-        if not self.chunks:
-            return
-        
-        # Extract texts for TF-IDF
-        texts = [chunk['content'] for chunk in self.chunks]
-        
-        # Create TF-IDF vectorizer with custom preprocessing
-        self.tfidf_vectorizer = TfidfVectorizer(
-            max_features=5000,
-            stop_words='english',
-            ngram_range=(1, 2),  # Include bigrams for better context
-            lowercase=True,
-            token_pattern=r'\b[a-zA-Z][a-zA-Z0-9]*\b'  # Include alphanumeric tokens
+    @property
+    def snapshot(self) -> IndexSnapshot:
+        """The snapshot new searches read from."""
+        return self._snapshot
+    
+    @property
+    def chunks(self) -> ChunkStore:
+        return self._snapshot.chunks
+    
+    @property
+    def embeddings(self) -> np.ndarray:
+        return self._snapshot.embeddings
+    
+    @property
+    def vector_index(self) -> VectorIndex:
+        return self._snapshot.vector_index
+    
+    @property
+    def keyword_index(self) -> Optional[KeywordIndex]:
+        return self._snapshot.keyword_index
+    
+    def reload(self, wait: bool = False):
+        """
+        Load the knowledge base on disk into a new snapshot and swap it in.
+        
+        Loading happens on a background thread while searches keep reading the
+        current snapshot. At most one reload runs at a time.
+        
+        Args:
+            wait: Block until the reload has finished
+        """
+        with self._reload_lock:
+            thread = self._reload_thread
+            if thread is None or not thread.is_alive():
+                thread = threading.Thread(target=self._reload_worker, name="retriever-reload", daemon=True)
+                self._reload_thread = thread
+                thread.start()
+        if wait:
+            thread.join()
+    
+    def _reload_worker(self):
+        """Load snapshots until the live one matches the generation on disk."""
+        while True:
+            generation = self.generation.current()
+            if generation == self._snapshot.generation:
+                return
+            try:
+                snapshot = self._load_snapshot()
+            except Exception as e:
+                # Keep serving the current snapshot; the next ingest (or reload()) retries
+                self._failed_generation = generation
+                print(f"Reload failed, still serving generation {self._snapshot.generation}: {e}")
+                return
+            self._swap_snapshot(snapshot)
+    
+    def _swap_snapshot(self, snapshot: IndexSnapshot):
+        """Publish a loaded snapshot to new searches."""
+        # A single reference assignment: in-flight searches hold the previous snapshot,
+        # whose memory maps are released once the last of them finishes
+        self._snapshot = snapshot
+        self._failed_generation = None
+        self.result_cache.clear()
+        print(f"Swapped in knowledge-base generation {snapshot.generation}")
+    
+    def _maybe_reload(self):
+        """Start a background reload if the knowledge base changed on disk."""
+        generation = self.generation.current()
+        if generation != self._snapshot.generation and generation != self._failed_generation:
+            self.reload()
+    
+    @property
+    def embedding_model(self) -> Encoder:
+        """Sentence encoder for the configured backend, loaded on first use (torch is imported only then)."""
+        if self._embedding_model is None:
+            with self._model_lock:
+                if self._embedding_model is None:
+                    self._embedding_model = load_encoder(
+                        self.config.EMBEDDING_MODEL,
+                        backend=self.config.ENCODER_BACKEND,
+                        onnx_dir=self.config.ONNX_MODEL_DIR,
+                        quantized=self.config.ONNX_QUANTIZED,
+                        num_threads=self.config.ONNX_NUM_THREADS
+                    )
+        return self._embedding_model
+    
+    def warm_up(self):
+        """Load the embedding model and run one encode so the first real query is not slowed down."""
+        self.embedding_model.encode(["warm up"])
+        # Keyword tokenization imports its stop word list on first use
+        tokenize("warm up")
+    
+    def _is_fresh(self, path: Path, source: Path) -> bool:
+        """Whether a derived file exists and is at least as new as the file it was built from."""
+        return path.exists() and path.stat().st_mtime >= source.stat().st_mtime
+    
+    def _load_chunks(self, stamps: Dict[str, Optional[tuple]]) -> ChunkStore:
+        """Load chunk metadata, lazily from the offset-indexed blob in mmap mode."""
+        metadata_path = self.data_dir / "metadata.json"
+        
+        if self.config.MMAP_EMBEDDINGS or self.config.INDEX_TYPE == 'stream':
+            blob_path, offsets_path = chunk_store_paths(self.data_dir)
+            if not (self._is_fresh(blob_path, metadata_path) and self._is_fresh(offsets_path, metadata_path)):
+                # One-off conversion; afterwards only offsets and categories are loaded
+                with open(metadata_path, 'r', encoding='utf-8') as f:
+                    records = json.load(f)
+                if not persist_derived(self.data_dir, metadata_path, stamps["metadata.json"],
+                                       lambda: ChunkStore.write(records, self.data_dir)):
+                    # A writer is busy with the base; read the records in memory this time
+                    return ChunkStore.from_records(records)
+            return ChunkStore.open(self.data_dir)
+        
+        with open(metadata_path, 'r', encoding='utf-8') as f:
+            return ChunkStore.from_records(json.load(f))
+    
+    def _load_vector_index(self, embeddings: np.ndarray, stamps: Dict[str, Optional[tuple]]) -> VectorIndex:
+        """Load the persisted vector index (one per shard in sharded mode)."""
+        if self.config.INDEX_TYPE == 'stream':
+            return self._load_streaming_index(embeddings)
+        
+        path = index_path(self.data_dir, self.config.INDEX_TYPE, self.config.EMBEDDING_QUANTIZATION)
+        if self.config.NUM_SHARDS <= 1:
+            return self._load_vector_shard(embeddings, path, stamps["embeddings.npy"])
+        
+        bounds = shard_bounds(len(embeddings), self.config.NUM_SHARDS)
+        n_shards = len(bounds) - 1
+        shards = [
+            self._load_vector_shard(embeddings[start:end], shard_path(path, shard, n_shards), stamps["embeddings.npy"])
+            for shard, (start, end) in enumerate(zip(bounds[:-1], bounds[1:]))
+        ]
+        return ShardedVectorIndex(shards, bounds, self._shard_pool)
+    
+    def _load_streaming_index(self, embeddings: np.ndarray) -> VectorIndex:
+        """Exact search streamed from embeddings.npy with a bounded working set (sharded by row range)."""
+        if self.config.EMBEDDING_QUANTIZATION != 'none':
+            print("EMBEDDING_QUANTIZATION is ignored by the stream index, which scores in float32")
+        
+        embeddings_path = self.data_dir / "embeddings.npy"
+        bounds = shard_bounds(len(embeddings), self.config.NUM_SHARDS)
+        shards = [
+            StreamingIndex(embeddings_path, start, end, block_rows=self.config.STREAM_BLOCK_ROWS)
+            for start, end in zip(bounds[:-1], bounds[1:])
+        ]
+        if len(shards) == 1:
+            return shards[0]
+        return ShardedVectorIndex(shards, bounds, self._shard_pool)
+    
+    def _load_vector_shard(self, embeddings: np.ndarray, path: Path, stamp: Optional[tuple]) -> VectorIndex:
+        """Load a persisted vector index over embeddings, rebuilding it if missing or stale."""
+        index_type = self.config.INDEX_TYPE
+        quantization = self.config.EMBEDDING_QUANTIZATION
+        search_params = {'nprobe': self.config.IVF_NPROBE, 'ef_search': self.config.HNSW_EF_SEARCH}
+        
+        index = None
+        if index_type != 'exact' or quantization != 'none':
+            embeddings_path = self.data_dir / "embeddings.npy"
+            try:
+                if self._is_fresh(path, embeddings_path):
+                    if index_type == 'exact':
+                        index = QuantizedIndex.load(path, quantization)
+                    else:
+                        index = load_index(path, index_type, mmap=self.config.MMAP_EMBEDDINGS, **search_params)
+                    if index is not None and index.ntotal != len(embeddings):
+                        index = None
+            except Exception as e:
+                print(f"Could not load {index_type} index, rebuilding: {e}")
+                index = None
+        
+        if index is None:
+            index = build_index(
+                embeddings,
+                index_type=index_type,
+                nlist=self.config.IVF_NLIST,
+                hnsw_m=self.config.HNSW_M,
+                quantization=quantization,
+                **search_params
+            )
+            
+            # Persist so the next process start can skip the build
+            try:
+                persist_derived(self.data_dir, self.data_dir / "embeddings.npy", stamp, lambda: index.save(path))
+            except Exception as e:
+                print(f"Could not persist {index_type} index: {e}")
+        
+        if quantization != 'none':
+            # Compressed first pass, exact float32 scores for the shortlist only
+            index = RescoredIndex(index, embeddings, self.config.RESCORE_FACTOR)
+        
+        return index
+    
+    def _load_keyword_index(self, chunks: ChunkStore, segments: List[Segment],
+                            stamps: Dict[str, Optional[tuple]]) -> Optional[KeywordIndex]:
+        """Load the BM25 index (with segment postings), split into document-range shards in sharded mode."""
+        if segments:
+            # Segments store raw term counts, so every row is scored with collection-wide statistics
+            base_counts = load_base_term_counts(self.data_dir, chunks.parts[0], stamps["metadata.json"])
+            index = BM25Index.from_counts([base_counts] + [segment.term_counts for segment in segments],
+                                          k1=self.config.BM25_K1, b=self.config.BM25_B)
+        else:
+            index = self._load_bm25(chunks, stamps["metadata.json"])
+        if index is None or self.config.NUM_SHARDS <= 1:
+            return index
+        return ShardedBM25Index(index.split(shard_bounds(len(chunks), self.config.NUM_SHARDS)), self._shard_pool)
+    
+    def _load_bm25(self, chunks: ChunkStore, stamp: Optional[tuple]) -> Optional[BM25Index]:
+        """Load the persisted BM25 index, rebuilding it if missing or stale."""
+        if not chunks:
+            return None
+        
+        path = bm25_index_path(self.data_dir)
+        metadata_path = self.data_dir / "metadata.json"
+        try:
+            if self._is_fresh(path, metadata_path):
+                index = BM25Index.load(path)
+                if index is not None and index.num_docs == len(chunks):
+                    return index
+        except Exception as e:
+            print(f"Could not load keyword index, rebuilding: {e}")
+        
+        index = BM25Index.build(
+            [chunk['content'] for chunk in chunks],
+            k1=self.config.BM25_K1,
+            b=self.config.BM25_B
         )
         
-        # Fit and transform documents
-        self.tfidf_matrix = self.tfidf_vectorizer.fit_transform(texts)
+        # Persist so the next process start can skip the build
+        try:
+            persist_derived(self.data_dir, metadata_path, stamp, lambda: index.save(path))
+        except Exception as e:
+            print(f"Could not persist keyword index: {e}")
+        
+        return index
     
     def _preprocess_text(self, text: str) -> str:
         """Enhanced text preprocessing."""
@@ -81,29 +462,8 @@ class RAGRetriever:
         # Remove extra whitespace
         text = re.sub(r'\s+', ' ', text)
         
-        # Expand common dialysis abbreviations and medical terms
-        expansions = {
-            'hd': 'hemodialysis',
-            'pd': 'peritoneal dialysis',
-            'ckd': 'chronic kidney disease',
-            'esrd': 'end stage renal disease',
-            'dcc': 'dialysis care center',
-            'dialysis care center': 'dcc',
-            'kidney failure': 'renal failure end stage kidney disease',
-            'kidney disease': 'renal disease nephrology',
-            'blood cleaning': 'hemodialysis filtration',
-            'home dialysis': 'peritoneal dialysis home hemodialysis',
-            'treatment': 'therapy dialysis care',
-            'appointment': 'visit session treatment',
-            'cost': 'price insurance coverage',
-            'schedule': 'appointment time frequency',
-            'location': 'address center facility',
-            'staff': 'team doctors nurses technicians',
-        }
-        
-        # Apply expansions with word boundaries
-        for abbr, expansion in expansions.items():
-            text = re.sub(r'\b' + re.escape(abbr) + r'\b', f"{abbr} {expansion}", text)
+        # Expand common dialysis abbreviations and medical terms in one pass
+        text = self.query_expander.expand(text)
         
         return text.strip()
     
@@ -111,7 +471,9 @@ class RAGRetriever:
         """Preprocess query for better matching."""
         return self._preprocess_text(query)
     
-    def search(self, query: str, top_k: int = 5, similarity_threshold: float = 0.15) -> List[Dict]:
+    def search(self, query: str, top_k: int = 5, similarity_threshold: float = 0.15,
+               fusion: Optional[str] = None, categories: Optional[List[str]] = None,
+               timings: Optional[Dict[str, float]] = None) -> List[SearchResult]:
         """
         Enhanced hybrid semantic and keyword search with quality control.
         
@@ -119,143 +481,226 @@ class RAGRetriever:
             query: Search query
             top_k: Number of results to return
             similarity_threshold: Minimum similarity score (lowered for better recall)
+            fusion: 'weighted' or 'rrf' (defaults to Config.FUSION_STRATEGY)
+            categories: Only search chunks in these categories (None searches everything)
+            timings: If given, filled with the milliseconds spent in each stage of this call
             
         Returns:
-            List of relevant chunks with metadata
+            Ranked results; scores are attributes and chunk fields are read on access
         """
-        if not self.embedding_model or self.embeddings is None or not self.chunks:
-            raise ValueError("Retriever not properly initialized")
+        return self.search_batch([query], top_k=top_k, similarity_threshold=similarity_threshold,
+                                 fusion=fusion, categories=categories, timings=timings)[0]
+    
+    def search_batch(self, queries: List[str], top_k: int = 5,
+                     similarity_threshold: float = 0.15,
+                     fusion: Optional[str] = None,
+                     categories: Optional[List[str]] = None,
+                     timings: Optional[Dict[str, float]] = None) -> List[List[SearchResult]]:
+        """
+        Run the hybrid search for many queries at once.
         
-        # Preprocess query
-        processed_query = self.preprocess_query(query)
+        All queries are encoded in one model forward pass, scored against the
+        embedding index in one batched search and against the BM25 postings in
+        one sparse product.
         
-        # 1. SEMANTIC SEARCH using dense embeddings
-        semantic_results = self._semantic_search(processed_query, top_k * 3)
+        Args:
+            queries: Search queries
+            top_k: Number of results to return per query
+            similarity_threshold: Minimum similarity score
+            fusion: 'weighted' or 'rrf' (defaults to Config.FUSION_STRATEGY)
+            categories: Only search chunks in these categories (None searches everything)
+            timings: If given, filled with the milliseconds spent in each stage of this call
+            
+        Returns:
+            One list of results per query, in the same order as queries
+        """
+        timer = StageTimer()
         
-        # 2. KEYWORD SEARCH using TF-IDF
-        keyword_results = self._keyword_search(processed_query, top_k * 3)
+        # Every stage of this call reads the same snapshot, even if a reload swaps in a new one
+        self._maybe_reload()
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.chunks:
+            raise ValueError("Retriever not properly initialized")
         
-        # 3. HYBRID FUSION - combine both approaches
-        fused_results = self._fuse_results(semantic_results, keyword_results, query)
+        fusion = fusion or self.config.FUSION_STRATEGY
+        if fusion not in FUSION_STRATEGIES:
+            raise ValueError(f"Unknown fusion strategy '{fusion}', expected one of {FUSION_STRATEGIES}")
         
-        # 4. Quality filtering and diversity
-        final_results = self._apply_quality_filter(fused_results, similarity_threshold, top_k)
+        if not queries:
+            return []
+        
+        # Only the rows of the requested categories are scored
+        if isinstance(categories, str):
+            categories = [categories]
+        category_filter = tuple(sorted(set(categories))) if categories is not None else None
+        subset = self._filter_rows(snapshot, category_filter)
+        if subset is not None and not len(subset):
+            return [[] for _ in queries]
+        timer.lap('filter')
+        
+        # Serve repeated retrievals from the cache, keyed on the generation of the snapshot searched
+        cache_keys = [
+            (" ".join(query.lower().split()), top_k, similarity_threshold, fusion, category_filter,
+             snapshot.generation)
+            for query in queries
+        ]
+        final_results = [self.result_cache.get(key) for key in cache_keys]
+        missing = [i for i, results in enumerate(final_results) if results is None]
+        timer.lap('cache_lookup')
         
+        if missing:
+            missing_queries = [queries[i] for i in missing]
+            
+            # Preprocess queries
+            processed_queries = [self.preprocess_query(query) for query in missing_queries]
+            timer.lap('preprocess')
+            
+            # 1. SEMANTIC SEARCH using dense embeddings (times 'encode' and 'dense_search')
+            semantic_results = self._semantic_search(snapshot, processed_queries, top_k * 3, subset, timer)
+            
+            # 2. KEYWORD SEARCH using BM25
+            keyword_results = self._keyword_search(snapshot, processed_queries, top_k * 3, subset)
+            timer.lap('keyword_search')
+            
+            for i, query, semantic, keyword in zip(missing, missing_queries, semantic_results, keyword_results):
+                # 3. HYBRID FUSION - combine both approaches
+                fused = self._fuse_results(semantic, keyword, query, fusion, similarity_threshold)
+                timer.lap('fusion')
+                
+                # 4. Quality filtering and diversity, then build results for the survivors only
+                selected = self._apply_quality_filter(snapshot, fused, similarity_threshold, top_k)
+                timer.lap('quality_filter')
+                final_results[i] = self._materialize(snapshot, fused, selected)
+                self.result_cache.put(cache_keys[i], final_results[i])
+                timer.lap('materialize')
+        
+        # Results are read-only and shared with the cache; callers get their own lists
+        final_results = [list(results) for results in final_results]
+        
+        timer.durations['total'] = timer.total
+        self.latency.record(timer.durations)
+        if timings is not None:
+            timings.update({stage: seconds * 1000.0 for stage, seconds in timer.durations.items()})
         return final_results
     
-    def _apply_quality_filter(self, results: List[Dict], threshold: float, top_k: int) -> List[Dict]:
-        """Apply quality filtering and ensure diversity in results."""
-        if not results:
-            return []
+    def _apply_quality_filter(self, snapshot: IndexSnapshot, fused: FusedScores,
+                              threshold: float, top_k: int) -> np.ndarray:
+        """Apply quality filtering and ensure diversity, returning positions into fused."""
+        if not len(fused.rows):
+            return np.empty(0, dtype=np.int64)
         
-        # First pass: filter by threshold
-        filtered_results = [r for r in results if r['similarity'] >= threshold]
+        # First pass: filter by threshold (fused is sorted, so survivors stay in rank order)
+        passing = np.flatnonzero(fused.similarity >= threshold)
         
         # If we don't have enough results, lower the threshold slightly
-        if len(filtered_results) < 2 and results:
+        if len(passing) < 2:
             lower_threshold = max(0.1, threshold - 0.1)
-            filtered_results = [r for r in results if r['similarity'] >= lower_threshold]
+            passing = np.flatnonzero(fused.similarity >= lower_threshold)
         
         # Ensure diversity by avoiding too many results from the same category
-        diverse_results = []
+        selected = []
         category_counts = {}
+        categories = snapshot.chunks.categories
         
-        for result in filtered_results:
-            category = result.get('category', 'unknown')
+        for position in passing:
+            category = categories[fused.rows[position]]
             count = category_counts.get(category, 0)
             
             # Allow max 2 results per category unless we have very few results
-            if count < 2 or len(diverse_results) < 2:
-                diverse_results.append(result)
+            if count < 2 or len(selected) < 2:
+                selected.append(position)
                 category_counts[category] = count + 1
                 
-            if len(diverse_results) >= top_k:
+            if len(selected) >= top_k:
                 break
         
-        return diverse_results[:top_k]
+        return np.asarray(selected[:top_k], dtype=np.int64)
     
-    def _semantic_search(self, query: str, top_k: int) -> List[Dict]:
-        """Perform dense vector semantic search."""
-        if not self.embedding_model or self.embeddings is None or not self.chunks:
-            return []
+    def _semantic_search(self, snapshot: IndexSnapshot, queries: List[str], top_k: int,
+                         subset: Optional[np.ndarray] = None,
+                         timer: Optional[StageTimer] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Perform dense vector semantic search, returning (row_ids, scores) per query."""
+        if snapshot.vector_index is None or not snapshot.chunks:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(queries)
             
-        # Generate query embedding
-        query_embedding = self.embedding_model.encode([query])
+        query_embeddings = self._encode_queries(queries)
+        if timer:
+            timer.lap('encode')
         
-        # Calculate cosine similarities
-        similarities = cosine_similarity(query_embedding, self.embeddings)[0]
-        
-        # Get top results
-        top_indices = np.argsort(similarities)[::-1][:top_k]
+        # Nearest neighbours by cosine similarity, all queries in one call
+        scores, indices = snapshot.vector_index.search(query_embeddings, top_k, subset)
+        if timer:
+            timer.lap('dense_search')
         
         results = []
-        for idx in top_indices:
-            chunk = self.chunks[idx].copy()
-            chunk['semantic_score'] = float(similarities[idx])
-            results.append(chunk)
-        
+        for row_scores, row_indices in zip(scores, indices):
+            # Drop padding when there are fewer neighbours than requested
+            valid = row_indices >= 0
+            results.append((row_indices[valid], row_scores[valid]))
         return results
     
-    def _keyword_search(self, query: str, top_k: int) -> List[Dict]:
-        """Perform sparse keyword-based search using TF-IDF."""
-        if (self.tfidf_vectorizer is None or self.tfidf_matrix is None or 
-            not self.chunks):
-            return []
-        
-        # Transform query using fitted TF-IDF vectorizer
-        query_tfidf = self.tfidf_vectorizer.transform([query])
-        
-        # Calculate cosine similarities
-        similarities = linear_kernel(query_tfidf, self.tfidf_matrix)[0]
-        
-        # Get top results
-        top_indices = np.argsort(similarities)[::-1][:top_k]
-        
-        results = []
-        for idx in top_indices:
-            if similarities[idx] > 0:  # Only include non-zero matches
-                chunk = self.chunks[idx].copy()
-                chunk['keyword_score'] = float(similarities[idx])
-                results.append(chunk)
-        
-        return results
+    def _encode_queries(self, queries: List[str]) -> np.ndarray:
+        """Embed preprocessed queries, reusing cached embeddings for repeated queries."""
+        embeddings = [self.query_cache.get(query) for query in queries]
+        missing = [i for i, embedding in enumerate(embeddings) if embedding is None]
+        
+        if missing:
+            # Encode every cache miss in a single forward pass
+            unique_queries = list(dict.fromkeys(queries[i] for i in missing))
+            encoded = np.asarray(self.embedding_model.encode(unique_queries), dtype=np.float32)
+            encoded.setflags(write=False)  # rows are shared between callers through the cache
+            encoded_by_query = {}
+            for query, embedding in zip(unique_queries, encoded):
+                encoded_by_query[query] = embedding.reshape(1, -1)
+                self.query_cache.put(query, encoded_by_query[query])
+            for i in missing:
+                embeddings[i] = encoded_by_query[queries[i]]
+        
+        return np.vstack(embeddings)
     
-    def _fuse_results(self, semantic_results: List[Dict], keyword_results: List[Dict], 
-                     original_query: str) -> List[Dict]:
-        """Fuse semantic and keyword search results with intelligent weighting."""
-        
-        # Create a mapping from chunk index to results
-        chunk_scores = {}
-        
-        # Add semantic scores (weight: 0.7 for semantic understanding)
-        for result in semantic_results:
-            chunk_idx = self._get_chunk_index(result)
-            if chunk_idx is not None:
-                chunk_scores[chunk_idx] = {
-                    'chunk': result,
-                    'semantic_score': result.get('semantic_score', 0.0),
-                    'keyword_score': 0.0
-                }
-        
-        # Add keyword scores (weight: 0.3 for exact matches)
-        for result in keyword_results:
-            chunk_idx = self._get_chunk_index(result)
-            if chunk_idx is not None:
-                if chunk_idx in chunk_scores:
-                    chunk_scores[chunk_idx]['keyword_score'] = result.get('keyword_score', 0.0)
-                else:
-                    chunk_scores[chunk_idx] = {
-                        'chunk': result,
-                        'semantic_score': 0.0,
-                        'keyword_score': result.get('keyword_score', 0.0)
-                    }
-        
-        # Calculate fusion scores with adaptive weighting
-        fused_results = []
-        for chunk_idx, scores in chunk_scores.items():
-            semantic_score = scores['semantic_score']
-            keyword_score = scores['keyword_score']
-            
+    def _keyword_search(self, snapshot: IndexSnapshot, queries: List[str], top_k: int,
+                        subset: Optional[np.ndarray] = None) -> List[Tuple[np.ndarray, np.ndarray]]:
+        """Perform sparse keyword-based search using BM25, returning (row_ids, scores) per query."""
+        if snapshot.keyword_index is None or not snapshot.chunks:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(queries)
+        
+        allowed = None
+        if subset is not None:
+            allowed = np.zeros(len(snapshot.chunks), dtype=bool)
+            allowed[subset] = True
+        
+        # Only documents containing query terms are touched
+        return snapshot.keyword_index.search_batch(queries, top_k, allowed)
+    
+    def _fuse_results(self, semantic_results: Tuple[np.ndarray, np.ndarray],
+                      keyword_results: Tuple[np.ndarray, np.ndarray],
+                      original_query: str, fusion: str = 'weighted', threshold: float = 0.0) -> FusedScores:
+        """Fuse semantic and keyword search results into score arrays sorted best first."""
+        semantic_ids, semantic_hits = semantic_results
+        keyword_ids, keyword_hits = keyword_results
+        
+        # Score arrays indexed by position in the union of candidate row ids
+        candidate_ids = np.union1d(semantic_ids, keyword_ids)
+        semantic_positions = np.searchsorted(candidate_ids, semantic_ids)
+        keyword_positions = np.searchsorted(candidate_ids, keyword_ids)
+        semantic_scores = np.zeros(len(candidate_ids), dtype=np.float32)
+        keyword_scores = np.zeros(len(candidate_ids), dtype=np.float32)
+        semantic_scores[semantic_positions] = semantic_hits
+        keyword_scores[keyword_positions] = keyword_hits
+        
+        if fusion == 'rrf':
+            # Reciprocal rank fusion: both inputs arrive best first, ranks start at 1.
+            # Rank alone says nothing about relevance (every candidate of a top-k list gets a
+            # sizeable score), so a list only votes for candidates whose raw score in it
+            # reaches the similarity threshold; candidates without such a vote score 0
+            rrf_k = self.config.RRF_K
+            fusion_scores = np.zeros(len(candidate_ids), dtype=np.float32)
+            for positions, hits in ((semantic_positions, semantic_hits), (keyword_positions, keyword_hits)):
+                votes = hits >= threshold
+                fusion_scores[positions[votes]] += 1.0 / (rrf_k + np.arange(1, len(hits) + 1)[votes])
+            # Scale so first place in both lists scores 1.0 (first place in one list scores 0.5)
+            fusion_scores *= (rrf_k + 1) / 2.0
+        else:
             # Adaptive weighting based on query characteristics
             query_len = len(original_query.split())
             if query_len <= 3:  # Short queries - favor keyword matching
@@ -266,53 +711,80 @@ class RAGRetriever:
                 keyword_weight = 0.2
             
             # Calculate final fusion score
-            fusion_score = (semantic_weight * semantic_score + 
-                          keyword_weight * keyword_score)
-            
-            # Boost score if both methods found the chunk
-            if semantic_score > 0 and keyword_score > 0:
-                fusion_score *= 1.2  # 20% boost for consensus
-            
-            # Create final result
-            result = scores['chunk'].copy()
-            result['similarity'] = fusion_score
-            result['semantic_score'] = semantic_score
-            result['keyword_score'] = keyword_score
+            fusion_scores = semantic_weight * semantic_scores + keyword_weight * keyword_scores
             
-            fused_results.append(result)
+            # Boost score if both methods found the chunk (20% boost for consensus)
+            fusion_scores[(semantic_scores > 0) & (keyword_scores > 0)] *= 1.2
         
         # Sort by fusion score
-        fused_results.sort(key=lambda x: x['similarity'], reverse=True)
-        
-        return fused_results
+        order = np.argsort(-fusion_scores, kind='stable')
+        return FusedScores(candidate_ids[order], fusion_scores[order],
+                           semantic_scores[order], keyword_scores[order])
     
-    def _get_chunk_index(self, chunk: Dict) -> Optional[int]:
-        """Get the index of a chunk in the chunks list."""
-        try:
-            if not self.chunks:
-                return None
-                
-            # Try to find chunk by content matching
-            content = chunk.get('content', '')
-            for i, original_chunk in enumerate(self.chunks):
-                if original_chunk.get('content') == content:
-                    return i
-            return None
-        except:
-            return None
+    def _materialize(self, snapshot: IndexSnapshot, fused: FusedScores,
+                     positions: np.ndarray) -> List[SearchResult]:
+        """Build results for the selected positions only; chunk records are not read here."""
+        return [
+            SearchResult(int(row), float(similarity), float(semantic), float(keyword), snapshot.chunks)
+            for row, similarity, semantic, keyword in zip(
+                fused.rows[positions].tolist(), fused.similarity[positions].tolist(),
+                fused.semantic[positions].tolist(), fused.keyword[positions].tolist()
+            )
+        ]
+    
+    @staticmethod
+    def _build_category_rows(chunks: ChunkStore, live_rows: Optional[np.ndarray] = None) -> Dict[str, np.ndarray]:
+        """Group rows by category so a filter can be resolved without scanning every chunk."""
+        rows_by_category: Dict[str, List[int]] = {}
+        rows = range(len(chunks)) if live_rows is None else live_rows.tolist()
+        for row in rows:
+            rows_by_category.setdefault(chunks.categories[row], []).append(row)
+        return {category: np.asarray(rows, dtype=np.int64) for category, rows in rows_by_category.items()}
+    
+    @staticmethod
+    def _filter_rows(snapshot: IndexSnapshot, categories: Optional[Tuple[str, ...]]) -> Optional[np.ndarray]:
+        """Sorted rows of the given categories, or None when the filter keeps every row."""
+        if categories is None:
+            # Tombstoned rows are excluded like an implicit filter until they are compacted away
+            return snapshot.live_rows
+        rows = [snapshot.category_rows[category] for category in categories if category in snapshot.category_rows]
+        if not rows:
+            return np.empty(0, dtype=np.int64)
+        subset = np.sort(np.concatenate(rows))
+        return None if len(subset) == len(snapshot.chunks) else subset
+    
+    def get_categories(self) -> List[str]:
+        """Categories that can be passed to search() as a filter."""
+        return sorted(self._snapshot.category_rows)
     
     def get_stats(self) -> Dict:
         """Get retriever statistics."""
-        if not self.chunks:
+        snapshot = self._snapshot
+        if snapshot is None or not snapshot.chunks:
             return {"total_chunks": 0, "total_files": 0, "hybrid_search": False}
         
-        categories = set(chunk['category'] for chunk in self.chunks)
+        reload_thread = self._reload_thread
         return {
-            "total_chunks": len(self.chunks),
-            "total_files": len(categories),
-            "hybrid_search": self.tfidf_vectorizer is not None,
-            "semantic_model": "all-MiniLM-L6-v2",
-            "search_methods": ["semantic_dense", "keyword_sparse", "hybrid_fusion"]
+            "total_chunks": len(snapshot.chunks) - len(snapshot.manifest.tombstones),
+            "total_files": len(snapshot.category_rows),
+            "hybrid_search": snapshot.keyword_index is not None,
+            "semantic_model": self.config.EMBEDDING_MODEL,
+            "model_loaded": self._embedding_model is not None,
+            "encoder_backend": self.config.ENCODER_BACKEND,
+            "vector_index": snapshot.vector_index.index_type if snapshot.vector_index else None,
+            "embedding_quantization": self.config.EMBEDDING_QUANTIZATION,
+            "search_methods": ["semantic_dense", "keyword_bm25", "hybrid_fusion"],
+            "memory_mapped": bool(self.config.MMAP_EMBEDDINGS),
+            "shards": len(shard_bounds(snapshot.manifest.base_rows, self.config.NUM_SHARDS)) - 1,
+            "segments": len(snapshot.manifest.segments),
+            "deleted_chunks": len(snapshot.manifest.tombstones),
+            "query_embedding_cache": self.query_cache.stats(),
+            "result_cache": self.result_cache.stats(),
+            "latency_ms": self.latency.stats(),
+            "generation": snapshot.generation,
+            "built_at": snapshot.manifest.built_at,
+            "disk_generation": self.generation.current(),
+            "reloading": reload_thread is not None and reload_thread.is_alive()
         }
 
 
@@ -341,11 +813,11 @@ def test_retriever():
             
             for i, result in enumerate(results, 1):
                 print(f"\nResult {i}:")
-                print(f"  Overall Score: {result['similarity']:.3f}")
-                print(f"  Semantic Score: {result.get('semantic_score', 0):.3f}")
-                print(f"  Keyword Score: {result.get('keyword_score', 0):.3f}")
-                print(f"  Category: {result['category']}")
-                print(f"  Content: {result['content'][:150]}...")
+                print(f"  Overall Score: {result.similarity:.3f}")
+                print(f"  Semantic Score: {result.semantic_score:.3f}")
+                print(f"  Keyword Score: {result.keyword_score:.3f}")
+                print(f"  Category: {result.category}")
+                print(f"  Content: {result.content[:150]}...")
             
             print("\n" + "="*80 + "\n")
             
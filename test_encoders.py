@@ -0,0 +1,35 @@
+"""
+Agreement between the ONNX and torch encoders on the same texts.
+
+Run with: python -m pytest test_encoders.py
+"""
+
+import pytest
+
+from backend.utils.encoders import (
+    ONNX_COSINE_TOLERANCE, ONNX_QUANTIZED_COSINE_TOLERANCE, VERIFICATION_TEXTS, TorchEncoder, cosine_agreement,
+    load_encoder
+)
+
+MODEL_NAME = 'all-MiniLM-L6-v2'
+
+
+@pytest.fixture(scope='module')
+def reference():
+    pytest.importorskip('torch')
+    return TorchEncoder(MODEL_NAME).encode(VERIFICATION_TEXTS)
+
+
+@pytest.mark.parametrize('quantized, tolerance', [
+    (False, ONNX_COSINE_TOLERANCE),
+    (True, ONNX_QUANTIZED_COSINE_TOLERANCE),
+])
+def test_onnx_encoder_matches_torch(reference, tmp_path_factory, quantized, tolerance):
+    pytest.importorskip('onnxruntime')
+    pytest.importorskip('torch')
+    # The model is exported into a throwaway directory rather than ONNX_MODEL_DIR
+    onnx_dir = tmp_path_factory.getbasetemp() / "onnx"
+    encoder = load_encoder(MODEL_NAME, 'onnx', str(onnx_dir), quantized=quantized)
+
+    agreement = cosine_agreement(reference, encoder.encode(VERIFICATION_TEXTS))
+    assert agreement.min() >= tolerance, f"ONNX embeddings drifted from torch: {agreement.min():.4f}"
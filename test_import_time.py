@@ -0,0 +1,31 @@
+"""
+Import-time budget for rag_retriever: tooling that never encodes a query must not pay for the model stack.
+
+Run with: python -m pytest test_import_time.py
+"""
+
+import subprocess
+import sys
+from pathlib import Path
+
+IMPORT_TIME_BUDGET_SECONDS = 1.0
+HEAVY_MODULES = ("sentence_transformers", "torch", "sklearn", "faiss")
+
+
+def test_import_time():
+    # A fresh interpreter, so modules other tests already imported do not hide the cost
+    code = (
+        "import sys, time; start = time.perf_counter(); import rag_retriever; "
+        "elapsed = time.perf_counter() - start; "
+        f"print(elapsed, *[m for m in {HEAVY_MODULES!r} if m in sys.modules])"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=str(Path(__file__).resolve().parent),
+        capture_output=True, text=True, check=True
+    ).stdout.split()
+    elapsed, loaded = float(output[0]), output[1:]
+
+    assert not loaded, f"Importing rag_retriever loaded heavy modules: {loaded}"
+    assert elapsed <= IMPORT_TIME_BUDGET_SECONDS, \
+        f"Import took {elapsed:.3f}s (budget {IMPORT_TIME_BUDGET_SECONDS:.1f}s)"
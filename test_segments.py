@@ -0,0 +1,196 @@
+"""
+Regression tests for the segmented knowledge base: uploads, deletes and compaction.
+
+Run with: python -m pytest test_segments.py
+"""
+
+import json
+import multiprocessing
+import os
+import threading
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+from backend.utils.chunk_store import ChunkStore
+from backend.utils.knowledge_base import Manifest, publish_manifest, read_manifest, verify_manifest
+from backend.utils.near_duplicates import minhash_path
+from backend.utils import segments
+from backend.utils.segments import (
+    add_tombstones, append_segment, compact, find_layout_duplicates, load_base_signatures, load_chunks,
+    load_segment, minhash_index
+)
+
+DIM = 16
+
+# Compaction only runs when a test calls compact()
+CONFIG = SimpleNamespace(
+    EMBEDDING_MODEL='test-model', INDEX_TYPE='flat', IVF_NLIST=0, HNSW_M=32, EMBEDDING_QUANTIZATION='none',
+    BM25_K1=1.2, BM25_B=0.75, SEGMENT_MERGE_THRESHOLD=1000, COMPACT_RATIO=1000.0,
+    DEDUP_THRESHOLD=0.8, MINHASH_PERMUTATIONS=32, MINHASH_BANDS=8
+)
+
+
+def upload(data_dir, category, count, seed):
+    records = [{'chunk_id': f'{category}_{i}', 'category': category, 'file_path': f'{category}/{i}.txt',
+                'content': f'{category} chunk {i} about dialysis'} for i in range(count)]
+    embeddings = np.random.default_rng(seed).standard_normal((count, DIM)).astype(np.float32)
+    return append_segment(data_dir, records, embeddings, CONFIG)
+
+
+def live_categories(data_dir):
+    """Category of every row that is not tombstoned, checking the manifest on the way."""
+    manifest = read_manifest(data_dir)
+    verify_manifest(data_dir, manifest, CONFIG.EMBEDDING_MODEL)
+    chunks = load_chunks(data_dir, [load_segment(data_dir, segment.name) for segment in manifest.segments])
+    assert len(chunks) == manifest.total_rows
+    tombstones = set(manifest.tombstones)
+    categories = [category for row, category in enumerate(chunks.categories) if row not in tombstones]
+    chunks.close()
+    return categories
+
+
+def test_delete_then_compact(tmp_path):
+    upload(tmp_path, 'base', 20, 0)
+    upload(tmp_path, 'doc-a', 5, 1)
+    upload(tmp_path, 'doc-b', 7, 2)
+
+    assert add_tombstones(tmp_path, 'doc-a', CONFIG)[0] == 5
+    assert add_tombstones(tmp_path, 'doc-a', CONFIG) == (0, None)
+    compact(tmp_path, CONFIG, plan='merge')
+    assert add_tombstones(tmp_path, 'base', CONFIG)[0] == 20
+    assert sorted(set(live_categories(tmp_path))) == ['doc-b']
+
+    compact(tmp_path, CONFIG, plan='full')
+    manifest = read_manifest(tmp_path)
+    assert (manifest.base_rows, manifest.segments, manifest.tombstones) == (7, [], [])
+    assert live_categories(tmp_path) == ['doc-b'] * 7
+
+
+def test_delete_races_with_compaction(tmp_path):
+    upload(tmp_path, 'base', 30, 0)
+    for i in range(6):
+        upload(tmp_path, f'doc-{i}', 4, i + 1)
+
+    # Merges renumber segment rows while deletes and uploads run
+    errors = []
+
+    def run(action):
+        try:
+            action()
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=run, args=(lambda i=i: add_tombstones(tmp_path, f'doc-{i}', CONFIG),))
+               for i in range(0, 6, 2)]
+    threads += [threading.Thread(target=run, args=(lambda: compact(tmp_path, CONFIG, plan='merge'),)),
+                threading.Thread(target=run, args=(lambda: upload(tmp_path, 'doc-new', 3, 9),))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+
+    categories = live_categories(tmp_path)
+    assert not {'doc-0', 'doc-2', 'doc-4'} & set(categories)
+    assert categories.count('doc-1') == 4 and categories.count('doc-new') == 3
+    compact(tmp_path, CONFIG, plan='full')
+    assert len(ChunkStore.open(tmp_path)) == 30 + 3 * 4 + 3
+
+
+def test_out_of_range_tombstones_are_rejected(tmp_path):
+    upload(tmp_path, 'base', 10, 0)
+    manifest = read_manifest(tmp_path)
+    with pytest.raises(ValueError):
+        publish_manifest(tmp_path, manifest._replace(tombstones=[10]), CONFIG.EMBEDDING_MODEL)
+    with pytest.raises(ValueError):
+        verify_manifest(tmp_path, manifest._replace(tombstones=[-1]), CONFIG.EMBEDDING_MODEL)
+    assert read_manifest(tmp_path).total_rows == Manifest(10, [], []).total_rows
+
+
+def test_full_compaction_keeps_signatures(tmp_path):
+    upload(tmp_path, 'base', 10, 0)
+    upload(tmp_path, 'doc-a', 4, 1)
+    assert np.load(minhash_path(tmp_path)).shape == (10, CONFIG.MINHASH_PERMUTATIONS)
+
+    compact(tmp_path, CONFIG, plan='full')
+    chunks = ChunkStore.open(tmp_path)
+    expected = minhash_index(CONFIG).signatures([chunk['content'] for chunk in chunks])
+    assert np.array_equal(np.load(minhash_path(tmp_path)), expected)
+
+    # A rewritten metadata.json makes the stored signatures stale, even with the same row count
+    np.save(minhash_path(tmp_path), np.zeros_like(expected))
+    stat = minhash_path(tmp_path).stat()
+    os.utime(tmp_path / "metadata.json", ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert np.array_equal(load_base_signatures(tmp_path, CONFIG), expected)
+    assert np.array_equal(np.load(minhash_path(tmp_path)), expected)
+
+
+def test_uploads_from_several_processes_are_all_published(tmp_path):
+    upload(tmp_path, 'base', 10, 0)
+    context = multiprocessing.get_context('spawn')
+    processes = [context.Process(target=upload, args=(tmp_path, f'doc-{i}', 3, i + 1)) for i in range(4)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    assert all(process.exitcode == 0 for process in processes)
+
+    manifest = read_manifest(tmp_path)
+    assert len(manifest.segments) == 4 and manifest.total_rows == 10 + 4 * 3
+    assert sorted(set(live_categories(tmp_path))) == ['base'] + [f'doc-{i}' for i in range(4)]
+
+
+def test_full_compaction_streams_the_layout_into_new_base_files(tmp_path, monkeypatch):
+    monkeypatch.setattr('backend.utils.segments.COMPACT_BLOCK_ROWS', 4)
+    upload(tmp_path, 'base', 11, 0)
+    upload(tmp_path, 'doc-a', 6, 1)
+    upload(tmp_path, 'doc-b', 5, 2)
+    before = read_manifest(tmp_path)
+    chunks = load_chunks(tmp_path, [load_segment(tmp_path, segment.name) for segment in before.segments])
+    embeddings = np.concatenate([np.load(tmp_path / "embeddings.npy")] +
+                                [load_segment(tmp_path, segment.name).embeddings for segment in before.segments])
+    add_tombstones(tmp_path, 'doc-a', CONFIG)
+    kept = [row for row, category in enumerate(chunks.categories) if category != 'doc-a']
+
+    compact(tmp_path, CONFIG, plan='full')
+    assert read_manifest(tmp_path).base_rows == len(kept)
+    assert np.allclose(np.load(tmp_path / "embeddings.npy"), embeddings[kept])
+    with open(tmp_path / "metadata.json", encoding='utf-8') as f:
+        assert json.load(f) == [chunks[row] for row in kept]
+    assert [chunk['chunk_id'] for chunk in ChunkStore.open(tmp_path)] == [chunks[row]['chunk_id'] for row in kept]
+    assert np.load(minhash_path(tmp_path)).shape == (len(kept), CONFIG.MINHASH_PERMUTATIONS)
+    verify_manifest(tmp_path, read_manifest(tmp_path), CONFIG.EMBEDDING_MODEL, full=True)
+
+    add_tombstones(tmp_path, 'base', CONFIG)
+    add_tombstones(tmp_path, 'doc-b', CONFIG)
+    compact(tmp_path, CONFIG, plan='full')
+    assert np.load(tmp_path / "embeddings.npy").shape == (0, DIM)
+    assert read_manifest(tmp_path).total_rows == 0
+
+
+def test_back_to_back_uploads_while_compaction_is_scheduled(tmp_path):
+    # Every upload schedules a full compaction on the background thread
+    config = SimpleNamespace(**{**vars(CONFIG), 'COMPACT_RATIO': 0.1})
+    lsh = minhash_index(config)
+    records = [{'chunk_id': f'base_{i}', 'category': 'base', 'file_path': f'base/{i}.txt',
+                'content': f'base chunk number {i} explains home hemodialysis training and supplies'}
+               for i in range(20)]
+    append_segment(tmp_path, records, np.random.default_rng(0).standard_normal((20, DIM)), config)
+
+    for upload_id in range(3):
+        # Re-uploads of two base chunks plus one new chunk
+        texts = [records[3]['content'], records[7]['content'], f'new chunk {upload_id} about clinic hours']
+        matches, offset, names = find_layout_duplicates(tmp_path, lsh.signatures(texts), config)
+        assert sorted(match.row - offset for match in matches) == [0, 1]
+        assert all(names[match.duplicate_of].startswith('base/') for match in matches)
+
+        new_records = [{'chunk_id': f'upload{upload_id}_0', 'category': f'upload-{upload_id}',
+                        'file_path': f'upload-{upload_id}/0.txt', 'content': texts[2]}]
+        append_segment(tmp_path, new_records, np.random.default_rng(upload_id + 1).standard_normal((1, DIM)),
+                       config, signatures=lsh.signatures(texts[2:]))
+
+    if segments._compaction_thread is not None:
+        segments._compaction_thread.join()
+    assert sorted(set(live_categories(tmp_path))) == ['base', 'upload-0', 'upload-1', 'upload-2']
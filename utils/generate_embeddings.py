@@ -1,25 +1,57 @@
 import os
-import json
-import torch
+import sys
+import time
 import numpy as np
-from sentence_transformers import SentenceTransformer
+from contextlib import contextmanager
+from typing import Dict, List, Optional, Tuple
 from tqdm import tqdm
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from backend.utils.embedding_cache import EmbeddingCache, cache_namespace
+from backend.utils.encoders import EncodePool, load_encoder, model_revision
+from backend.utils.near_duplicates import MinHashLSH, find_near_duplicates, save_signatures
+from backend.utils.streaming_writer import JsonArrayWriter, NpyRowWriter
+from backend.utils.vector_index import normalize_rows
+
 class EmbeddingGenerator:
     """
     A class to generate embeddings for text chunks using sentence-transformers.
     """
     
-    def __init__(self, model_name: str = 'all-MiniLM-L6-v2'):
+    def __init__(self, model_name: str = 'all-MiniLM-L6-v2', backend: str = 'torch',
+                 onnx_dir: str = None, quantized: bool = False, batch_size: int = 64,
+                 workers: int = 0, cache_dir: str = None, cache_max_entries: int = 0):
         """
         Initialize the embedding generator.
         
         Args:
             model_name: Name of the pre-trained model from sentence-transformers
+            backend: 'torch' or 'onnx' (onnxruntime)
+            onnx_dir: Base directory for exported ONNX models
+            quantized: Use the int8 dynamically quantized ONNX model
+            batch_size: Chunks per forward pass
+            workers: Encoder processes for large runs (0 or 1 encodes in this process)
+            cache_dir: Directory of the content-hash embedding cache (None disables it)
+            cache_max_entries: Entries the cache keeps when its shards are merged (0 = unbounded)
         """
         self.model_name = model_name
-        self.model = SentenceTransformer(model_name)
-        print(f"Loaded model: {model_name}")
+        self.backend = backend
+        self.onnx_dir = onnx_dir
+        self.quantized = quantized
+        self.batch_size = batch_size
+        self.workers = workers
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self._encoder = None
+        self._pool = None
+    
+    @property
+    def encoder(self):
+        """In-process encoder, loaded on first use (pool runs never need it)."""
+        if self._encoder is None:
+            self._encoder = load_encoder(self.model_name, self.backend, self.onnx_dir, quantized=self.quantized)
+            print(f"Loaded model: {self.model_name} ({self.backend})")
+        return self._encoder
     
     def generate_embedding(self, text: str) -> np.ndarray:
         """
@@ -31,123 +63,205 @@ class EmbeddingGenerator:
         Returns:
             Numpy array containing the embedding
         """
-        with torch.no_grad():
-            embedding = self.model.encode(text, show_progress_bar=False)
-        # Handle both Tensor and numpy array return types
-        if isinstance(embedding, torch.Tensor):
-            return embedding.cpu().numpy()
-        return embedding  # Already a numpy array
+        return self.encoder.encode([text])[0]
     
-    def process_chunks_directory(self, chunks_dir: str, output_dir: str):
+    def generate_embeddings(self, texts: List[str]) -> np.ndarray:
         """
-        Process all chunks in a directory structure and generate embeddings.
+        Generate embeddings for many texts, reusing cached embeddings of unchanged text.
         
         Args:
-            chunks_dir: Directory containing chunk files
-            output_dir: Directory to save embeddings
+            texts: Input texts to embed
+            
+        Returns:
+            Numpy array of shape (len(texts), dim), in the order of texts
         """
-        # Create embeddings directory if it doesn't exist
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # Dictionary to store all embeddings and metadata
-        all_embeddings = {}
+        cache = self._open_cache() if self.cache_dir else None
+        with self._encoder_pool(len(texts)):
+            embeddings = cache.embed(texts, self._encode) if cache is not None else self._encode(texts)
+        if cache is not None:
+            self._finish_cache(cache, len(texts))
+        return embeddings
+    
+    def _open_cache(self) -> EmbeddingCache:
+        """Cache for the exact model weights in use (loading the model once if it is not on disk yet)."""
+        revision = model_revision(self.model_name, self.backend, self.onnx_dir, self.quantized)
+        if revision is None:
+            # Downloads (or exports) the model, after which its revision can be read
+            self.encoder
+            revision = model_revision(self.model_name, self.backend, self.onnx_dir, self.quantized)
+        if revision is None:
+            print(f"Warning: could not determine the revision of {self.model_name}; "
+                  f"cached embeddings are keyed by model name only")
+            revision = 'unknown'
+        return EmbeddingCache(self.cache_dir, cache_namespace(self.model_name, revision,
+                                                              self.backend, self.quantized),
+                              max_entries=self.cache_max_entries)
+    
+    @staticmethod
+    def _finish_cache(cache: EmbeddingCache, total: int, merge: bool = False):
+        """Persist newly encoded entries (merging the shards if asked or over the bound) and report the hit rate."""
+        cache.save()
+        if merge or (cache.max_entries and len(cache) > cache.max_entries):
+            cache.merge()
+        stats = cache.stats()
+        print(f"Embedding cache: {stats['hits']}/{total} hits ({stats['hit_rate']:.1%}), "
+              f"{stats['misses']} chunks encoded, {stats['entries']} cached")
+    
+    @contextmanager
+    def _encoder_pool(self, total: int):
+        """Run the encodes inside this block on a worker pool, if the run is large enough for one."""
+        # A pool only pays off once every worker gets several batches (each loads its own model)
+        if self.workers > 1 and total >= self.batch_size * self.workers * 4:
+            print(f"Encoding {total} chunks on {self.workers} worker processes...")
+            with EncodePool(self.model_name, self.backend, self.onnx_dir, self.quantized, self.workers) as pool:
+                self._pool = pool
+                try:
+                    yield
+                finally:
+                    self._pool = None
+        else:
+            yield
+    
+    def _encode(self, texts: List[str]) -> np.ndarray:
+        """Encode texts in batches, on the worker pool if one is running."""
+        if self._pool is not None:
+            return self._pool.encode(texts, batch_size=self.batch_size)
         
-        # Walk through the chunks directory
+        embeddings = []
+        for start in range(0, len(texts), self.batch_size):
+            embeddings.append(self.encoder.encode(texts[start:start + self.batch_size],
+                                                  batch_size=self.batch_size))
+        return np.vstack(embeddings) if embeddings else np.empty((0, 0), dtype=np.float32)
+    
+    def _embedding_dim(self, cache: Optional[EmbeddingCache]) -> int:
+        """Width of the embeddings, from the cache if it has any (otherwise the model is loaded)."""
+        if cache is not None and cache.dim is not None:
+            return cache.dim
+        return self.encoder.dim
+    
+    @staticmethod
+    def _read_chunk(file_path: str) -> str:
+        with open(file_path, 'r', encoding='utf-8') as f:
+            return f.read().strip()
+    
+    def _list_chunks(self, chunks_dir: str) -> List[Tuple[str, str, str]]:
+        """(category, chunk_id, file_path) of every non-empty chunk file, in output order."""
+        entries = []
         for root, dirs, files in os.walk(chunks_dir):
-            if not files:
-                continue
-                
             # Get the relative path to determine the topic/category
             rel_path = os.path.relpath(root, chunks_dir)
-            if rel_path == '.':
+            if not files or rel_path == '.':
                 continue
-                
-            print(f"Processing category: {rel_path}")
-            
-            # Process each chunk file in this category
-            category_embeddings = []
             
-            for file in tqdm(sorted(files), desc=f"Generating embeddings for {rel_path}"):
-                if not file.endswith('.txt'):
-                    continue
-                    
+            print(f"Processing category: {rel_path}")
+            for file in sorted(files):
                 file_path = os.path.join(root, file)
-                
-                # Create a subdirectory in the embeddings folder
-                output_subdir = os.path.join(output_dir, rel_path)
-                os.makedirs(output_subdir, exist_ok=True)
-                
-                # Read the chunk content
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    content = f.read().strip()
-                
-                if not content:
-                    continue
-                
-                # Generate embedding
-                embedding = self.generate_embedding(content)
-                
-                # Create metadata
-                chunk_data = {
-                    'chunk_id': os.path.splitext(file)[0],
-                    'category': rel_path,
-                    'file_path': file_path,
-                    'content': content,
-                    'embedding': embedding.tolist()  # Convert to list for JSON serialization
-                }
-                
-                category_embeddings.append(chunk_data)
-                
-                # Save individual embedding
-                output_file = os.path.join(output_subdir, f"{os.path.splitext(file)[0]}.json")
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    # Save without the embedding to keep the file size manageable
-                    save_data = {**chunk_data}
-                    # Remove the embedding from the individual file to save space
-                    # We'll keep them in the full embeddings file
-                    del save_data['embedding']
-                    json.dump(save_data, f, ensure_ascii=False, indent=2)
+                if file.endswith('.txt') and self._read_chunk(file_path):
+                    entries.append((rel_path, os.path.splitext(file)[0], file_path))
+        return entries
+    
+    def _drop_near_duplicates(self, entries: List[Tuple[str, str, str]],
+                              lsh: MinHashLSH) -> Tuple[List[Tuple[str, str, str]], np.ndarray, Dict]:
+        """
+        Drop chunks that nearly duplicate an earlier one, before anything is encoded.
+        
+        Args:
+            entries: (category, chunk_id, file_path) of every chunk, in output order
+            lsh: Empty MinHash index with the deduplication settings
             
-            all_embeddings[rel_path] = category_embeddings
+        Returns:
+            The kept entries, their signatures and a report like the upload path's
+        """
+        signatures = np.empty((len(entries), lsh.num_perm), dtype=np.uint32)
+        for row, (_, _, file_path) in enumerate(entries):
+            signatures[row] = lsh.signature(self._read_chunk(file_path))
+        matches = find_near_duplicates(signatures, lsh)
         
-        # Save all embeddings to a single file
-        print("Saving all embeddings to a single file...")
-        embeddings_file = os.path.join(output_dir, 'all_embeddings.json')
-        with open(embeddings_file, 'w', encoding='utf-8') as f:
-            json.dump(all_embeddings, f, ensure_ascii=False, indent=2)
+        def name(row: int) -> str:
+            return f"{entries[row][0]}/{entries[row][1]}"
         
-        # Also save embeddings in a format suitable for FAISS
-        print("Preparing data for FAISS...")
-        faiss_embeddings = []
-        faiss_metadata = []
+        duplicate_rows = {match.row for match in matches}
+        kept = [row for row in range(len(entries)) if row not in duplicate_rows]
+        report = {
+            "chunks": len(entries),
+            "duplicates_removed": len(matches),
+            "shrink_ratio": round(len(matches) / max(len(entries), 1), 4),
+            "duplicates": [
+                {"chunk": name(match.row), "duplicate_of": name(match.duplicate_of),
+                 "similarity": round(match.similarity, 3)}
+                for match in matches
+            ]
+        }
+        for duplicate in report["duplicates"]:
+            print(f"{duplicate['chunk']} ~ {duplicate['duplicate_of']} ({duplicate['similarity']:.2f})")
+        print(f"Near-duplicate detection: {len(entries)} chunks, {len(matches)} near-duplicates dropped, "
+              f"index shrank to {len(kept)} rows ({report['shrink_ratio']:.1%} smaller)")
+        return [entries[row] for row in kept], signatures[kept], report
+    
+    def process_chunks_directory(self, chunks_dir: str, output_dir: str, merge_cache: bool = False,
+                                 lsh: Optional[MinHashLSH] = None) -> Optional[Dict]:
+        """
+        Process all chunks in a directory structure and generate embeddings.
         
-        for category, embeddings in all_embeddings.items():
-            for item in embeddings:
-                faiss_embeddings.append(item['embedding'])
-                # Create metadata without the embedding
-                meta = {
-                    'chunk_id': item['chunk_id'],
-                    'category': item['category'],
-                    'file_path': item['file_path'],
-                    'content': item['content']
-                }
-                faiss_metadata.append(meta)
+        Chunks are read and encoded one slice at a time. Vectors go straight into a
+        preallocated, memory-mapped faiss/embeddings.npy and chunk records are streamed
+        into faiss/metadata.json, one record per line, so neither is held in memory.
         
-        # Save FAISS-ready data
+        Args:
+            chunks_dir: Directory containing chunk files
+            output_dir: Directory to save embeddings
+            merge_cache: Merge the embedding cache shards into one afterwards (full rebuilds)
+            lsh: Empty MinHash index to drop near-duplicate chunks with before they are
+                encoded (None keeps every chunk)
+            
+        Returns:
+            The near-duplicate report, or None if lsh was not given
+        """
         faiss_dir = os.path.join(output_dir, 'faiss')
         os.makedirs(faiss_dir, exist_ok=True)
         
-        # Save embeddings as numpy array
-        embeddings_array = np.array(faiss_embeddings, dtype=np.float32)
-        np.save(os.path.join(faiss_dir, 'embeddings.npy'), embeddings_array)
+        entries = self._list_chunks(chunks_dir)
+        dedup_report = signatures = None
+        if lsh is not None:
+            entries, signatures, dedup_report = self._drop_near_duplicates(entries, lsh)
+        cache = self._open_cache() if self.cache_dir else None
+        # Enough chunks per slice to keep every worker busy for several batches
+        slice_size = self.batch_size * max(self.workers, 1) * 16
         
-        # Save metadata
-        with open(os.path.join(faiss_dir, 'metadata.json'), 'w', encoding='utf-8') as f:
-            json.dump(faiss_metadata, f, ensure_ascii=False, indent=2)
+        start = time.perf_counter()
+        with self._encoder_pool(len(entries)), \
+                NpyRowWriter(os.path.join(faiss_dir, 'embeddings.npy'), len(entries),
+                             dim=self._embedding_dim(cache)) as vectors, \
+                JsonArrayWriter(os.path.join(faiss_dir, 'metadata.json')) as metadata:
+            for offset in tqdm(range(0, len(entries), slice_size), desc="Generating embeddings"):
+                records = [
+                    {
+                        'chunk_id': chunk_id,
+                        'category': category,
+                        'file_path': file_path,
+                        'content': self._read_chunk(file_path)
+                    }
+                    for category, chunk_id, file_path in entries[offset:offset + slice_size]
+                ]
+                texts = [record['content'] for record in records]
+                embeddings = cache.embed(texts, self._encode) if cache is not None else self._encode(texts)
+                # Unit rows on disk, as segments and compactions write them
+                vectors.append(normalize_rows(embeddings))
+                for record in records:
+                    metadata.write(record)
+        elapsed = time.perf_counter() - start
         
-        print(f"Successfully processed {len(faiss_metadata)} chunks.")
-        print(f"Embeddings saved to {output_dir}")
+        # Saved after metadata.json, so the signatures count as current for the next upload
+        if signatures is not None:
+            save_signatures(signatures, faiss_dir)
+        if cache is not None:
+            self._finish_cache(cache, len(entries), merge=merge_cache)
+        print(f"Encoded {len(entries)} chunks in {elapsed:.1f}s "
+              f"({len(entries) / max(elapsed, 1e-9):.1f} chunks/s, batch size {self.batch_size}, "
+              f"{self.workers if self.workers > 1 else 1} worker(s))")
+        print(f"Successfully processed {len(entries)} chunks.")
         print(f"FAISS-ready data saved to {faiss_dir}")
+        return dedup_report
 
 
 def main():
@@ -156,10 +270,35 @@ def main():
     embeddings_dir = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'data', 'embeddings')
     
     # Initialize embedding generator
-    embedding_generator = EmbeddingGenerator()
+    from backend.config import Config
+    embedding_generator = EmbeddingGenerator(
+        Config.EMBEDDING_MODEL,
+        backend=Config.ENCODER_BACKEND,
+        onnx_dir=Config.ONNX_MODEL_DIR,
+        quantized=Config.ONNX_QUANTIZED,
+        batch_size=Config.EMBED_BATCH_SIZE,
+        workers=Config.EMBED_WORKERS,
+        cache_dir=Config.EMBEDDING_CACHE_DIR or None,
+        cache_max_entries=Config.EMBEDDING_CACHE_MAX_ENTRIES
+    )
     
-    # Process all chunks
-    embedding_generator.process_chunks_directory(chunks_dir, embeddings_dir)
+    # The rebuild is a writer like uploads and the compactor: hold the lock so neither runs meanwhile
+    from pathlib import Path
+    from backend.utils.segments import minhash_index, reset_layout, write_lock
+    from rag_retriever import RAGRetriever
+    faiss_dir = Path(embeddings_dir) / 'faiss'
+    with write_lock(faiss_dir):
+        # Process all chunks, dropping near-duplicates before they are encoded (a full rebuild
+        # also merges the cache shards uploads appended)
+        embedding_generator.process_chunks_directory(chunks_dir, embeddings_dir, merge_cache=True,
+                                                     lsh=minhash_index(Config))
+        
+        # The rebuilt base replaces the whole knowledge base, including uploaded segments and deletes
+        reset_layout(faiss_dir, Config)
+        
+        # Build the ANN index (quantized codes included), its shards and the BM25 index now with the
+        # retriever's own loader, which persists whatever is missing, so server starts only load them
+        RAGRetriever(faiss_dir)
 
 
 if __name__ == "__main__":